@@ -0,0 +1,74 @@
+"""
+Benchmark ASCII85 decoding (base64.a85decode reference vs chunked decoder).
+
+Usage (from the project root):
+
+    python benchmarks/bench_ascii85.py               # 1 MB and 64 MB of decoded data
+    python benchmarks/bench_ascii85.py --sizes 256   # sizes in MB
+
+The reference decoder runs at well under 1 MB/s, so above --reference-max-mb
+it is timed on a sample of that size and its time is extrapolated linearly
+(marked 'est.'). Peak Python heap usage (tracemalloc, excluding the encoded
+input itself) is measured in a separate run and reported as a multiple of
+the encoded size. The chunked decoder uses NumPy when it is installed.
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from helpers import decode_ascii85, decode_ascii85_reference, np
+
+_MB = 1 << 20
+
+
+def _time(fn, data):
+    t0 = time.perf_counter()
+    out = fn(data)
+    return time.perf_counter() - t0, out
+
+
+def _peak(fn, data):
+    tracemalloc.start()
+    fn(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 64], help="Decoded sizes in MB")
+    parser.add_argument("--reference-max-mb", type=int, default=1, help="Largest input decoded with the reference")
+    args = parser.parse_args()
+
+    print("numpy: {}".format("yes" if np is not None else "no"))
+    for size_mb in args.sizes:
+        raw = os.urandom(size_mb * _MB)
+        encoded = base64.a85encode(raw, adobe=True, wrapcol=80)
+        sample = base64.a85encode(raw[: min(size_mb, args.reference_max_mb) * _MB], adobe=True, wrapcol=80)
+
+        ref_sec, expected = _time(decode_ascii85_reference, sample)
+        estimated = len(sample) != len(encoded)
+        ref_sec *= len(encoded) / len(sample)
+        print("{:>6} MB  reference {:9.3f}s{:<7}  peak {:5.2f}x input (sample)".format(
+            size_mb, ref_sec, " (est.)" if estimated else "", _peak(decode_ascii85_reference, sample)))
+
+        if decode_ascii85(sample) != expected:
+            raise AssertionError("chunked output differs from reference")
+        sec, out = _time(decode_ascii85, encoded)
+        if out != raw:
+            raise AssertionError("chunked output differs from the encoded data")
+        del out
+        print("{:>6} MB  chunked   {:9.3f}s {:8.1f}x  peak {:5.2f}x input".format(
+            size_mb, sec, ref_sec / sec, _peak(decode_ascii85, encoded)))
+        del raw, encoded, sample, expected
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark layer 1 engines (reference loop, bytes.translate table, NumPy).
+
+Usage (from the project root):
+
+    python benchmarks/bench_layer1.py                  # 1 MB, 100 MB, 1 GB
+    python benchmarks/bench_layer1.py --sizes 1 16     # sizes in MB
+
+The reference loop runs at well under 10 MB/s, so above --reference-max-mb it
+is timed on a sample of that size and its time is extrapolated linearly
+(marked 'est.'). Every engine's output is checked against the reference on the
+sample before timing.
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from layers.layer1_flip_rotate import (
+    flip_and_rotate,
+    flip_and_rotate_numpy,
+    flip_and_rotate_reference,
+    np,
+)
+
+_MB = 1 << 20
+
+
+def _time(fn, data):
+    t0 = time.perf_counter()
+    out = fn(data)
+    return time.perf_counter() - t0, out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 1024], help="Input sizes in MB")
+    parser.add_argument("--reference-max-mb", type=int, default=8, help="Largest input timed with the reference loop")
+    args = parser.parse_args()
+
+    engines = [("translate", flip_and_rotate)]
+    if np is not None:
+        engines.append(("numpy", flip_and_rotate_numpy))
+
+    for size_mb in args.sizes:
+        data = os.urandom(size_mb * _MB)
+        sample = data[: min(size_mb, args.reference_max_mb) * _MB]
+
+        ref_sec, expected = _time(flip_and_rotate_reference, sample)
+        estimated = len(sample) != len(data)
+        ref_sec *= len(data) / len(sample)
+        print("{:>6} MB  reference  {:9.3f}s{}".format(size_mb, ref_sec, " (est.)" if estimated else ""))
+
+        for name, fn in engines:
+            if fn(sample) != expected:
+                raise AssertionError("{} output differs from reference".format(name))
+            sec, _ = _time(fn, data)
+            print("{:>6} MB  {:<10} {:9.3f}s  {:8.1f}x".format(size_mb, name, sec, ref_sec / sec))
+        del data, sample, expected
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark layer 6 engines (reference loop, pre-decoded dispatch loop,
+basic-block compiler).
+
+Usage (from the project root, after src/main.py has produced data/output):
+
+    python benchmarks/bench_layer6.py                # the real layer 6 program
+    python benchmarks/bench_layer6.py --repeat 20
+
+The bytecode is decoded from data/output/layer5_output.txt (override with
+--input). Each engine runs --repeat times and the best time is reported;
+every engine's output is checked against the reference first. The compiled
+engine's block cache is warm after that check, so its time excludes compiling.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from constants import OUTPUT_DIR
+from helpers import decode_ascii85, get_payload_from_layer_output
+from layers.layer6_tomtel_vm import run_tomtel_vm, run_tomtel_vm_compiled, run_tomtel_vm_reference
+
+
+def _best_time(fn, bytecode, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(bytecode)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", type=Path, default=OUTPUT_DIR / "layer5_output.txt", help="Layer 5 output holding the bytecode")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per engine (best is reported)")
+    args = parser.parse_args()
+
+    if not args.input.exists():
+        sys.exit("{} not found; run src/main.py first".format(args.input))
+    bytecode = decode_ascii85(get_payload_from_layer_output(args.input))
+
+    expected = run_tomtel_vm_reference(bytecode)
+    ref_sec = _best_time(run_tomtel_vm_reference, bytecode, args.repeat)
+    print("{} bytes of bytecode, {} bytes of output".format(len(bytecode), len(expected)))
+    print("reference  {:9.4f}s".format(ref_sec))
+
+    for name, fn in [("predecoded", run_tomtel_vm), ("compiled", run_tomtel_vm_compiled)]:
+        if fn(bytecode) != expected:
+            raise AssertionError("{} output differs from reference".format(name))
+        sec = _best_time(fn, bytecode, args.repeat)
+        print("{:<10} {:9.4f}s  {:8.1f}x".format(name, sec, ref_sec / sec))
+
+
+if __name__ == "__main__":
+    main()
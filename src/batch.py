@@ -0,0 +1,445 @@
+"""
+Batch mode: run the whole pipeline over every input file in a directory.
+
+Each input gets its own output directory (<output dir>/<input file name>/),
+so runs never share files. Two executors:
+
+  - run_batch: whole pipeline runs spread over one process pool;
+  - run_pipelined: a staged executor where each stage has its own worker
+    pool and bounded input queue, so different inputs are in different
+    layers at the same time and throughput approaches the slowest stage.
+
+Both yield one BatchResult per input; format_summary tabulates their
+per-layer timings, and .metrics holds the inputs' metrics.StageMetrics.
+The pipeline's progress lines are swallowed.
+"""
+import io
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from cache import ResultCache
+from constants import CACHE_MAX_BYTES
+from metrics import StageMetrics, StageTimer
+from orchestrator import BackgroundWriter, LayerIO, execute_stage, run_pipeline
+from stages import STAGES, STAGES_BY_NAME, get_stages
+
+BatchResult = namedtuple("BatchResult", "input output_dir timings error metrics", defaults=(None,))
+
+# longest input name shown in the summary table
+_NAME_WIDTH = 40
+
+# seconds run_pipelined waits for a result before checking its workers are alive
+_RESULT_POLL_S = 1.0
+
+
+def _run_input(input_path: Path, output_dir: Path, options: dict, cache_dir, cache_max_bytes: int) -> tuple:
+    """Worker side of run_batch: (timings, None, metrics) or (None, error message, metrics)."""
+    metrics = []
+    try:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        cache = ResultCache(cache_dir, cache_max_bytes) if cache_dir is not None else None
+        with redirect_stdout(io.StringIO()):
+            timings = run_pipeline(
+                input_path=input_path, output_dir=output_dir, cache=cache, metrics=metrics, **options
+            )
+        error = None
+    except Exception as exc:
+        timings, error = None, "{}: {}".format(type(exc).__name__, exc)
+    for record in metrics:
+        record.input = input_path.name
+    return timings, error, metrics
+
+
+def find_inputs(input_dir: Path, pattern: str = "*") -> list:
+    """Files in input_dir matching pattern, sorted by name."""
+    return sorted(path for path in Path(input_dir).glob(pattern) if path.is_file())
+
+
+def run_batch(inputs, output_dir: Path, workers: int = None, cache_dir=None, cache_max_bytes=CACHE_MAX_BYTES, **options):
+    """
+    Run the pipeline on each input file on a pool of `workers` processes
+    (default: CPU count), writing to output_dir/<input file name>/. Yields
+    BatchResult(input, output_dir, timings, error, metrics) in completion
+    order; a failing input gets timings=None and an error message, and the
+    rest of the batch is unaffected. metrics lists the StageMetrics of the
+    stages that ran, labelled with the input's file name.
+
+    options are passed on to run_pipeline (engines, in_memory, ...); with
+    cache_dir, every worker shares a ResultCache there. inputs may be any
+    iterable; at most 2 * workers are in flight at a time.
+
+    When a worker dies, the pool is replaced and the inputs that were in
+    flight are rerun one at a time, so only the one that kills its worker
+    again fails (with a BrokenProcessPool error).
+    """
+    workers = workers or os.cpu_count()
+    inputs = iter(inputs)
+    pending = {}  # future -> job: (input path, its output dir)
+    suspects = []  # jobs that were in flight when a worker died
+
+    def submit(job: tuple):
+        return pool.submit(_run_input, job[0], job[1], options, cache_dir, cache_max_bytes)
+
+    def result(future) -> tuple:
+        try:
+            return future.result()
+        except Exception as exc:
+            return None, "{}: {}".format(type(exc).__name__, exc), []
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            if suspects:
+                # every future of the broken pool has failed or finished by now
+                wait(pending)
+                for future, job in list(pending.items()):
+                    del pending[future]
+                    if isinstance(future.exception(), BrokenProcessPool):
+                        suspects.append(job)
+                    else:
+                        yield BatchResult(*job, *result(future))
+                pool.shutdown()
+                pool = ProcessPoolExecutor(max_workers=workers)
+                while suspects:
+                    job = suspects.pop(0)
+                    future = submit(job)
+                    if isinstance(future.exception(), BrokenProcessPool):  # this one kills its worker
+                        pool.shutdown()
+                        pool = ProcessPoolExecutor(max_workers=workers)
+                    yield BatchResult(*job, *result(future))
+
+            for input_path in inputs:
+                input_path = Path(input_path)
+                job = (input_path, Path(output_dir) / input_path.name)
+                try:
+                    pending[submit(job)] = job
+                except BrokenProcessPool:
+                    suspects.append(job)
+                    break
+                if len(pending) >= 2 * workers:
+                    break
+            if suspects:
+                continue
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = pending.pop(future)
+                if isinstance(future.exception(), BrokenProcessPool):
+                    suspects.append(job)
+                else:
+                    yield BatchResult(*job, *result(future))
+    finally:
+        pool.shutdown()
+
+
+class _JobWrites:
+    """
+    One run_pipelined input's writes through the shared BackgroundWriter,
+    counted so the input can wait for its files and see its own first error.
+    """
+
+    def __init__(self, writer: BackgroundWriter):
+        self._writer = writer
+        self._done = threading.Condition()
+        self._pending = 0
+        self.error = None
+
+    def write(self, path, data):
+        with self._done:
+            self._pending += 1
+        self._writer.write(path, data, self._finished)
+
+    def _finished(self, error):
+        with self._done:
+            self._pending -= 1
+            if error is not None and self.error is None:
+                self.error = error
+            self._done.notify_all()
+
+    def wait(self):
+        """Wait until every queued write is on disk; returns the first write error, or None."""
+        with self._done:
+            self._done.wait_for(lambda: self._pending == 0)
+        return self.error
+
+
+class _Job:
+    """One input travelling through run_pipelined."""
+
+    __slots__ = ("input", "output_dir", "layer_io", "writes", "timings", "metrics", "error", "t0")
+
+    def __init__(self, input_path, output_dir, keep_intermediates, writer):
+        self.input = input_path
+        self.output_dir = output_dir
+        self.writes = _JobWrites(writer)
+        self.layer_io = LayerIO(True, keep_intermediates, output_dir, input_path, writer=self.writes)
+        self.timings = {}
+        self.metrics = []
+        self.error = None
+        self.t0 = None  # set when the input enters the first stage
+
+
+def _call_engine(stage_name: str, engine: str, data) -> tuple:
+    """
+    Process-pool side of a run_pipelined stage: run one engine with its
+    prints swallowed; returns (output, CPU seconds).
+    """
+    cpu0 = time.process_time()
+    with redirect_stdout(io.StringIO()):
+        output = STAGES_BY_NAME[stage_name].engines[engine](data)
+    return output, time.process_time() - cpu0
+
+
+def _in_pool(pool, stage_name: str, engine: str):
+    """
+    Transform that runs the engine in pool (memoryviews and mmaps are copied
+    to bytes); its .cpu_s is the worker's CPU time for the last call.
+    """
+
+    def transform(data):
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(data)
+        output, transform.cpu_s = pool.submit(_call_engine, stage_name, engine, data).result()
+        return output
+
+    transform.cpu_s = 0.0
+    return transform
+
+
+def _pool_context():
+    """
+    multiprocessing context for run_pipelined's pools. Their workers start
+    while the stage threads run, and fork() in a multi-threaded process can
+    deadlock, so use forkserver where there is one (the default elsewhere).
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+
+
+def parse_stage_workers(specs) -> dict:
+    """Parse 'stage=N' specs (e.g. ["layer6=2"]) into {stage name: N}."""
+    workers = {}
+    for spec in specs or ():
+        name, sep, count = spec.partition("=")
+        if not sep or not count.isdigit() or int(count) < 1:
+            raise ValueError("Stage workers spec {!r} is not of the form stage=N (N >= 1)".format(spec))
+        get_stages([name])
+        workers[name] = int(count)
+    return workers
+
+
+def run_pipelined(
+    inputs,
+    output_dir: Path,
+    workers: int = 1,
+    stage_workers=None,
+    queue_size: int = 2,
+    cache_dir=None,
+    cache_max_bytes=CACHE_MAX_BYTES,
+    stages=None,
+    engines=None,
+    profile_vm=False,
+    keep_intermediates=False,
+):
+    """
+    Staged executor: every stage gets its own pool of n workers (`workers`,
+    or stage_workers[stage name]) fed by a bounded queue of queue_size * n
+    inputs, so while one input is in layer 6 the next can be in layer 5.
+    Stages with pool='process' (GIL-bound Python) run their transform on a
+    process pool, the others on threads; layers are chained in memory and
+    files are written by one shared background writer. Full queues block
+    the stage before them, which keeps memory bounded.
+
+    Yields BatchResult(input, output_dir, timings, error, metrics) in
+    completion order, like run_batch; stages, engines, profile_vm,
+    keep_intermediates and the cache are as for run_pipeline/run_batch.
+    Timings are per stage, and "total" is the input's time from entering
+    the first stage to leaving the last, queueing included; an input is
+    yielded once its files are on disk. An error in a stage, or in writing
+    one of the input's files, fails only that input; if every worker exits
+    without finishing the batch, RuntimeError is raised.
+    """
+    selected = get_stages(stages)
+    engines = dict(engines or {})
+    if profile_vm:
+        engines["layer6"] = "profile"
+    stage_workers = stage_workers or {}
+    counts = [stage_workers.get(stage.name, workers or 1) for stage in selected]
+
+    # queues[i] feeds stage i; the last one collects finished jobs (unbounded:
+    # results are small). None is the end marker, one per worker.
+    queues = [queue.Queue(queue_size * n) for n in counts] + [queue.Queue()]
+    remaining = list(counts)
+    lock = threading.Lock()
+    abort = threading.Event()
+    cache = ResultCache(cache_dir, cache_max_bytes) if cache_dir is not None else None
+    writer = BackgroundWriter(max_pending=queue_size * max(counts))
+    context = _pool_context()
+    pools = [
+        ProcessPoolExecutor(max_workers=n, mp_context=context) if s.pool == "process" else None
+        for s, n in zip(selected, counts)
+    ]
+
+    def stage_worker(i: int) -> None:
+        stage = selected[i]
+        engine = engines.get(stage.name) or stage.default
+        transform = _in_pool(pools[i], stage.name, engine) if pools[i] is not None else None
+        inbox, outbox = queues[i], queues[i + 1]
+        try:
+            while True:
+                job = inbox.get()
+                if job is None:
+                    break
+                if i == 0:
+                    job.t0 = time.perf_counter()
+                if job.error is None and not abort.is_set():
+                    try:
+                        record = StageMetrics(stage, engine, job.input.name)
+                        with StageTimer(record, time.thread_time):  # other stages run meanwhile
+                            execute_stage(stage, engine, job.layer_io, cache, transform, record)
+                        if transform is not None and not record.cached:
+                            record.cpu_s += transform.cpu_s  # spent in the pool, not this thread
+                        job.timings[stage.name] = record.wall_s
+                        job.metrics.append(record)
+                    except BaseException as exc:  # e.g. SystemExit from an engine: fail this input only
+                        job.error = "RuntimeError: Step {} (Process layer {}) failed: {}".format(
+                            i + 1, stage.layer_num, str(exc) or type(exc).__name__
+                        )
+                if i == len(selected) - 1:
+                    write_error = job.writes.wait()
+                    if write_error is not None and job.error is None:
+                        job.error = "{}: {}".format(type(write_error).__name__, write_error)
+                    job.timings["total"] = time.perf_counter() - job.t0
+                outbox.put(job)
+        finally:
+            # the last worker of a stage passes the end markers on, even if it died
+            with lock:
+                remaining[i] -= 1
+                last = remaining[i] == 0
+            if last:
+                for _ in range(counts[i + 1] if i + 1 < len(selected) else 1):
+                    outbox.put(None)
+
+    feed_errors = []
+
+    def feed() -> None:
+        try:
+            for input_path in inputs:
+                if abort.is_set():
+                    break
+                input_path = Path(input_path)
+                run_dir = Path(output_dir) / input_path.name
+                job = _Job(input_path, run_dir, keep_intermediates, writer)
+                try:
+                    run_dir.mkdir(parents=True, exist_ok=True)
+                except OSError as exc:
+                    job.error = "{}: {}".format(type(exc).__name__, exc)
+                queues[0].put(job)
+        except BaseException as exc:  # a failing inputs iterable ends the batch
+            feed_errors.append(exc)
+        finally:
+            for _ in range(counts[0]):
+                queues[0].put(None)
+
+    threads = [threading.Thread(target=feed, name="batch-feed", daemon=True)]
+    for i, stage in enumerate(selected):
+        for k in range(counts[i]):
+            name = "batch-{}-{}".format(stage.name, k)
+            threads.append(threading.Thread(target=stage_worker, args=(i,), name=name, daemon=True))
+    for thread in threads:
+        thread.start()
+
+    results = queues[-1]
+
+    def next_result():
+        """Next finished job, or None at the end; raises if the workers all exited without one."""
+        while True:
+            try:
+                return results.get(timeout=_RESULT_POLL_S)
+            except queue.Empty:
+                if not any(thread.is_alive() for thread in threads):
+                    try:
+                        return results.get_nowait()
+                    except queue.Empty:
+                        raise RuntimeError("Pipelined batch workers exited before finishing the batch") from None
+
+    finished = False
+    try:
+        while True:
+            job = next_result()
+            if job is None:
+                finished = True
+                break
+            timings = job.timings if job.error is None else None
+            yield BatchResult(job.input, job.output_dir, timings, job.error, job.metrics)
+    finally:
+        if not finished:
+            # stopped early: let the workers skip what is left, then drain
+            abort.set()
+            try:
+                while next_result() is not None:
+                    pass
+            except RuntimeError:
+                pass  # no workers left to drain
+        for thread in threads:
+            thread.join()
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown()
+        writer.close()
+    if feed_errors:
+        raise feed_errors[0]
+
+
+def format_summary(results, wall_time: float) -> str:
+    """Table of per-input, per-layer timings (seconds), with means and throughput."""
+    results = sorted(results, key=lambda r: r.input.name)
+    names = [stage.name for stage in STAGES] + ["total"]
+    width = min(_NAME_WIDTH, max([len(r.input.name) for r in results] + [len("input")]))
+    row = "{:<" + str(width) + "}" + "  {:>8}" * len(names)
+    lines = [row.format("input", *names)]
+
+    ok = [r for r in results if r.error is None]
+    for r in results:
+        label = r.input.name[:width]
+        if r.error is not None:
+            lines.append("{:<{}}  FAILED: {}".format(label, width, r.error))
+        else:
+            lines.append(row.format(label, *("{:.3f}".format(r.timings[n]) if n in r.timings else "-" for n in names)))
+    if ok:
+        means = []
+        for n in names:
+            values = [r.timings[n] for r in ok if n in r.timings]
+            means.append("{:.3f}".format(sum(values) / len(values)) if values else "-")
+        lines.append(row.format("mean", *means))
+    lines.append(
+        "{} ok, {} failed in {:.3f}s ({:.1f} inputs/s)".format(
+            len(ok), len(results) - len(ok), wall_time, len(results) / wall_time if wall_time else 0.0
+        )
+    )
+    return "\n".join(lines)
+
+
+def process_directory(input_dir: Path, output_dir: Path, pattern: str = "*", runner=run_batch, **kwargs) -> list:
+    """
+    Run the pipeline over every file in input_dir with runner (run_batch or
+    run_pipelined, which take kwargs), print the summary table and return
+    the BatchResults sorted by input name.
+    """
+    inputs = find_inputs(input_dir, pattern)
+    if not inputs:
+        raise ValueError("No input files matching {!r} in {}".format(pattern, input_dir))
+    print("Processing {} inputs from {}...".format(len(inputs), input_dir))
+    t0 = time.perf_counter()
+    results = sorted(runner(inputs, output_dir, **kwargs), key=lambda r: r.input.name)
+    print(format_summary(results, time.perf_counter() - t0))
+    return results
@@ -0,0 +1,86 @@
+"""
+Content-addressed on-disk cache of stage outputs.
+
+A result is stored under the SHA-256 of the stage name, engine, stage version
+and the stage's raw input bytes, so a hit means the stage would produce the
+same output again and can be skipped. Hits are returned memory-mapped.
+
+Entries are <key>.bin files in the cache directory. A file's mtime records
+its last use; once the total size exceeds max_bytes, the least recently used
+entries are deleted.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from constants import CACHE_MAX_BYTES
+from helpers import map_file
+
+
+class ResultCache:
+    """LRU-capped, content-addressed store of stage outputs; counts hits and misses."""
+
+    def __init__(self, directory: Path, max_bytes: int = CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(stage, engine: str, data) -> str:
+        """Cache key of running stage's engine on raw input data (any bytes-like)."""
+        h = hashlib.sha256("{}\0{}\0{}\0".format(stage.name, engine, stage.version).encode("ascii"))
+        h.update(data)
+        return h.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / (key + ".bin")
+
+    def get(self, key: str):
+        """Cached output for key, memory-mapped, or None; a hit marks the entry as recently used."""
+        path = self._path(key)
+        try:
+            data = map_file(path)
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key: str, data) -> None:
+        """Store data under key, then evict least recently used entries beyond max_bytes."""
+        if len(data) > self.max_bytes:
+            return  # would evict everything, itself included
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file and rename, so readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        total = 0
+        for path in self.directory.glob("*.bin"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:  # removed by a concurrent run
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -14,6 +14,12 @@ _PROJECT_ROOT = Path(__file__).resolve().parent.parent
 DATA_DIR = _PROJECT_ROOT / "data"
 INPUT_DIR = DATA_DIR / "input"
 OUTPUT_DIR = DATA_DIR / "output"
+CACHE_DIR = DATA_DIR / "cache"
+
+# -----------------------------------------------------------------------------
+# Result cache (stage outputs, least recently used evicted beyond this size)
+# -----------------------------------------------------------------------------
+CACHE_MAX_BYTES = 256 << 20
 
 # -----------------------------------------------------------------------------
 # Payload extraction (layer output files)
@@ -5,53 +5,268 @@ Used by layers and orchestrator. Kept at src level (with constants) as
 cross-cutting project utilities, not layer logic.
 """
 import base64
+import mmap
 import struct
 from pathlib import Path
 
+try:
+    import numpy as np
+except ImportError:  # optional dependency: groups are decoded in pure Python instead
+    np = None
+
 from constants import ASCII85_MARKER, ASCII85_MARKER_END, PAYLOAD_MARKER
 
+# payload markers as bytes, for searching mapped files
+_PAYLOAD_MARKER = PAYLOAD_MARKER.encode("ascii")
+_ASCII85_MARKER = ASCII85_MARKER.encode("ascii")
+_ASCII85_MARKER_END = ASCII85_MARKER_END.encode("ascii")
+
+# -----------------------------------------------------------------------------
+# Adobe ASCII85
+# -----------------------------------------------------------------------------
+
+# ignored anywhere in the encoded text (as base64.a85decode does)
+_A85_WHITESPACE = b" \t\n\r\v"
+
+# the 85 digit characters '!'..'u'
+_A85_ALPHABET = bytes(range(33, 118))
+
+# translation table: character -> digit value (only meaningful for the alphabet)
+_A85_DIGITS = bytes((b - 33) & 0xFF for b in range(256))
+
+# encoded bytes handed to the decoder per step by decode_ascii85 / decode_ascii85_stream
+_A85_CHUNK_SIZE = 1 << 20
+
+# digit runs at least this long are decoded with NumPy when it is installed
+_A85_NUMPY_MIN = 1 << 14
+
+
+def _decode_a85_groups(chars: bytes) -> bytes:
+    """Decode complete 5-character groups (no whitespace, 'z' or markers)."""
+    invalid = chars.translate(None, _A85_ALPHABET)
+    if invalid:
+        raise ValueError("Non-Ascii85 digit found: {}".format(chr(invalid[0])))
+    digits = chars.translate(_A85_DIGITS)
+    if np is not None and len(digits) >= _A85_NUMPY_MIN:
+        groups = np.frombuffer(digits, dtype=np.uint8).reshape(-1, 5)
+        # Horner's rule in place: one uint64 per group, not per digit
+        values = groups[:, 0].astype(np.uint64)
+        for i in range(1, 5):
+            values *= 85
+            values += groups[:, i]
+        if values.size and values.max() > 0xFFFFFFFF:
+            raise ValueError("Ascii85 overflow")
+        return values.astype(">u4").tobytes()
+    # one strided slice per digit position; zip walks the groups at C speed
+    values = [
+        a * 52200625 + b * 614125 + c * 7225 + d * 85 + e
+        for a, b, c, d, e in zip(digits[0::5], digits[1::5], digits[2::5], digits[3::5], digits[4::5])
+    ]
+    try:
+        return struct.pack(">{}I".format(len(values)), *values)
+    except struct.error:
+        raise ValueError("Ascii85 overflow") from None
+
 
-def decode_ascii85(payload: bytes) -> bytes:
+class Ascii85Decoder:
+    """
+    Incremental Adobe ASCII85 decoder: feed() encoded chunks of any size and
+    get back the bytes decoded so far, then call finish() for the partial
+    final group. Handles an optional leading '<~', the 'z' shortcut,
+    whitespace anywhere and the closing '~>' (only whitespace may follow it).
+    Memory use is bounded by the chunk size, not by the whole text.
+    """
+
+    def __init__(self):
+        self._head = b""    # first bytes, until a leading '<~' can be recognised
+        self._started = False
+        self._carry = b""   # digits of an incomplete group (fewer than 5)
+        self._tail = None   # everything from the closing '~' on
+
+    def feed(self, chunk) -> bytes:
+        chunk = bytes(chunk)
+        if self._tail is not None:
+            self._tail += chunk
+            self._check_tail()
+            return b""
+        if not self._started:
+            chunk = self._head + chunk
+            if len(chunk) < 2:
+                self._head = chunk
+                return b""
+            self._head = b""
+            self._started = True
+            if chunk.startswith(b"<~"):
+                chunk = chunk[2:]
+        end = chunk.find(b"~")
+        if end != -1:
+            self._tail = chunk[end:]
+            self._check_tail()
+            chunk = chunk[:end]
+        return self._decode(chunk)
+
+    def finish(self) -> bytes:
+        if not self._started:
+            self.feed(b"")  # a stream shorter than 2 bytes
+        if self._tail is None or not self._tail.startswith(b"~>"):
+            raise ValueError("Ascii85 encoded byte sequences must end with b'~>'")
+        carry, self._carry = self._carry, b""
+        if not carry:
+            return b""
+        # pad the partial group with 'u' (digit 84) and drop the padding bytes
+        return _decode_a85_groups(carry + b"u" * (5 - len(carry)))[: len(carry) - 1]
+
+    def _check_tail(self) -> None:
+        tail = self._tail
+        if tail[:2] not in (b"~", b"~>") or tail[2:].translate(None, _A85_WHITESPACE):
+            # only whitespace may follow the end marker
+            raise ValueError("Ascii85 encoded byte sequences must end with b'~>'")
+
+    def _decode(self, chunk: bytes) -> bytes:
+        data = self._carry + chunk.translate(None, _A85_WHITESPACE)
+        # 'z' stands for a whole group of zero bytes, so it must sit on a group boundary
+        *full, last = data.split(b"z")
+        out = []
+        for part in full:
+            if len(part) % 5:
+                raise ValueError("z inside Ascii85 5-tuple")
+            out.append(_decode_a85_groups(part))
+            out.append(b"\x00\x00\x00\x00")
+        whole = len(last) - len(last) % 5
+        out.append(_decode_a85_groups(last[:whole]))
+        self._carry = last[whole:]
+        return b"".join(out)
+
+
+def iter_decode_ascii85(chunks):
+    """Decode an iterable of Adobe ASCII85 chunks, yielding decoded bytes as they become available."""
+    decoder = Ascii85Decoder()
+    for chunk in chunks:
+        out = decoder.feed(chunk)
+        if out:
+            yield out
+    out = decoder.finish()
+    if out:
+        yield out
+
+
+def decode_ascii85(payload) -> bytearray:
     """
     Decode Adobe ASCII85-encoded bytes to raw bytes.
 
-    Uses adobe=True so that the text markers <~ and ~> are handled; input is
-    expected to include those delimiters when taken from layer output files.
+    <~ and ~> are handled; input is expected to include those delimiters when
+    taken from layer output files. Any bytes-like payload (e.g. a memoryview
+    of a mapped file) is decoded in _A85_CHUNK_SIZE steps into one growing
+    bytearray, so no whitespace-stripped copy of the whole text is made.
     """
+    view = memoryview(payload)
+    out = bytearray()
+    for chunk in iter_decode_ascii85(view[i : i + _A85_CHUNK_SIZE] for i in range(0, len(view), _A85_CHUNK_SIZE)):
+        out += chunk
+    return out
+
+
+def decode_ascii85_stream(src, chunk_size: int = _A85_CHUNK_SIZE) -> bytearray:
+    """Decode Adobe ASCII85 read from a binary file-like object in chunk_size reads."""
+    out = bytearray()
+    for chunk in iter_decode_ascii85(iter(lambda: src.read(chunk_size), b"")):
+        out += chunk
+    return out
+
+
+def decode_ascii85_reference(payload: bytes) -> bytes:
+    """Original whole-buffer decoder (base64.a85decode); kept as the reference for tests."""
     return base64.a85decode(payload, adobe=True)
 
 
-def get_payload_from_layer_output(path: Path):
-    """
-    Extract the ASCII85 payload block after '==[ Payload ]==' in a layer output file.
+def map_file(path: Path):
+    """Read-only mmap of a file (b"" if it is empty); valid after the file is closed."""
+    with open(path, "rb") as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty files cannot be mapped
+            return b""
+
 
-    Returns the raw ASCII85 block (including <~ and ~>) as a str. Callers must
-    decode via decode_ascii85.
+def extract_payload(data, with_explanation: bool = False, source: str = "layer output"):
     """
-    text = path.read_text(encoding="utf-8")
-    idx = text.find(PAYLOAD_MARKER)
+    Extract the ASCII85 payload block after '==[ Payload ]==' from a layer's
+    output (bytes, bytearray or mmap), as a zero-copy memoryview of the block
+    including <~ and ~>. With with_explanation=True, returns
+    (payload, explanation): the text before the payload marker, decoded as UTF-8.
+    """
+    idx = data.find(_PAYLOAD_MARKER)
     if idx == -1:
-        raise ValueError("No '==[ Payload ]' marker found in {}".format(path))
+        raise ValueError("No '==[ Payload ]' marker found in {}".format(source))
 
-    section = text[idx + len(PAYLOAD_MARKER) :]
-    start_marker = section.find(ASCII85_MARKER)
+    start_marker = data.find(_ASCII85_MARKER, idx + len(_PAYLOAD_MARKER))
     if start_marker == -1:
         raise ValueError("No '<~' marker found in payload section")
 
-    end_marker = section.find(ASCII85_MARKER_END, start_marker)
+    end_marker = data.find(_ASCII85_MARKER_END, start_marker)
     if end_marker == -1:
         raise ValueError("No '~>' marker found in payload section")
 
-    return section[start_marker : end_marker + len(ASCII85_MARKER_END)]
+    payload = memoryview(data)[start_marker : end_marker + len(_ASCII85_MARKER_END)]
+    if with_explanation:
+        return payload, bytes(data[:idx]).decode("utf-8")
+    return payload
+
+
+def get_payload_from_layer_output(path: Path, with_explanation: bool = False):
+    """
+    Extract the ASCII85 payload block after '==[ Payload ]==' in a layer output file.
 
+    The file is memory-mapped and the markers are located with mmap.find, so
+    the result is a zero-copy memoryview of the block (including <~ and ~>)
+    that goes straight into decode_ascii85. with_explanation: see extract_payload.
+    """
+    return extract_payload(map_file(path), with_explanation, source=path)
 
-def checksum(data: bytes) -> int:
-    """Standard Internet checksum used by IPv4 and UDP (RFC 791 / RFC 768)."""
-    if len(data) % 2 == 1:
-        data += b"\x00"
-    s = 0
-    for i in range(0, len(data), 2):
-        s += (data[i] << 8) + data[i + 1]
+
+def checksum(data: bytes, *more: bytes) -> int:
+    """
+    Standard Internet checksum used by IPv4 and UDP (RFC 791 / RFC 768).
+
+    Extra arguments are checksummed as if concatenated to data (e.g. UDP
+    pseudo-header, header and payload), without building the joined buffer.
+    Any bytes-like object works, including memoryview slices.
+
+    Since 2**16 == 1 (mod 0xFFFF), the 16-bit words of a buffer sum to its
+    big-endian integer value mod 0xFFFF (RFC 1071), so each part is reduced
+    with one int.from_bytes and one C-level modulo instead of a word loop.
+    """
+    value = int.from_bytes(data, "big")
+    odd = len(data) % 2
+    nonzero = value != 0
+    total = value % 0xFFFF
+    for part in more:
+        value = int.from_bytes(part, "big")
+        # appending an odd number of bytes moves earlier bytes to the other
+        # half of their words (x 256); an even number leaves them in place
+        if len(part) % 2:
+            total <<= 8
+            odd ^= 1
+        total = (total + value) % 0xFFFF
+        nonzero = nonzero or value != 0
+    if odd:
+        # pad to an even length with one zero byte
+        total = (total << 8) % 0xFFFF
+    # folded one's complement sum: a non-zero sum that is 0 (mod 0xFFFF) folds to 0xFFFF
+    s = total or (0xFFFF if nonzero else 0)
+    return (~s) & 0xFFFF
+
+
+def checksum_update(old_checksum: int, old_data: bytes, new_data: bytes) -> int:
+    """
+    Incrementally update an Internet checksum after old_data was replaced by
+    new_data (RFC 1624, eqn. 3: HC' = ~(~HC + ~m + m')).
+
+    old_data and new_data must have the same even length and start at an even
+    offset of the checksummed buffer.
+    """
+    # ~checksum(x) is the folded one's complement sum of x
+    s = ((~old_checksum) & 0xFFFF) + checksum(old_data) + ((~checksum(new_data)) & 0xFFFF)
     while s >> 16:
         s = (s & 0xFFFF) + (s >> 16)
     return (~s) & 0xFFFF
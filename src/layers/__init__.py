@@ -1,23 +1,36 @@
 """
 Layers 0–6: one module per layer. Shared utilities in src/helpers.
 """
-from helpers import decode_ascii85, get_payload_from_layer_output
+from helpers import decode_ascii85, extract_payload, get_payload_from_layer_output
 from .layer0_ascii85 import process as process_layer0
+from .layer0_ascii85 import process_stream as process_layer0_stream
 from .layer1_flip_rotate import flip_and_rotate
 from .layer2_parity import check_parity
-from .layer3_xor_dec import decrypt_xor
-from .layer4_packets import parse_packets
+from .layer3_xor_dec import decrypt_xor, detect_key_length
+from .layer4_packets import PacketFilter, ScanStats, iter_packets, parse_packets
 from .layer5_aes_ctr import decrypt_aes_256
-from .layer6_tomtel_vm import run_tomtel_vm
+from .layer6_tomtel_vm import TomtelVM, VMBudgetExceeded, VMProfile, VMResult, VMState, run_many, run_tomtel_vm
 
 __all__ = [
+    "PacketFilter",
+    "ScanStats",
+    "TomtelVM",
+    "VMBudgetExceeded",
+    "VMProfile",
+    "VMResult",
+    "VMState",
     "check_parity",
     "decode_ascii85",
     "decrypt_aes_256",
     "decrypt_xor",
+    "detect_key_length",
+    "extract_payload",
     "flip_and_rotate",
     "get_payload_from_layer_output",
+    "iter_packets",
     "parse_packets",
     "process_layer0",
+    "process_layer0_stream",
+    "run_many",
     "run_tomtel_vm",
 ]
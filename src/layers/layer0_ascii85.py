@@ -1,11 +1,19 @@
 """
 Layer 0: ASCII85 decode.
 
-Input is raw ASCII85 encoded text. Output is decoded bytes.
+Input is raw ASCII85 encoded text. Output is the decoded bytes, in the
+bytearray they were decoded into (no final copy). process_stream decodes
+straight from a binary file in fixed-size reads, so the encoded text is never
+held in memory as a whole.
 """
-from helpers import decode_ascii85
+from helpers import decode_ascii85, decode_ascii85_stream
 
 
-def process(data: bytes) -> bytes:
+def process(data: bytes) -> bytearray:
     """Decode Adobe ASCII85 to raw bytes."""
     return decode_ascii85(data)
+
+
+def process_stream(src) -> bytearray:
+    """Decode Adobe ASCII85 read from a binary file-like object."""
+    return decode_ascii85_stream(src)
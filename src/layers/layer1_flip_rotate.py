@@ -1,10 +1,43 @@
 """
 Layer 1: flip every second bit, then rotate right by 1 (per byte).
 
+The transform is a fixed byte -> byte mapping, so it is precomputed once into a
+256-entry table and applied with bytes.translate (a single C-level pass). The
+per-byte loop is kept as flip_and_rotate_reference; an optional NumPy engine
+is available when numpy is installed.
 """
+try:
+    import numpy as np
+except ImportError:  # optional dependency: only flip_and_rotate_numpy needs it
+    np = None
+
+
+def _flip_rotate_byte(byte: int) -> int:
+    # 01010101 so only even bits are flipped
+    flipped = byte ^ 0x55
+    # shift bits right by one; move the old LSB into the MSB
+    return (flipped >> 1) | ((flipped & 1) << 7)
+
+
+# translation table: _FLIP_ROTATE_TABLE[b] is the transformed value of byte b
+_FLIP_ROTATE_TABLE = bytes(_flip_rotate_byte(b) for b in range(256))
 
 
 def flip_and_rotate(data: bytes) -> bytes:
+    """Flip every second bit and rotate right by 1, via a 256-entry table."""
+    return bytes(data).translate(_FLIP_ROTATE_TABLE)
+
+
+def flip_and_rotate_numpy(data: bytes) -> bytes:
+    """Same as flip_and_rotate, using a NumPy table lookup (requires numpy)."""
+    if np is None:
+        raise ImportError("flip_and_rotate_numpy requires numpy")
+    table = np.frombuffer(_FLIP_ROTATE_TABLE, dtype=np.uint8)
+    return table[np.frombuffer(data, dtype=np.uint8)].tobytes()
+
+
+def flip_and_rotate_reference(data: bytes) -> bytes:
+    """Original per-byte loop; kept as the reference for tests and benchmarks."""
     out = bytearray()
     for byte in data:
         # 01010101 so only even bits are flipped
@@ -1,10 +1,101 @@
 """
 Layer 2: filter out bytes with incorrect odd parity, emit 7 data bits each and
 reassemble 7-bit data into bytes.
+
+A byte is valid iff its total number of 1 bits (data + parity) is even, so the
+filter is a 256-entry delete table applied with bytes.translate. Surviving
+bytes are packed 8 -> 7 in chunks: each chunk is turned into one big integer
+and the parity bits are squeezed out with shift/mask steps on 16-, 32- and
+64-bit lanes, so every step is a C-level pass. Work is linear in the input and
+extra memory is bounded by the chunk size.
 """
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency: only check_parity_numpy needs it
+    np = None
+
+# bytes with an odd number of 1 bits fail the parity check
+_INVALID_BYTES = bytes(b for b in range(256) if bin(b).count("1") % 2)
+
+# input bytes examined per pass; packing works on multiples of 8 valid bytes
+_CHUNK_SIZE = 1 << 16
+
+
+@lru_cache(maxsize=8)
+def _lane_masks(groups: int) -> tuple:
+    """Masks for _pack7, repeated once per 8-byte group."""
+
+    def rep(pattern: str) -> int:
+        return int.from_bytes(bytes.fromhex(pattern) * groups, "big")
+
+    return (
+        rep("7f7f7f7f7f7f7f7f"),  # 7 data bits per byte
+        rep("007f007f007f007f"),  # low byte of each 16-bit lane
+        rep("7f007f007f007f00"),  # high byte of each 16-bit lane
+        rep("00003fff00003fff"),  # low half of each 32-bit lane
+        rep("3fff00003fff0000"),  # high half of each 32-bit lane
+        rep("000000000fffffff"),  # low half of each 64-bit lane
+        rep("0fffffff00000000"),  # high half of each 64-bit lane
+    )
+
+
+def _pack7(valid: bytes) -> bytearray:
+    """Pack the 7 data bits of each byte (len must be a multiple of 8), MSB-first."""
+    size = len(valid)
+    m7, lo16, hi16, lo32, hi32, lo64, hi64 = _lane_masks(size // 8)
+    v = int.from_bytes(valid, "big")
+    # drop each parity bit: every byte now holds its 7 data bits
+    v = (v >> 1) & m7
+    # merge neighbours: 14 bits per 16-bit lane, 28 per 32, 56 per 64
+    v = (v & lo16) | ((v & hi16) >> 1)
+    v = (v & lo32) | ((v & hi32) >> 2)
+    v = (v & lo64) | ((v & hi64) >> 4)
+    packed = bytearray(v.to_bytes(size, "big"))
+    # the top byte of every 64-bit lane is now empty
+    del packed[::8]
+    return packed
+
+
+def _pack7_numpy(valid: bytes) -> bytes:
+    """NumPy equivalent of _pack7."""
+    bits = np.unpackbits(np.frombuffer(valid, dtype=np.uint8).reshape(-1, 1), axis=1)
+    return np.packbits(bits[:, :7]).tobytes()
+
+
+def _check_parity_with(data: bytes, pack) -> bytes:
+    out = bytearray()
+    # valid bytes left over from the previous chunk (fewer than 8)
+    carry = b""
+
+    for start in range(0, len(data), _CHUNK_SIZE):
+        valid = carry + bytes(data[start : start + _CHUNK_SIZE]).translate(None, _INVALID_BYTES)
+        whole = len(valid) - len(valid) % 8
+        if whole:
+            out += pack(valid[:whole])
+        carry = valid[whole:]
+
+    if carry:
+        # 7 * len(carry) bits remain; only complete bytes are emitted
+        out += pack(carry.ljust(8, b"\x00"))[: 7 * len(carry) // 8]
+    return bytes(out)
 
 
 def check_parity(data: bytes) -> bytes:
+    """Drop bytes with bad parity and reassemble the 7-bit data into bytes."""
+    return _check_parity_with(data, _pack7)
+
+
+def check_parity_numpy(data: bytes) -> bytes:
+    """Same as check_parity, packing with NumPy unpackbits/packbits (requires numpy)."""
+    if np is None:
+        raise ImportError("check_parity_numpy requires numpy")
+    return _check_parity_with(data, _pack7_numpy)
+
+
+def check_parity_reference(data: bytes) -> bytes:
+    """Original bit-list implementation; kept as the reference for tests."""
     out = bytearray()
     # Temporary FIFO buffer holding data bits until a full byte is formed.
     bit_buffer = []
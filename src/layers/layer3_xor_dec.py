@@ -1,9 +1,312 @@
 """
-Layer 3: Recover a repeating 32-byte XOR key and decrypt the payload.
+Layer 3: Recover a repeating XOR key (32 bytes in the challenge) and decrypt the payload.
+
+Key recovery only depends on how often each byte value occurs in a column, so
+each column is reduced to a 256-bin histogram. The English score of candidate
+key k is then sum_b hist[b] * SCORE[b ^ k], i.e. one histogram x score-matrix
+product per column (a single matrix product over all columns with NumPy).
+Decryption and the ^ 0x01 bias correction are folded into one big-integer XOR.
+
+When the key length is unknown, detect_key_length measures the coincidence
+rate between the ciphertext and copies of itself shifted by 1..max_len bytes
+(Friedman's kappa test, the pairwise form of the index of coincidence). With a
+repeating key, bytes a multiple of the key length apart share a key byte, so
+those shifts keep the plaintext's high coincidence rate while all others look
+random. Multiples of the key length are periodic too, so the strongest length
+is reduced to its smallest divisor that the byte differences do not rule out
+(see _divisor_evidence); a key with repeated bytes is partly periodic at a
+divisor, and its differing byte pairs are what give that divisor away.
 """
+import math
+from collections import Counter
+from statistics import fmean, median
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency: pure-Python histogram scoring is used instead
+    np = None
+
+
+def _score_byte(b: int) -> int:
+    if b == 32:                            # space character
+        return 5
+    if 65 <= b <= 90 or 97 <= b <= 122:    # upper/lower case letters
+        return 3
+    if b in (44, 46, 39):                  # punctuation
+        return 1
+    if 32 <= b <= 126:                     # other printable characters
+        return 0
+    return -10                             # control/non-printable characters
+
+
+# heuristic English score of a single decoded byte
+_SCORE = [_score_byte(b) for b in range(256)]
+
+if np is not None:
+    # _SCORE_MATRIX[b, k]: score of cipher byte b decoded with key byte k
+    _SCORE_MATRIX = np.array(
+        [[_SCORE[b ^ k] for k in range(256)] for b in range(256)], dtype=np.int64
+    )
+
+
+def _recover_key_python(payload: bytes, key_len: int) -> bytes:
+    key = bytearray(key_len)
+    for i in range(key_len):
+        # histogram of the bytes encrypted with key byte i
+        hist = Counter(payload[i::key_len]).items()
+        best_score, best_key = -10**9, 0
+        for k in range(256):
+            s = sum(count * _SCORE[b ^ k] for b, count in hist)
+            # strict '>' keeps the lowest key byte on ties (as the reference does)
+            if s > best_score:
+                best_score, best_key = s, k
+        key[i] = best_key
+    return bytes(key)
+
+
+def _recover_key_numpy(payload: bytes, key_len: int) -> bytes:
+    data = np.frombuffer(payload, dtype=np.uint8)
+    column = np.arange(len(data), dtype=np.int64) % key_len
+    # one 256-bin histogram per column, shape (key_len, 256)
+    hist = np.bincount(column * 256 + data, minlength=key_len * 256).reshape(key_len, 256)
+    # argmax returns the first (lowest) key byte on ties
+    return (hist @ _SCORE_MATRIX).argmax(axis=1).astype(np.uint8).tobytes()
+
+
+def recover_xor_key(payload: bytes, key_len: int) -> bytes:
+    """Recover the repeating XOR key byte-by-byte via per-column histograms."""
+    if np is not None:
+        return _recover_key_numpy(payload, key_len)
+    return _recover_key_python(payload, key_len)
+
+
+# bytes of ciphertext examined by detect_key_length
+_KEY_LEN_SAMPLE = 1 << 17
+
+# coincidence rate of two independent uniform random bytes
+_RANDOM_COINCIDENCE = 1 / 256
+
+# shifts below this are left out when testing divisors: neighbouring bytes of
+# text are correlated (doubled letters are rare, 'e ' is common), far ones not
+_MIN_DIVISOR_SHIFT = 4
+
+# a divisor of the strongest length is not the key's period if a column falls
+# below this fraction of the median column's coincidence rate at its shifts,
+_DIVISOR_MATCH = 0.75
+# ... or a shift class falls below this fraction of the rate at the strongest
+# length's multiples (plaintext structure alone can make it 0.6)
+_DIVISOR_FLOOR = 0.5
+
+# byte differences per shift that go into the difference histograms (the
+# mode test needs far fewer than the coincidence counts, and a histogram of
+# every difference dominates the pure-Python run time)
+_DIFF_HIST_SAMPLE = 1 << 12
+
+
+def _xor_shifted(value: int, n: int, shift: int, length: int) -> bytes:
+    """
+    sample[:length] ^ sample[shift : shift + length], bytewise, given
+    value = int.from_bytes(sample, "big") and n = len(sample): one big-integer
+    XOR instead of converting two slices.
+    """
+    mask = (1 << 8 * length) - 1
+    head = value >> 8 * (n - length)
+    shifted = (value >> 8 * (n - shift - length)) & mask
+    return (head ^ shifted).to_bytes(length, "big")
+
+
+def _coincidence_rates(sample: bytes, max_shift: int) -> list:
+    """rates[s] = fraction of positions i where sample[i] == sample[i + s]."""
+    n = len(sample)
+    rates = [0.0] * (max_shift + 1)
+    if np is not None:
+        data = np.frombuffer(sample, dtype=np.uint8)
+        for s in range(1, max_shift + 1):
+            rates[s] = int(np.count_nonzero(data[:-s] == data[s:])) / (n - s)
+    else:
+        value = int.from_bytes(sample, "big")
+        for s in range(1, max_shift + 1):
+            # equal bytes XOR to zero bytes; one C-level pass per shift
+            rates[s] = _xor_shifted(value, n, s, n - s).count(0) / (n - s)
+    return rates
+
+
+def _shift_classes(sample: bytes, max_shift: int, period: int) -> tuple:
+    """
+    Byte differences at shifts _MIN_DIVISOR_SHIFT..max_shift, grouped by shift
+    class r = s % period:
+      - diffs[r][v]: positions i < _DIFF_HIST_SAMPLE where
+        sample[i] ^ sample[i + s] == v;
+      - hits[r][j]: positions i in column j (i % period) where the two bytes
+        are equal;
+      - totals[r]: positions per column (whole rows of period only, so every
+        column has the same total).
+    """
+    n = len(sample)
+    diffs = [[0] * 256 for _ in range(period)]
+    hits = [[0] * period for _ in range(period)]
+    totals = [0] * period
+    if np is not None:
+        data = np.frombuffer(sample, dtype=np.uint8)
+        diff_counts = np.zeros((period, 256), dtype=np.int64)
+        hit_counts = np.zeros((period, period), dtype=np.int64)
+        for s in range(_MIN_DIVISOR_SHIFT, max_shift + 1):
+            m = (n - s) // period
+            diff = data[: m * period] ^ data[s : s + m * period]
+            diff_counts[s % period] += np.bincount(diff[:_DIFF_HIST_SAMPLE], minlength=256)
+            hit_counts[s % period] += (diff == 0).reshape(m, period).sum(axis=0)
+            totals[s % period] += m
+        diffs, hits = diff_counts.tolist(), hit_counts.tolist()
+    else:
+        value = int.from_bytes(sample, "big")
+        for s in range(_MIN_DIVISOR_SHIFT, max_shift + 1):
+            m = (n - s) // period
+            diff = _xor_shifted(value, n, s, m * period)
+            r = s % period
+            for v, count in Counter(diff[:_DIFF_HIST_SAMPLE]).items():
+                diffs[r][v] += count
+            for j in range(period):
+                hits[r][j] += diff[j::period].count(0)
+            totals[r] += m
+    return diffs, hits, totals
+
+
+def _mean_rate(rates: list, shifts) -> float:
+    """Mean coincidence rate over shifts (uniform-random rate if there are none)."""
+    selected = [rates[s] for s in shifts]
+    return fmean(selected) if selected else _RANDOM_COINCIDENCE
+
+
+def _period_contrast(rates: list, key_len: int) -> float:
+    """Mean rate at shifts aligned to key_len minus the mean rate at all others."""
+    shifts = range(1, len(rates))
+    aligned = _mean_rate(rates, (s for s in shifts if s % key_len == 0))
+    return aligned - _mean_rate(rates, (s for s in shifts if s % key_len))
+
+
+def _chance_z(count: int) -> float:
+    """Largest z-score expected by chance among count independent tests."""
+    return math.sqrt(2 * math.log(count)) if count > 1 else 1.0
+
+
+def _shortfall_z(hits: int, total: int, rate: float, fraction: float) -> float:
+    """z-score of hits / total against fraction * rate (negative: below it)."""
+    # floor the variance at the uniform-random rate, as _significance does
+    p = min(max(rate, _RANDOM_COINCIDENCE), 1 - _RANDOM_COINCIDENCE)
+    return (hits - fraction * rate * total) / math.sqrt(p * (1 - p) * total)
+
+
+def _divisor_evidence(diffs: list, hits: list, totals: list, d: int, period: int) -> float:
+    """
+    How strongly the byte differences contradict d (a divisor of period)
+    being the key's period, in units of the largest z-score expected by
+    chance (> 1: contradicted). See _shift_classes for the arguments.
+
+    At a shift that lines up equal key bytes, ciphertext differences are
+    plaintext differences, and for two independent bytes of one distribution
+    no difference is more likely than 0 (Cauchy-Schwarz). Where the key bytes
+    differ by k, the most likely difference is k instead. So d is ruled out
+    if, at the shifts that are multiples of d but not of period:
+      - some shift class's most common difference is not 0 (most of its key
+        byte pairs differ), or
+      - some column coincides well below the median column (a minority of
+        pairs differ), or
+      - some shift class coincides well below the multiples of period (its
+        pairs differ by many different amounts, so no single one stands out).
+    """
+    classes = [r for r in range(d, period, d) if totals[r]]
+    if not classes or not totals[0]:
+        return 0.0
+    mode_z = max(_excess_z(max(diffs[r][1:]), diffs[r][0]) for r in classes)
+
+    column_total = sum(totals[r] for r in classes)
+    column_hits = [sum(hits[r][j] for r in classes) for j in range(period)]
+    column_rate = median(column_hits) / column_total
+    column_z = min(_shortfall_z(h, column_total, column_rate, _DIVISOR_MATCH) for h in column_hits)
+
+    aligned = sum(hits[0]) / (totals[0] * period)
+    class_z = min(_shortfall_z(sum(hits[r]), totals[r] * period, aligned, _DIVISOR_FLOOR) for r in classes)
+    return max(
+        mode_z / _chance_z(255 * len(classes)),
+        -column_z / _chance_z(period),
+        -class_z / _chance_z(len(classes)),
+    )
+
+
+def _excess_z(count: int, reference: int) -> float:
+    """z-score of a count exceeding a reference count (both Poisson)."""
+    return (count - reference) / math.sqrt(count + reference) if count + reference else 0.0
+
+
+def _significance(rates: list, key_len: int, sample_len: int) -> float:
+    """
+    Map key_len's contrast to 0..1 by its z-score: 0 at the largest z expected
+    by chance over len(rates) - 1 candidate lengths, 1 at twice that.
+    """
+    max_shift = len(rates) - 1
+    contrast = _period_contrast(rates, key_len)
+    # floor at the uniform-random rate so a near-zero baseline cannot inflate z
+    p = max(_mean_rate(rates, (s for s in range(1, max_shift + 1) if s % key_len)), _RANDOM_COINCIDENCE)
+    # binomial standard error of the mean aligned rate under 'no period'
+    sigma = math.sqrt(p * (1 - p) / ((max_shift // key_len) * (sample_len - max_shift)))
+    return min(1.0, max(0.0, contrast / sigma / _chance_z(max_shift) - 1.0))
+
+
+def detect_key_length(payload: bytes, max_len: int = 256) -> tuple:
+    """
+    Guess the repeating-key length of an XOR ciphertext.
+
+    Returns (key_len, confidence). Confidence is in 0..1: 0 when the periodic
+    signal at key_len is no stronger than chance fluctuations over max_len
+    candidates (e.g. random bytes), 1 when it is at least twice as strong; it
+    drops as well when key_len and the strongest length are both plausible.
+    Only the first _KEY_LEN_SAMPLE bytes are examined, so cost does not grow
+    with the input.
+    """
+    sample = bytes(payload[:_KEY_LEN_SAMPLE])
+    max_len = min(max_len, len(sample) - 1)
+    if max_len < 2:
+        return 1, 0.0
+
+    rates = _coincidence_rates(sample, max_len)
+    # length 1 has no unaligned shifts to contrast with; it is found as a divisor
+    best = max(range(2, max_len + 1), key=lambda L: _period_contrast(rates, L))
+    # every multiple of the true length is periodic too (and structure in the
+    # plaintext can make one of them stand out), so take the smallest divisor
+    # of the strongest candidate that is not ruled out
+    diffs, hits, totals = _shift_classes(sample, max_len, best)
+    key_len, certainty = best, 1.0
+    for d in range(1, best):
+        if best % d:
+            continue
+        evidence = _divisor_evidence(diffs, hits, totals, d, best)
+        # evidence near 1 (barely ruled out or barely kept) leaves both d and
+        # best plausible
+        certainty = min(certainty, 2.0 * abs(evidence - 1.0))
+        if evidence <= 1.0:
+            key_len = d
+            break
+    return key_len, _significance(rates, key_len, len(sample)) * certainty
+
+
+def _xor_with_key(payload: bytes, key: bytes) -> bytes:
+    n = len(payload)
+    stream = key * (n // len(key) + 1)
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(stream[:n], "big")).to_bytes(n, "big")
+
+
+def decrypt_xor(payload: bytes, key_len: int = None) -> bytes:
+    """Recover the repeating XOR key and decrypt; key_len=None detects the length."""
+    if key_len is None:
+        key_len, _ = detect_key_length(payload)
+    key = recover_xor_key(payload, key_len)
+    # decrypt with the repeating key and correct the 1-bit bias artifact in
+    # the same pass: (c ^ k) ^ 0x01 == c ^ (k ^ 0x01)
+    return _xor_with_key(payload, bytes(k ^ 0x01 for k in key))
 
 
-def decrypt_xor(payload: bytes, key_len: int) -> bytes:
+def decrypt_xor_reference(payload: bytes, key_len: int) -> bytes:
+    """Original candidate-loop implementation; kept as the reference for tests."""
     # heuristic to score how closely a byte sequence resembles English text
     def score_english(bs: bytes) -> int:
         score = 0
@@ -1,10 +1,28 @@
 """
 Layer 5: Unwrap an AES-256 key using RFC 3394, then decrypt the payload
 using AES-256 in CTR mode.
+
+decrypt_aes_256 works on an in-memory payload; decrypt_aes_256_stream reads
+from and writes to file-like objects in fixed-size chunks with bounded memory.
+decrypt_aes_256_parallel exploits that CTR mode is seekable: the keystream for
+byte offset o starts at counter data_iv + o // 16, so 16-byte-aligned ranges
+are decrypted independently by a thread pool (cryptography releases the GIL
+inside update_into) straight into their slots of one output buffer.
 """
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
+# KEK (32) + key IV (8) + wrapped key (40) + data IV (16)
+_HEADER_SIZE = 96
+
+# ciphertext bytes decrypted per update_into call in decrypt_aes_256_stream
+_CHUNK_SIZE = 1 << 20
+
+# ciphertext bytes per task in decrypt_aes_256_parallel (a multiple of 16)
+_PARALLEL_CHUNK_SIZE = 4 << 20
+
 
 def _aes_key_unwrap_rfc3394(kek: bytes, wrapped: bytes, iv: bytes) -> bytes:
     """
@@ -47,37 +65,142 @@ def _aes_key_unwrap_rfc3394(kek: bytes, wrapped: bytes, iv: bytes) -> bytes:
     return b"".join(r)
 
 
-def decrypt_aes_256(payload: bytes) -> bytes:
-    """Orchestrates parsing, key unwrap, and payload decryption."""
+def _parse_header(header: bytes):
+    """Split the 96-byte layer 5 header into (kek, key_iv, wrapped_key, data_iv)."""
     offset = 0
 
     # extract the key encryption key (32 bytes)
-    kek = payload[offset : offset + 32]
+    kek = header[offset : offset + 32]
     offset += 32
 
     # extract the 64-bit key initialization vector (8 bytes)
-    key_iv = payload[offset : offset + 8]
+    key_iv = header[offset : offset + 8]
     offset += 8
 
     # extracts the RFC 3394-wrapped AES-256 key (40 bytes)
-    wrapped_key = payload[offset : offset + 40]
+    wrapped_key = header[offset : offset + 40]
     offset += 40
 
     # extract the 128-bit data initialization vector (16 bytes)
-    data_iv = payload[offset : offset + 16]
-    offset += 16
+    data_iv = header[offset : offset + 16]
 
-    # remaining bytes are the AES-256-CTR ciphertext.
-    ciphertext = payload[offset:]
+    return kek, key_iv, wrapped_key, data_iv
+
+
+def _unwrap_header(header: bytes):
+    """Return (aes_key, data_iv) from the 96-byte header."""
+    kek, key_iv, wrapped_key, data_iv = _parse_header(header)
 
     # unwrap the AES-256 key using RFC 3394
-    aes_key = _aes_key_unwrap_rfc3394(kek, wrapped_key, key_iv)
+    return _aes_key_unwrap_rfc3394(kek, wrapped_key, key_iv), data_iv
+
+
+def _ctr_decryptor(header: bytes):
+    """Unwrap the AES-256 key from the header and return a CTR-mode decryptor."""
+    aes_key, data_iv = _unwrap_header(header)
 
     # initializes AES-256 in Counter Mode.
-    cipher = Cipher(algorithms.AES(aes_key), modes.CTR(data_iv))
-    decryptor = cipher.decryptor()
+    return Cipher(algorithms.AES(aes_key), modes.CTR(data_iv)).decryptor()
+
+
+def decrypt_aes_256(payload: bytes) -> bytes:
+    """Orchestrates parsing, key unwrap, and payload decryption."""
+    decryptor = _ctr_decryptor(bytes(payload[:_HEADER_SIZE]))
+
+    # remaining bytes are the AES-256-CTR ciphertext (a view, not a copy)
+    ciphertext = memoryview(payload)[_HEADER_SIZE:]
+
+    # decrypt the ciphertext using the AES-256-CTR cipher; CTR is a stream
+    # mode, so finalize() yields nothing and no concatenated copy is needed
+    decrypted_payload = decryptor.update(ciphertext)
+    tail = decryptor.finalize()
+    return decrypted_payload + tail if tail else decrypted_payload
+
+
+def _read_exact(src, size: int) -> bytes:
+    """Read exactly size bytes from src (fewer only at end of stream)."""
+    data = b""
+    while len(data) < size:
+        chunk = src.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
 
-    # decrypt the ciphertext using the AES-256-CTR cipher
-    decrypted_payload = decryptor.update(ciphertext) + decryptor.finalize()
 
-    return decrypted_payload
\ No newline at end of file
+def decrypt_aes_256_stream(src, dst, chunk_size: int = _CHUNK_SIZE) -> int:
+    """
+    Streaming decrypt_aes_256: read the 96-byte header from binary file-like
+    src, then decrypt the ciphertext chunk_size bytes at a time with
+    update_into, writing each chunk to dst. One input and one output buffer
+    are reused throughout, so peak memory is about 2 * chunk_size whatever
+    the payload size. Returns the number of plaintext bytes written.
+    """
+    header = _read_exact(src, _HEADER_SIZE)
+    if len(header) < _HEADER_SIZE:
+        raise ValueError("Layer 5 payload shorter than its {}-byte header".format(_HEADER_SIZE))
+    decryptor = _ctr_decryptor(header)
+
+    in_buf = bytearray(chunk_size)
+    in_view = memoryview(in_buf)
+    # update_into may need up to block_size - 1 spare bytes (older cryptography)
+    out_view = memoryview(bytearray(chunk_size + 15))
+    total = 0
+    while True:
+        n = src.readinto(in_buf)
+        if not n:
+            break
+        written = decryptor.update_into(in_view[:n], out_view)
+        dst.write(out_view[:written])
+        total += written
+
+    tail = decryptor.finalize()
+    dst.write(tail)
+    return total + len(tail)
+
+
+def _decrypt_range(aes_key: bytes, counter: int, src: memoryview, dst: memoryview) -> None:
+    """
+    Decrypt src into dst (of the same length) with the CTR keystream starting
+    at counter. dst is never written past its end, so ranges can share a buffer.
+    """
+    iv = (counter % (1 << 128)).to_bytes(16, "big")
+    decryptor = Cipher(algorithms.AES(aes_key), modes.CTR(iv)).decryptor()
+    # update_into may need up to block_size - 1 spare bytes (older cryptography):
+    # the last block's slot is the spare space, and that block is copied in
+    head = max(0, len(src) - 16)
+    if head:
+        decryptor.update_into(src[:head], dst[: head + 15])
+    dst[head:] = decryptor.update(src[head:])
+    decryptor.finalize()
+
+
+def decrypt_aes_256_parallel(payload: bytes, workers: int = None, chunk_size: int = _PARALLEL_CHUNK_SIZE):
+    """
+    Parallel decrypt_aes_256: split the ciphertext into chunk_size ranges
+    (rounded down to a multiple of 16) and decrypt them on a thread pool of
+    `workers` threads (default: CPU count), each starting its counter at
+    data_iv + range_offset // 16. Output is byte-identical to the serial path.
+    """
+    aes_key, data_iv = _unwrap_header(bytes(payload[:_HEADER_SIZE]))
+    ciphertext = memoryview(payload)[_HEADER_SIZE:]
+    n = len(ciphertext)
+    chunk_size = max(16, chunk_size - chunk_size % 16)
+    iv_int = int.from_bytes(data_iv, "big")
+
+    out = bytearray(n)
+    out_view = memoryview(out)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [
+            pool.submit(
+                _decrypt_range,
+                aes_key,
+                iv_int + start // 16,
+                ciphertext[start : start + chunk_size],
+                out_view[start : start + chunk_size],
+            )
+            for start in range(0, n, chunk_size)
+        ]
+        for future in futures:
+            future.result()
+    return bytes(out)
@@ -2,14 +2,949 @@
 Layer 6: Tomtel Core i69 VM. Fetch-decode-execute loop over bytecode.
 Memory = bytecode; output is collected via OUT and returned when HALT. All
 values unsigned.
+
+run_tomtel_vm decodes each instruction once, on first execution, into a
+(kind, x, y, next_pc) tuple: register indices, immediates and jump targets are
+resolved up front, and the interpreter loop dispatches on the small-int kind
+with registers in a single local list. A write through the (ptr+c)
+pseudo-register drops the decoded entries of every instruction that can
+overlap the written byte (the 5 addresses ending at it), so self-modifying
+code is re-decoded on its next execution.
+
+run_tomtel_vm_compiled goes one step further: each basic block (ending at a
+jump, a write to pc, HALT or an unknown opcode) is turned into Python source
+and compile()d into one function that keeps the registers in real locals.
+Compiled blocks are cached by their code bytes, and a store into the bytes of
+a compiled block invalidates it. The original loop is kept as
+run_tomtel_vm_reference.
+
+TomtelVM adds instruction budgets, deadlines and snapshot/resume on top of
+the compiler, and run_many spreads independent programs over a process pool.
 """
+import os
+import struct
+import time
+from collections import Counter, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
 from helpers import read_u8, read_u32_le, write_u8
 
+_U32 = struct.Struct("<I")
+
+# decoded instruction kinds, roughly in order of execution frequency
+(
+    _MV, _MVI, _LOAD, _STORE, _SUB, _CMP, _JNZ, _XOR, _ADD, _OUT,
+    _JEZ, _APTR, _STOREI, _JMP, _JMPR, _DECODE, _NOP, _HALT, _BAD,
+) = range(19)
+
+# register file layout: 1..6 = a..f, 9..13 = la, lb, lc, ld, ptr
+_R32 = 8
+_PTR = _R32 + 5
+
+_HALT_INSN = (_HALT, 0, 0, 0)
+_DECODE_INSN = (_DECODE, 0, 0, 0)
+
+
+# magic, a..f, la..ptr, pc, halted, steps, len(mem), len(out)
+_STATE_HEADER = struct.Struct("<4s6B5IIBQIQ")
+_STATE_MAGIC = b"TVM1"
+
+
+class VMState:
+    """
+    Complete state of a Tomtel VM run, shared by all engines: memory,
+    registers, pc and output so far. to_bytes()/from_bytes() checkpoint it;
+    TomtelVM(state=...) resumes.
+
+    regs uses the engines' register file layout: regs[1..6] = a..f,
+    regs[9..13] = la, lb, lc, ld, ptr (32-bit values need no masking: they
+    are only ever set from immediates, other registers or a masked APTR).
+    out holds output not yet handed to an output sink (all of it without
+    one). steps counts instructions executed (TomtelVM only).
+    """
+
+    __slots__ = ("mem", "regs", "pc", "out", "halted", "steps")
+
+    def __init__(self, bytecode: bytes = b""):
+        self.mem = bytearray(bytecode)
+        self.regs = [0] * (_PTR + 1)
+        self.pc = 0
+        self.out = bytearray()
+        self.halted = False
+        self.steps = 0
+
+    def __repr__(self):
+        return "VMState(pc=0x{:X}, steps={}, halted={}, mem={} bytes, out={} bytes)".format(
+            self.pc, self.steps, self.halted, len(self.mem), len(self.out)
+        )
+
+    @property
+    def finished(self) -> bool:
+        """True after HALT or once pc has left memory."""
+        return self.halted or not 0 <= self.pc < len(self.mem)
+
+    def to_bytes(self) -> bytes:
+        """Serialize the state (header followed by memory and output)."""
+        r = self.regs
+        header = _STATE_HEADER.pack(
+            _STATE_MAGIC, *r[1:7], *r[_R32 + 1 : _PTR + 1], self.pc,
+            self.halted, self.steps, len(self.mem), len(self.out),
+        )
+        return header + bytes(self.mem) + bytes(self.out)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "VMState":
+        """Inverse of to_bytes."""
+        if len(data) < _STATE_HEADER.size:
+            raise ValueError("VM snapshot too short: {} bytes".format(len(data)))
+        fields = _STATE_HEADER.unpack_from(data)
+        if fields[0] != _STATE_MAGIC:
+            raise ValueError("Not a Tomtel VM snapshot (magic {!r})".format(fields[0]))
+        mem_len, out_len = fields[-2], fields[-1]
+        if len(data) != _STATE_HEADER.size + mem_len + out_len:
+            raise ValueError("VM snapshot length mismatch: {} bytes".format(len(data)))
+        state = cls(data[_STATE_HEADER.size : _STATE_HEADER.size + mem_len])
+        state.regs[1:7] = fields[1:7]
+        state.regs[_R32 + 1 : _PTR + 1] = fields[7:12]
+        state.pc, state.halted, state.steps = fields[12], bool(fields[13]), fields[14]
+        state.out = bytearray(data[_STATE_HEADER.size + mem_len :])
+        return state
 
-def run_tomtel_vm(bytecode: bytes) -> bytes:
+
+# OUT bytes are handed to an output sink in chunks of this size
+_FLUSH_SIZE = 1 << 16
+
+# flush threshold when there is no sink: output stays in VMState.out
+_NO_FLUSH = float("inf")
+
+
+class _OutputSink:
+    """
+    Destination for OUT bytes: a growable bytearray, a writable stream
+    (anything with .write) or a preallocated writable buffer such as a
+    memoryview. Engines buffer output in VMState.out and flush() it here.
     """
-    Run Tomtel Core i69 bytecode. Returns the output stream as bytes.
+
+    __slots__ = ("write", "written")
+
+    def __init__(self, target):
+        if isinstance(target, bytearray):
+            self.write = target.extend
+        elif hasattr(target, "write"):
+            self.write = target.write
+        else:
+            self.write = _buffer_writer(memoryview(target))
+        self.written = 0
+
+    def flush(self, out: bytearray) -> None:
+        if out:
+            self.write(out)
+            self.written += len(out)
+            del out[:]
+
+
+def _buffer_writer(view: memoryview):
+    """write() for a fixed-size buffer; ValueError once the output would not fit."""
+    if view.readonly:
+        raise TypeError("output buffer is read-only")
+    view = view.cast("B")
+    pos = 0
+
+    def write(chunk) -> None:
+        nonlocal pos
+        end = pos + len(chunk)
+        if end > len(view):
+            raise ValueError("VM output exceeds the {}-byte output buffer".format(len(view)))
+        view[pos:end] = chunk
+        pos = end
+
+    return write
+
+
+def _output(state: VMState, sink: _OutputSink):
+    """Engine result: the output bytes, or with a sink the number of bytes written."""
+    if sink is None:
+        return bytes(state.out)
+    sink.flush(state.out)
+    return sink.written
+
+
+def _decode(mem, pc: int) -> tuple:
+    """Decode the instruction at pc into (kind, x, y, next_pc)."""
+    n = len(mem)
+    op = mem[pc]
+    if op == 0x01:  # HALT
+        return _HALT_INSN
+    if op == 0x02:
+        return (_OUT, 0, 0, pc + 1)
+    if op == 0xC1:
+        return (_CMP, 0, 0, pc + 1)
+    if op == 0xC2:
+        return (_ADD, 0, 0, pc + 1)
+    if op == 0xC3:
+        return (_SUB, 0, 0, pc + 1)
+    if op == 0xC4:
+        return (_XOR, 0, 0, pc + 1)
+    if op == 0xE1:  # APTR imm8
+        if pc + 2 > n:
+            return _HALT_INSN
+        return (_APTR, mem[pc + 1], 0, pc + 2)
+    if op == 0x21 or op == 0x22:  # JEZ / JNZ imm32; targets past the end stop at n
+        if pc + 5 > n:
+            return _HALT_INSN
+        target = min(_U32.unpack_from(mem, pc + 1)[0], n)
+        return (_JEZ if op == 0x21 else _JNZ, target, 0, pc + 5)
+
+    dest = (op >> 3) & 7
+    src = op & 7
+    if (op >> 6) == 0b01:  # MV / MVI
+        if src == 0:
+            if pc + 2 > n:
+                return _HALT_INSN
+            imm8 = mem[pc + 1]
+            if dest == 7:
+                return (_STOREI, imm8, 0, pc + 2)
+            if dest == 0:
+                return (_NOP, 0, 0, pc + 2)
+            return (_MVI, dest, imm8, pc + 2)
+        # (ptr+c) <- (ptr+c) rewrites the same byte (or nothing, out of bounds)
+        if dest == 0 or (dest == 7 and src == 7):
+            return (_NOP, 0, 0, pc + 1)
+        if dest == 7:
+            return (_STORE, src, 0, pc + 1)
+        if src == 7:
+            return (_LOAD, dest, 0, pc + 1)
+        return (_MV, dest, src, pc + 1)
+    if (op >> 6) == 0b10:  # MV32 / MVI32; dest 6 (pc) is a jump
+        if src == 0:
+            if pc + 5 > n:
+                return _HALT_INSN
+            imm32 = _U32.unpack_from(mem, pc + 1)[0]
+            if dest == 6:
+                return (_JMP, min(imm32, n), 0, 0)
+            if dest == 0 or dest == 7:
+                return (_NOP, 0, 0, pc + 5)
+            return (_MVI, _R32 + dest, imm32, pc + 5)
+        if dest == 0 or dest == 7:
+            return (_NOP, 0, 0, pc + 1)
+        # reading pc yields this instruction's address; (ptr+c) reads as 0
+        if src == 6 or src == 7:
+            value = pc if src == 6 else 0
+            if dest == 6:
+                return (_JMP, min(value, n), 0, 0)
+            return (_MVI, _R32 + dest, value, pc + 1)
+        if dest == 6:
+            return (_JMPR, _R32 + src, 0, 0)
+        return (_MV, _R32 + dest, _R32 + src, pc + 1)
+    return (_BAD, op, 0, 0)
+
+
+def run_tomtel_vm(
+    bytecode: bytes,
+    profile: "VMProfile" = None,
+    trace: int = 0,
+    max_steps: int = None,
+    timeout: float = None,
+    out=None,
+):
     """
+    Run Tomtel Core i69 bytecode. Returns the output stream as bytes or,
+    when out is given, writes it there while the program runs and returns
+    the number of bytes written. out may be a bytearray (extended), a
+    writable stream or a preallocated writable buffer / memoryview.
+
+    Passing a VMProfile (or trace=N) runs a separate, slower profiling loop
+    that fills in the profile and, with trace=N, appends the last N executed
+    instructions to an unknown-opcode RuntimeError. The default loop does no
+    accounting at all.
+
+    max_steps (instructions) and timeout (seconds) bound the run via
+    TomtelVM; VMBudgetExceeded is raised if the program has not finished,
+    carrying the VMState to resume from.
+    """
+    if max_steps is not None or timeout is not None:
+        if profile is not None or trace:
+            raise ValueError("profile/trace cannot be combined with max_steps/timeout")
+        vm = TomtelVM(bytecode, out=out)
+        if not vm.run(max_steps, timeout):
+            raise VMBudgetExceeded(
+                "Program stopped after {} instructions at pc=0x{:X} (budget or timeout exhausted)".format(
+                    vm.state.steps, vm.state.pc
+                ),
+                vm.state,
+            )
+        return vm.output if out is None else vm.sink.written
+    if profile is not None or trace:
+        return _run_profiled(bytecode, profile if profile is not None else VMProfile(), trace, out)
+
+    state = VMState(bytecode)
+    mem, r, buf = state.mem, state.regs, state.out
+    n = len(mem)
+    sink = _OutputSink(out) if out is not None else None
+    flush_at = _FLUSH_SIZE if sink is not None else _NO_FLUSH
+
+    # code[n] stops execution: pc only leaves 0..n-1 by falling off the end
+    # or by a jump, and decoded jump targets are clamped to n
+    code = [_DECODE_INSN] * n + [_HALT_INSN]
+    stale = [_DECODE_INSN] * 5
+
+    # kinds as locals: compared once per executed instruction
+    MV, MVI, LOAD, STORE, SUB, CMP, JNZ, XOR = _MV, _MVI, _LOAD, _STORE, _SUB, _CMP, _JNZ, _XOR
+    ADD, OUT, JEZ, APTR, STOREI, JMP, JMPR = _ADD, _OUT, _JEZ, _APTR, _STOREI, _JMP, _JMPR
+    DECODE, NOP, HALT, PTR = _DECODE, _NOP, _HALT, _PTR
+
+    pc = 0
+    while True:
+        kind, x, y, next_pc = code[pc]
+        if kind == MV:
+            r[x] = r[y]
+        elif kind == MVI:
+            r[x] = y
+        elif kind == LOAD:
+            addr = (r[PTR] + r[3]) & 0xFFFFFFFF
+            r[x] = mem[addr] if addr < n else 0
+        elif kind == STORE:
+            addr = (r[PTR] + r[3]) & 0xFFFFFFFF
+            if addr < n:
+                mem[addr] = r[x]
+                # instructions are at most 5 bytes long
+                if addr >= 4:
+                    code[addr - 4 : addr + 1] = stale
+                else:
+                    code[: addr + 1] = stale[: addr + 1]
+        elif kind == SUB:
+            r[1] = (r[1] - r[2]) & 0xFF
+        elif kind == CMP:
+            r[6] = 0x01 if r[1] != r[2] else 0x00
+        elif kind == JNZ:
+            if r[6] != 0:
+                pc = x
+                continue
+        elif kind == XOR:
+            r[1] ^= r[2]
+        elif kind == ADD:
+            r[1] = (r[1] + r[2]) & 0xFF
+        elif kind == OUT:
+            buf.append(r[1])
+            if len(buf) >= flush_at:
+                sink.flush(buf)
+        elif kind == JEZ:
+            if r[6] == 0:
+                pc = x
+                continue
+        elif kind == APTR:
+            r[PTR] = (r[PTR] + x) & 0xFFFFFFFF
+        elif kind == STOREI:
+            addr = (r[PTR] + r[3]) & 0xFFFFFFFF
+            if addr < n:
+                mem[addr] = x
+                if addr >= 4:
+                    code[addr - 4 : addr + 1] = stale
+                else:
+                    code[: addr + 1] = stale[: addr + 1]
+        elif kind == JMP:
+            pc = x
+            continue
+        elif kind == JMPR:
+            pc = min(r[x], n)
+            continue
+        elif kind == DECODE:
+            code[pc] = _decode(mem, pc)
+            continue
+        elif kind == NOP:
+            pass
+        elif kind == HALT:
+            break
+        else:
+            raise RuntimeError("Unknown opcode 0x{:02X} at pc=0x{:X} (invalid instruction encoding)".format(x, pc))
+        pc = next_pc
+
+    return _output(state, sink)
+
+
+# -----------------------------------------------------------------------------
+# Basic-block compiler
+# -----------------------------------------------------------------------------
+
+# local variable name of each register in generated code
+_REG_NAMES = {1: "a", 2: "b", 3: "c", 4: "d", 5: "e", 6: "f",
+              _R32 + 1: "la", _R32 + 2: "lb", _R32 + 3: "lc", _R32 + 4: "ld", _PTR: "ptr"}
+
+# instructions that end a basic block (jumps, HALT, unknown opcodes)
+_BLOCK_END = frozenset((_JEZ, _JNZ, _JMP, _JMPR, _HALT, _BAD))
+
+# straight-line runs longer than this are split, bounding compile time
+_MAX_BLOCK_INSNS = 256
+
+# compiled blocks shared across runs, keyed by (start, memory size, code bytes)
+_BLOCK_CACHE = {}
+_BLOCK_CACHE_SIZE = 4096
+
+
+def _scan_block(mem, start: int, max_insns: int) -> tuple:
+    """Decode the basic block at start: (end address, decoded instructions)."""
+    insns = []
+    pc = start
+    while True:
+        insn = _decode(mem, pc)
+        insns.append((pc, insn))
+        if insn[0] in _BLOCK_END or insn[3] >= len(mem) or len(insns) == max_insns:
+            # a truncated instruction (decoded as HALT) runs to the end of memory
+            return min(pc + _insn_size(mem[pc]), len(mem)), insns
+        pc = insn[3]
+
+
+def _insn_size(op: int) -> int:
+    """Encoded length of the instruction with opcode op."""
+    if op in (0x21, 0x22) or (op >> 6 == 0b10 and op & 7 == 0):  # JEZ, JNZ, MVI32
+        return 5
+    if op == 0xE1 or (op >> 6 == 0b01 and op & 7 == 0):  # APTR, MVI
+        return 2
+    return 1
+
+
+def _block_source(start: int, n: int, insns: list) -> str:
+    """Python source of one block: def block(r, mem, out, covered, invalidate) -> next pc."""
+    used = {reg for _, (kind, x, y, _) in insns for reg in _insn_regs(kind, x, y)}
+    written = {reg for _, (kind, x, y, _) in insns for reg in _insn_writes(kind, x)}
+    load = "".join("    {} = r[{}]\n".format(_REG_NAMES[reg], reg) for reg in sorted(used))
+
+    def exit_(value, indent="    "):
+        stores = "".join("{}r[{}] = {}\n".format(indent, reg, _REG_NAMES[reg]) for reg in sorted(written))
+        return "{}{}return {}\n".format(stores, indent, value)
+
+    body = []
+    for pc, (kind, x, y, next_pc) in insns:
+        if kind == _MV:
+            body.append("    {} = {}\n".format(_REG_NAMES[x], _REG_NAMES[y]))
+        elif kind == _MVI:
+            body.append("    {} = {}\n".format(_REG_NAMES[x], y))
+        elif kind == _LOAD:
+            body.append("    addr = (ptr + c) & 0xFFFFFFFF\n")
+            body.append("    {} = mem[addr] if addr < {} else 0\n".format(_REG_NAMES[x], n))
+        elif kind == _STORE or kind == _STOREI:
+            # a store into compiled code leaves the block so that the rest of
+            # it (and any other block over that byte) is decoded again
+            body.append("    addr = (ptr + c) & 0xFFFFFFFF\n")
+            body.append("    if addr < {}:\n".format(n))
+            body.append("        mem[addr] = {}\n".format(_REG_NAMES[x] if kind == _STORE else x))
+            body.append("        if covered[addr]:\n")
+            body.append("            invalidate(addr)\n")
+            body.append(exit_(next_pc, "            "))
+        elif kind == _SUB:
+            body.append("    a = (a - b) & 0xFF\n")
+        elif kind == _ADD:
+            body.append("    a = (a + b) & 0xFF\n")
+        elif kind == _XOR:
+            body.append("    a ^= b\n")
+        elif kind == _CMP:
+            body.append("    f = 0x01 if a != b else 0x00\n")
+        elif kind == _OUT:
+            body.append("    out.append(a)\n")
+        elif kind == _APTR:
+            body.append("    ptr = (ptr + {}) & 0xFFFFFFFF\n".format(x))
+        elif kind == _JEZ or kind == _JNZ:
+            body.append(exit_("{} if f {} 0 else {}".format(x, "==" if kind == _JEZ else "!=", next_pc)))
+            break
+        elif kind == _JMP:
+            body.append(exit_(x))
+            break
+        elif kind == _JMPR:
+            body.append(exit_(_REG_NAMES[x]))
+            break
+        elif kind == _HALT:
+            # negative stops the dispatch loop; -1 - pc keeps the address
+            body.append(exit_(-1 - pc))
+            break
+        elif kind == _BAD:
+            body.append(exit_("error(0x{:02X}, 0x{:X})".format(x, pc)))
+            break
+    else:
+        # end of memory or block split at max_insns: fall through
+        body.append(exit_(insns[-1][1][3]))
+
+    return "def block(r, mem, out, covered, invalidate):\n" + load + "".join(body)
+
+
+def _insn_regs(kind: int, x: int, y: int) -> tuple:
+    """Registers an instruction reads or writes (loaded into locals on block entry)."""
+    if kind == _MV:
+        return (x, y)
+    if kind == _MVI or kind == _JMPR:
+        return (x,)
+    if kind == _LOAD:
+        return (x, 3, _PTR)
+    if kind == _STORE:
+        return (x, 3, _PTR)
+    if kind == _STOREI:
+        return (3, _PTR)
+    if kind in (_SUB, _ADD, _XOR):
+        return (1, 2)
+    if kind == _CMP:
+        return (1, 2, 6)
+    if kind == _OUT:
+        return (1,)
+    if kind == _APTR:
+        return (_PTR,)
+    if kind == _JEZ or kind == _JNZ:
+        return (6,)
+    return ()
+
+
+def _insn_writes(kind: int, x: int) -> tuple:
+    """Registers an instruction writes (stored back on block exit)."""
+    if kind in (_MV, _MVI, _LOAD):
+        return (x,)
+    if kind in (_SUB, _ADD, _XOR):
+        return (1,)
+    if kind == _CMP:
+        return (6,)
+    if kind == _APTR:
+        return (_PTR,)
+    return ()
+
+
+def _raise_unknown_opcode(op: int, pc: int):
+    raise RuntimeError("Unknown opcode 0x{:02X} at pc=0x{:X} (invalid instruction encoding)".format(op, pc))
+
+
+def _compile_block(mem, start: int, max_insns: int) -> tuple:
+    """
+    Compile the basic block at start (cached by code bytes). Returns
+    (function, end address, next_pc of each instruction in the block).
+    """
+    end, insns = _scan_block(mem, start, max_insns)
+    key = (start, len(mem), bytes(mem[start:end]))
+    fn = _BLOCK_CACHE.get(key)
+    if fn is None:
+        namespace = {"error": _raise_unknown_opcode}
+        source = _block_source(start, len(mem), insns)
+        exec(compile(source, "<tomtel block 0x{:X}>".format(start), "exec"), namespace)
+        fn = namespace["block"]
+        if len(_BLOCK_CACHE) >= _BLOCK_CACHE_SIZE:
+            # dicts keep insertion order: drop the oldest entry
+            del _BLOCK_CACHE[next(iter(_BLOCK_CACHE))]
+        _BLOCK_CACHE[key] = fn
+    return fn, end, tuple(insn[3] for _, insn in insns)
+
+
+class _BlockTable:
+    """Compiled blocks of one run by start address; stores into them invalidate."""
+
+    def __init__(self, mem: bytearray, max_insns: int = _MAX_BLOCK_INSNS):
+        self.mem = mem
+        self.max_insns = max_insns
+        self.blocks = {}                    # start address -> compiled block
+        self.extents = {}                   # start address -> end address
+        self.nexts = {}                     # start address -> next_pc per instruction
+        self.covered = bytearray(len(mem))  # 1 for bytes inside some compiled block
+        self.invalidations = 0
+
+    def compile(self, start: int):
+        block, end, nexts = _compile_block(self.mem, start, self.max_insns)
+        self.blocks[start] = block
+        self.extents[start] = end
+        self.nexts[start] = nexts
+        self.covered[start:end] = b"\x01" * (end - start)
+        return block
+
+    def invalidate(self, addr: int) -> None:
+        blocks, extents, covered = self.blocks, self.extents, self.covered
+        self.invalidations += 1
+        for start, end in list(extents.items()):
+            if start <= addr < end:
+                del blocks[start], extents[start], self.nexts[start]
+                covered[start:end] = bytes(end - start)
+        # blocks may overlap: re-mark the ones that are still valid
+        for start, end in extents.items():
+            covered[start:end] = b"\x01" * (end - start)
+
+
+def run_tomtel_vm_compiled(bytecode: bytes, out=None):
+    """
+    Same as run_tomtel_vm, but compiles each basic block (split at jumps and
+    writes to pc) into one Python function with the registers in locals.
+    Blocks are invalidated when the program writes into their code bytes.
+    """
+    state = VMState(bytecode)
+    mem, r, buf = state.mem, state.regs, state.out
+    n = len(mem)
+    sink = _OutputSink(out) if out is not None else None
+    table = _BlockTable(mem)
+    blocks, covered, invalidate = table.blocks, table.covered, table.invalidate
+
+    pc = 0
+    if sink is None:
+        while 0 <= pc < n:
+            block = blocks.get(pc) or table.compile(pc)
+            pc = block(r, mem, buf, covered, invalidate)
+    else:
+        while 0 <= pc < n:
+            block = blocks.get(pc) or table.compile(pc)
+            pc = block(r, mem, buf, covered, invalidate)
+            # a block emits at most _MAX_BLOCK_INSNS bytes past the threshold
+            if len(buf) >= _FLUSH_SIZE:
+                sink.flush(buf)
+
+    return _output(state, sink)
+
+
+# -----------------------------------------------------------------------------
+# Profiling and tracing
+# -----------------------------------------------------------------------------
+
+# opcodes that transfer control: JEZ, JNZ and MV32/MVI32 into pc
+_BRANCH_OPS = frozenset([0x21, 0x22] + [0x80 | 6 << 3 | src for src in range(8)])
+
+_NAMES8 = ("-", "a", "b", "c", "d", "e", "f", "(ptr+c)")
+_NAMES32 = ("-", "la", "lb", "lc", "ld", "ptr", "pc", "-")
+
+
+class VMProfile:
+    """
+    Counters filled in by run_tomtel_vm(..., profile=VMProfile()). Counts
+    accumulate if the same profile is passed to several runs.
+
+    instructions: total instructions executed.
+    opcodes: Counter of executions per opcode byte.
+    pcs: Counter of executions per instruction address.
+    block_entries: Counter of entries per basic block start address (the
+        first instruction, every jump target and every fall-through after a
+        conditional jump).
+    block_instructions: Counter of instructions executed per basic block.
+    """
+
+    def __init__(self):
+        self.instructions = 0
+        self.opcodes = Counter()
+        self.pcs = Counter()
+        self.block_entries = Counter()
+        self.block_instructions = Counter()
+
+    def __repr__(self):
+        return "VMProfile(instructions={}, opcodes={}, blocks={})".format(
+            self.instructions, len(self.opcodes), len(self.block_entries)
+        )
+
+    def hot_blocks(self, k: int = 10) -> list:
+        """The k blocks that executed the most instructions: [(start, entries, instructions)]."""
+        return [(start, self.block_entries[start], count) for start, count in self.block_instructions.most_common(k)]
+
+    def report(self, k: int = 10) -> str:
+        """Multi-line summary: total, top-k opcodes and hot blocks."""
+        total = self.instructions or 1
+        lines = ["{} instructions".format(self.instructions), "top opcodes:"]
+        for op, count in self.opcodes.most_common(k):
+            name = _mnemonic(bytes([op])).replace(" <- ?", "").replace(" ?", "")
+            lines.append("  0x{:02X} {:<18} {:>10} {:6.1%}".format(op, name, count, count / total))
+        lines.append("hot blocks:")
+        for start, entries, count in self.hot_blocks(k):
+            lines.append("  0x{:04X} entries {:>8} instructions {:>10} {:6.1%}".format(start, entries, count, count / total))
+        return "\n".join(lines)
+
+
+def _mnemonic(raw: bytes) -> str:
+    """Disassemble one instruction (opcode plus any immediate bytes)."""
+    op = raw[0]
+    imm = raw[1:]
+    if op == 0x01:
+        return "HALT"
+    if op == 0x02:
+        return "OUT a"
+    if op in (0xC1, 0xC2, 0xC3, 0xC4):
+        return ("CMP", "ADD a <- b", "SUB a <- b", "XOR a <- b")[op - 0xC1]
+    if op == 0xE1:
+        return "APTR {}".format(imm[0] if imm else "?")
+    if op in (0x21, 0x22):
+        target = "0x{:X}".format(int.from_bytes(imm, "little")) if len(imm) == 4 else "?"
+        return "{} {}".format("JEZ" if op == 0x21 else "JNZ", target)
+    dest, src = (op >> 3) & 7, op & 7
+    if (op >> 6) == 0b01:
+        if src == 0:
+            return "MVI {} <- {}".format(_NAMES8[dest], "0x{:02X}".format(imm[0]) if imm else "?")
+        return "MV {} <- {}".format(_NAMES8[dest], _NAMES8[src])
+    if (op >> 6) == 0b10:
+        if src == 0:
+            value = "0x{:X}".format(int.from_bytes(imm, "little")) if len(imm) == 4 else "?"
+            return "MVI32 {} <- {}".format(_NAMES32[dest], value)
+        return "MV32 {} <- {}".format(_NAMES32[dest], _NAMES32[src])
+    return "??"
+
+
+def _format_trace(history) -> str:
+    lines = ["last {} instructions:".format(len(history))]
+    for pc, raw in history:
+        lines.append("  0x{:04X}  {:<14} {}".format(pc, raw.hex(" "), _mnemonic(raw)))
+    return "\n".join(lines)
+
+
+def _run_profiled(bytecode: bytes, profile: VMProfile, trace: int, out=None):
+    """
+    run_tomtel_vm with per-instruction accounting. Instructions are compiled
+    one at a time (blocks of max_insns=1) so every step passes through here;
+    with trace > 0 the last trace instructions are kept and appended to the
+    message of an unknown-opcode RuntimeError.
+    """
+    state = VMState(bytecode)
+    mem, r, buf = state.mem, state.regs, state.out
+    n = len(mem)
+    sink = _OutputSink(out) if out is not None else None
+    flush_at = _FLUSH_SIZE if sink is not None else _NO_FLUSH
+    table = _BlockTable(mem, max_insns=1)
+    insns, covered, invalidate = table.blocks, table.covered, table.invalidate
+
+    history = deque(maxlen=trace) if trace else None
+    opcodes = [0] * 256
+    pcs = [0] * n
+    block_entries = Counter()
+    block_instructions = Counter()
+    block = 0
+    expected = -1  # fall-through address of the previous instruction
+
+    pc = 0
+    try:
+        while 0 <= pc < n:
+            op = mem[pc]
+            if pc != expected:
+                block = pc
+                block_entries[pc] += 1
+            opcodes[op] += 1
+            pcs[pc] += 1
+            block_instructions[block] += 1
+            if history is not None:
+                history.append((pc, bytes(mem[pc : pc + _insn_size(op)])))
+            insn = insns.get(pc) or table.compile(pc)
+            # a branch ends the block even when it falls through
+            expected = -1 if op in _BRANCH_OPS else pc + _insn_size(op)
+            pc = insn(r, mem, buf, covered, invalidate)
+            if len(buf) >= flush_at:
+                sink.flush(buf)
+    except RuntimeError as exc:
+        if history:
+            exc.args = ("{}\n{}".format(exc, _format_trace(history)),)
+        raise
+    finally:
+        profile.instructions += sum(pcs)
+        profile.opcodes.update({op: count for op, count in enumerate(opcodes) if count})
+        profile.pcs.update({addr: count for addr, count in enumerate(pcs) if count})
+        profile.block_entries.update(block_entries)
+        profile.block_instructions.update(block_instructions)
+
+    return _output(state, sink)
+
+
+# -----------------------------------------------------------------------------
+# Resumable execution: instruction budget, deadline, snapshots
+# -----------------------------------------------------------------------------
+
+class VMBudgetExceeded(RuntimeError):
+    """Raised by run_tomtel_vm when max_steps or timeout stops the program; .state resumes it."""
+
+    def __init__(self, message: str, state: "VMState"):
+        super().__init__(message)
+        self.state = state
+
+
+class TomtelVM:
+    """
+    Resumable Tomtel VM on the basic-block compiler. run() executes at most
+    max_steps instructions (exactly: the last block is cut short if needed)
+    and stops at a block boundary once timeout seconds have passed, so many
+    programs can be time-sliced on one worker. out is an optional output
+    sink, as for run_tomtel_vm.
+    """
+
+    def __init__(self, bytecode: bytes = b"", state: VMState = None, out=None):
+        self.state = state if state is not None else VMState(bytecode)
+        # with an output sink, state.out is flushed to it during and after each run()
+        self.sink = _OutputSink(out) if out is not None else None
+        self._table = _BlockTable(self.state.mem)
+
+    @property
+    def output(self) -> bytes:
+        """Output held in the state (everything, unless a sink was given)."""
+        return bytes(self.state.out)
+
+    def snapshot(self) -> bytes:
+        """Serialized state; TomtelVM.resume(snapshot) continues from here."""
+        return self.state.to_bytes()
+
+    @classmethod
+    def resume(cls, snapshot: bytes) -> "TomtelVM":
+        return cls(state=VMState.from_bytes(snapshot))
+
+    def run(self, max_steps: int = None, timeout: float = None) -> bool:
+        """
+        Run until HALT, pc leaves memory, max_steps instructions have executed
+        or timeout seconds have passed. Returns True if the program finished.
+        """
+        state, table = self.state, self._table
+        mem, r, buf, sink = state.mem, state.regs, state.out, self.sink
+        n = len(mem)
+        flush_at = _FLUSH_SIZE if sink is not None else _NO_FLUSH
+        blocks, nexts, covered, invalidate = table.blocks, table.nexts, table.covered, table.invalidate
+        remaining = max_steps if max_steps is not None else float("inf")
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        pc = state.pc
+        try:
+            while not state.halted and 0 <= pc < n and remaining > 0:
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                block = blocks.get(pc) or table.compile(pc)
+                ends = nexts[pc]
+                if len(ends) > remaining:
+                    # cut the block at the budget; its bytes stay covered by the full block
+                    block, _, ends = _compile_block(mem, pc, remaining)
+                invalidations = table.invalidations
+                next_pc = block(r, mem, buf, covered, invalidate)
+                if table.invalidations == invalidations:
+                    executed = len(ends)
+                else:
+                    # a store into code left the block early, right after the store
+                    executed = ends.index(next_pc) + 1
+                state.steps += executed
+                remaining -= executed
+                if next_pc < 0:
+                    state.halted = True
+                    next_pc = -1 - next_pc
+                pc = next_pc
+                if len(buf) >= flush_at:
+                    sink.flush(buf)
+        finally:
+            state.pc = pc
+        if sink is not None:
+            sink.flush(buf)
+        return state.finished
+
+
+# -----------------------------------------------------------------------------
+# Batch runner
+# -----------------------------------------------------------------------------
+
+# programs at least this large reach the workers through shared memory
+_SHM_THRESHOLD = 1 << 20
+
+VMResult = namedtuple("VMResult", "index output error")
+
+
+def _run_job(payload, max_steps: int, timeout: float) -> tuple:
+    """Worker side of run_many: (output, None) or (None, error message)."""
+    try:
+        if isinstance(payload, tuple):
+            # (shared memory block name, program size); the parent unlinks it
+            name, size = payload
+            shm = shared_memory.SharedMemory(name=name)
+            try:
+                payload = bytes(shm.buf[:size])
+            finally:
+                shm.close()
+        return run_tomtel_vm(payload, max_steps=max_steps, timeout=timeout), None
+    except Exception as exc:
+        return None, "{}: {}".format(type(exc).__name__, exc)
+
+
+def run_many(programs, workers: int = None, max_steps: int = None, timeout: float = None):
+    """
+    Run independent Tomtel programs on a process pool. Yields
+    VMResult(index, output, error) in completion order, where index is the
+    program's position in programs. A failing program (unknown opcode,
+    exhausted max_steps/timeout, a crashed worker) gets output=None and an
+    error message; the rest of the batch is unaffected.
+
+    When a worker dies, the pool is replaced and the programs that were in
+    flight are rerun one at a time, so only the one that kills its worker
+    again is reported as failed.
+
+    Programs of _SHM_THRESHOLD bytes or more are handed over in a
+    shared-memory block instead of being pickled. programs may be any
+    iterable; at most 2 * workers are in flight at a time.
+    """
+    workers = workers or os.cpu_count()
+    programs = enumerate(programs)
+    pending = {}  # future -> job: (index, payload, shared memory block or None)
+    suspects = []  # jobs that were in flight when a worker died
+
+    def make_job(index: int, bytecode) -> tuple:
+        if len(bytecode) < _SHM_THRESHOLD:
+            return index, bytes(bytecode), None
+        shm = shared_memory.SharedMemory(create=True, size=len(bytecode))
+        shm.buf[: len(bytecode)] = bytecode
+        return index, (shm.name, len(bytecode)), shm
+
+    def finish(job: tuple, output, error) -> VMResult:
+        shm = job[2]
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+        return VMResult(job[0], output, error)
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            if suspects:
+                # every future of the broken pool has failed or finished by now
+                wait(pending)
+                for future, job in list(pending.items()):
+                    del pending[future]
+                    try:
+                        output, error = future.result()
+                    except BrokenProcessPool:
+                        suspects.append(job)
+                        continue
+                    except Exception as exc:
+                        output, error = None, "{}: {}".format(type(exc).__name__, exc)
+                    yield finish(job, output, error)
+                pool.shutdown()
+                pool = ProcessPoolExecutor(max_workers=workers)
+                while suspects:
+                    job = suspects.pop(0)
+                    try:
+                        output, error = pool.submit(_run_job, job[1], max_steps, timeout).result()
+                    except BrokenProcessPool as exc:  # this one kills its worker
+                        output, error = None, "{}: {}".format(type(exc).__name__, exc)
+                        pool.shutdown()
+                        pool = ProcessPoolExecutor(max_workers=workers)
+                    except Exception as exc:
+                        output, error = None, "{}: {}".format(type(exc).__name__, exc)
+                    yield finish(job, output, error)
+
+            for index, bytecode in programs:
+                job = make_job(index, bytecode)
+                try:
+                    pending[pool.submit(_run_job, job[1], max_steps, timeout)] = job
+                except BrokenProcessPool:
+                    suspects.append(job)
+                    break
+                if len(pending) >= 2 * workers:
+                    break
+            if suspects:
+                continue
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = pending.pop(future)
+                try:
+                    output, error = future.result()
+                except BrokenProcessPool:
+                    suspects.append(job)
+                    continue
+                except Exception as exc:
+                    output, error = None, "{}: {}".format(type(exc).__name__, exc)
+                yield finish(job, output, error)
+    finally:
+        pool.shutdown()
+        for _, _, shm in list(pending.values()) + suspects:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+
+def run_tomtel_vm_reference(bytecode: bytes) -> bytes:
+    """Original fetch-decode-execute loop; kept as the reference for tests."""
     mem = bytearray(bytecode)
     n = len(mem)
 
@@ -9,8 +9,15 @@ from __future__ import print_function  # Py2/3-safe print(file=...); we use .for
 import argparse
 import sys
 import traceback
-from constants import OUTPUT_DIR
+import tracemalloc
+from pathlib import Path
+
+from batch import parse_stage_workers, process_directory, run_pipelined
+from cache import ResultCache
+from constants import CACHE_DIR, CACHE_MAX_BYTES, OUTPUT_DIR
+from metrics import METRICS_FORMATS, write_metrics
 from orchestrator import run_pipeline
+from stages import STAGES, get_stages, select_engines
 
 
 def _clear_output_dir():
@@ -21,19 +28,91 @@ def _clear_output_dir():
                 f.unlink()
 
 
-def main(clear=True):
+def main(
+    clear=True,
+    profile_vm=False,
+    in_memory=False,
+    keep_intermediates=False,
+    stages=None,
+    engines=None,
+    cache=False,
+    cache_max_bytes=CACHE_MAX_BYTES,
+    batch=None,
+    workers=None,
+    pipelined=False,
+    stage_workers=None,
+    metrics_out=None,
+    metrics_format=None,
+    trace_memory=False,
+):
     """
-    Entry point: optionally clear output dir, then run the pipeline.
+    Entry point: optionally clear output dir, then run the pipeline
+    (profile_vm: print an instruction profile of the layer 6 VM; in_memory:
+    chain layers in memory, writing intermediates only with keep_intermediates;
+    stages: stage names to run; engines: 'stage=engine' specs; cache: store and
+    reuse stage results in data/cache, capped at cache_max_bytes; batch: a
+    directory whose files are each run through the pipeline on `workers`
+    processes, into data/output/<file name>/; with pipelined, each stage gets
+    its own pool instead, sized by `workers` or stage_workers 'stage=N' specs;
+    metrics_out: file to write per-stage metrics to, as metrics_format 'jsonl'
+    or 'prometheus' (default: by extension, see metrics.write_metrics);
+    trace_memory: record each stage's tracemalloc peak, single runs only).
     On any exception, print error + traceback to stderr and exit 1.
     """
     try:
+        # validate options before touching the output directory
+        engines = select_engines(engines)
+        get_stages(stages)
+        stage_workers = parse_stage_workers(stage_workers)
+        if metrics_format is not None and metrics_format not in METRICS_FORMATS:
+            raise ValueError(
+                "Unknown metrics format {!r}; use one of {}".format(metrics_format, ", ".join(METRICS_FORMATS))
+            )
+        if trace_memory and batch is not None:
+            raise ValueError("trace_memory is only supported for single runs, not batch")
+
         OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
         if clear:
             print("Clearing output directory...")
             _clear_output_dir()
 
         print("Running pipeline...")
-        run_pipeline()
+        options = dict(
+            profile_vm=profile_vm,
+            in_memory=in_memory,
+            keep_intermediates=keep_intermediates,
+            stages=stages,
+            engines=engines,
+        )
+        if batch is not None:
+            if pipelined:
+                options.update(runner=run_pipelined, stage_workers=stage_workers)
+                del options["in_memory"]  # stages are always chained in memory
+            results = process_directory(
+                Path(batch),
+                OUTPUT_DIR,
+                workers=workers,
+                cache_dir=CACHE_DIR if cache else None,
+                cache_max_bytes=cache_max_bytes,
+                **options
+            )
+            if metrics_out is not None:
+                write_metrics([m for r in results for m in r.metrics or ()], metrics_out, metrics_format)
+            failed = sum(1 for r in results if r.error is not None)
+            if failed:
+                raise RuntimeError("{} of {} inputs failed".format(failed, len(results)))
+        else:
+            metrics = []
+            result_cache = ResultCache(CACHE_DIR, cache_max_bytes) if cache else None
+            if trace_memory:
+                tracemalloc.start()
+            try:
+                run_pipeline(cache=result_cache, metrics=metrics, **options)
+            finally:
+                if trace_memory:
+                    tracemalloc.stop()
+            if metrics_out is not None:
+                write_metrics(metrics, metrics_out, metrics_format)
 
         # Drop bear: classic Aussie tall tale — best enjoyed from a safe distance.
         print("Congratulations! All layers complete. Watch out for drop bears.")
@@ -50,5 +129,88 @@ def main(clear=True):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--no-clear", action="store_true", help="Do not clear output directory")
+    parser.add_argument("--profile-vm", action="store_true", help="Profile the layer 6 VM (opcode counts, hot blocks)")
+    parser.add_argument("--in-memory", action="store_true", help="Pass layer outputs in memory; only layer6_output.txt is written")
+    parser.add_argument(
+        "--keep-intermediates",
+        action="store_true",
+        help="With --in-memory, also write layer 0-5 outputs (on a background thread)",
+    )
+    parser.add_argument(
+        "--engine",
+        action="append",
+        metavar="STAGE=ENGINE",
+        help="Run a stage with another implementation, e.g. layer2=numpy (repeatable). Engines: "
+        + "; ".join("{} {}".format(stage.name, "/".join(stage.engines)) for stage in STAGES),
+    )
+    parser.add_argument(
+        "--stages",
+        type=lambda value: value.split(","),
+        metavar="NAMES",
+        help="Comma-separated stages to run, in order (e.g. layer5,layer6); "
+        "inputs of skipped layers are read from data/output",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Reuse stage results from data/cache and store new ones there (up to --cache-max-mb on disk)",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=CACHE_MAX_BYTES >> 20,
+        help="With --cache, size cap of data/cache in MB; least recently used results are evicted (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="DIR",
+        help="Run the pipeline on every file in DIR, each into data/output/<file name>/, and print a timing summary",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Processes for --batch (default: CPU count); with --pipelined, workers per stage (default: 1)",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="With --batch, give each stage its own worker pool and bounded queue so inputs overlap across layers",
+    )
+    parser.add_argument(
+        "--stage-workers",
+        action="append",
+        metavar="STAGE=N",
+        help="With --pipelined, workers for one stage, e.g. layer6=2 (repeatable)",
+    )
+    parser.add_argument(
+        "--metrics-out",
+        metavar="PATH",
+        help="Write per-stage metrics (time, CPU, bytes, MB/s, peak memory) to PATH: "
+        "JSON lines, appended, or Prometheus text for *.prom",
+    )
+    parser.add_argument(
+        "--metrics-format", choices=METRICS_FORMATS, help="Format for --metrics-out (default: by extension)"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Also record each stage's peak Python allocations with tracemalloc (slower; not with --batch)",
+    )
     args = parser.parse_args()
-    main(clear=not args.no_clear)
+    main(
+        clear=not args.no_clear,
+        profile_vm=args.profile_vm,
+        in_memory=args.in_memory or args.keep_intermediates,
+        keep_intermediates=args.keep_intermediates,
+        stages=args.stages,
+        engines=args.engine,
+        cache=args.cache,
+        cache_max_bytes=args.cache_max_mb << 20,
+        batch=args.batch,
+        workers=args.workers,
+        pipelined=args.pipelined,
+        stage_workers=args.stage_workers,
+        metrics_out=args.metrics_out,
+        metrics_format=args.metrics_format,
+        trace_memory=args.trace_memory,
+    )
@@ -0,0 +1,185 @@
+"""
+Per-stage metrics: time, bytes in/out, throughput and peak memory.
+
+Each stage run fills one StageMetrics record:
+  - wall_s / cpu_s: wall-clock and CPU seconds. CPU is the whole process's,
+    so an engine's own worker threads (e.g. layer 5's parallel engine) count;
+    batch.run_pipelined runs stages concurrently, so there it is the CPU of
+    the thread that ran the stage, plus the pool worker's for process-pool
+    stages;
+  - bytes_in / bytes_out: the stage's raw input (what it reads, e.g. the
+    previous layer's ASCII85 payload) and its output;
+  - mb_per_s: bytes_in per wall second, in MB (10**6 bytes);
+  - peak_rss_bytes: the process's peak resident set size so far (None where
+    the resource module is missing, e.g. Windows);
+  - alloc_peak_bytes: peak Python allocations during the stage, only while
+    tracemalloc is tracing (meaningful for sequential runs only).
+
+Records are written as JSON lines (appended, one object per stage) or as
+Prometheus text exposition format (the file is replaced atomically, e.g. for
+node_exporter's textfile collector).
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+METRICS_FORMATS = ("jsonl", "prometheus")
+
+# (metric name, StageMetrics attribute, help text) for the Prometheus format
+_PROMETHEUS_METRICS = (
+    ("onion_stage_wall_seconds", "wall_s", "Wall-clock time of the stage."),
+    ("onion_stage_cpu_seconds", "cpu_s", "CPU time spent on the stage."),
+    ("onion_stage_input_bytes", "bytes_in", "Raw input bytes read by the stage."),
+    ("onion_stage_output_bytes", "bytes_out", "Output bytes produced by the stage."),
+    ("onion_stage_throughput_bytes_per_second", "bytes_per_s", "Input bytes per wall-clock second."),
+    ("onion_stage_peak_rss_bytes", "peak_rss_bytes", "Peak resident set size of the process after the stage."),
+    ("onion_stage_alloc_peak_bytes", "alloc_peak_bytes", "Peak traced Python allocations during the stage."),
+    ("onion_stage_cached", "cached", "1 if the output came from the result cache."),
+)
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process in bytes, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageMetrics:
+    """Measurements of one stage run; see the module docstring for the fields."""
+
+    __slots__ = (
+        "stage",
+        "layer",
+        "engine",
+        "input",
+        "wall_s",
+        "cpu_s",
+        "bytes_in",
+        "bytes_out",
+        "cached",
+        "peak_rss_bytes",
+        "alloc_peak_bytes",
+        "timestamp",
+    )
+
+    def __init__(self, stage, engine: str, input_name: str = None):
+        self.stage = stage.name
+        self.layer = stage.layer_num
+        self.engine = engine
+        self.input = input_name
+        self.wall_s = self.cpu_s = 0.0
+        self.bytes_in = self.bytes_out = 0
+        self.cached = False
+        self.peak_rss_bytes = self.alloc_peak_bytes = None
+        self.timestamp = None
+
+    @property
+    def bytes_per_s(self) -> float:
+        return self.bytes_in / self.wall_s if self.wall_s else 0.0
+
+    @property
+    def mb_per_s(self) -> float:
+        return self.bytes_per_s / 1e6
+
+    def to_dict(self) -> dict:
+        d = {name: getattr(self, name) for name in self.__slots__}
+        d["mb_per_s"] = round(self.mb_per_s, 3)
+        return d
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        for name in self.__slots__:
+            setattr(self, name, state[name])
+
+    def __repr__(self):
+        return "StageMetrics({}, wall={:.3f}s, cpu={:.3f}s, {} -> {} bytes)".format(
+            self.stage, self.wall_s, self.cpu_s, self.bytes_in, self.bytes_out
+        )
+
+
+class StageTimer:
+    """
+    Context manager: record wall and CPU time and peak memory into a
+    StageMetrics. cpu_clock defaults to process CPU time; pass
+    time.thread_time when other work runs in the process meanwhile.
+    """
+
+    def __init__(self, record: StageMetrics, cpu_clock=time.process_time):
+        self.record = record
+        self._cpu_clock = cpu_clock
+
+    def __enter__(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self._cpu0 = self._cpu_clock()
+        self._wall0 = time.perf_counter()
+        return self.record
+
+    def __exit__(self, typ, val, tb):
+        r = self.record
+        r.wall_s = time.perf_counter() - self._wall0
+        r.cpu_s = self._cpu_clock() - self._cpu0
+        r.peak_rss_bytes = peak_rss_bytes()
+        if tracemalloc.is_tracing():
+            r.alloc_peak_bytes = tracemalloc.get_traced_memory()[1]
+        r.timestamp = time.time()
+        return False
+
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_prometheus(records) -> str:
+    """Records in the Prometheus text exposition format (one gauge family per field)."""
+    lines = []
+    for metric, attr, help_text in _PROMETHEUS_METRICS:
+        samples = []
+        for r in records:
+            value = getattr(r, attr)
+            if value is None:
+                continue
+            labels = [("stage", r.stage), ("engine", r.engine)]
+            if r.input is not None:
+                labels.append(("input", r.input))
+            label_text = ",".join('{}="{}"'.format(k, _label_value(v)) for k, v in labels)
+            samples.append("{}{{{}}} {}".format(metric, label_text, float(value)))
+        if samples:
+            lines.append("# HELP {} {}".format(metric, help_text))
+            lines.append("# TYPE {} gauge".format(metric))
+            lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(records, path: Path, fmt: str = None) -> None:
+    """
+    Write records to path as 'jsonl' (appended) or 'prometheus' (replaced);
+    fmt=None picks prometheus for *.prom files and jsonl otherwise.
+    """
+    path = Path(path)
+    fmt = fmt or ("prometheus" if path.suffix == ".prom" else "jsonl")
+    if fmt == "jsonl":
+        with path.open("a") as f:
+            for r in records:
+                f.write(json.dumps(r.to_dict()) + "\n")
+    elif fmt == "prometheus":
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(format_prometheus(records))
+        os.replace(tmp, path)
+    else:
+        raise ValueError("Unknown metrics format {!r}; use one of {}".format(fmt, ", ".join(METRICS_FORMATS)))
@@ -1,160 +1,263 @@
 """
 Orchestrates the multi-layer pipeline (Tom's Data Onion layers 0-6).
 
-Each step: read previous output, transform, write next output. We wrap each
-step in try/except, raise RuntimeError with step index + message, and chain
-the original via 'from exc' so main() can print a full traceback.
+The layers are declared in stages.STAGES; run_pipeline walks that list (or
+any sub-list of it). Each step: read previous output, transform with the
+selected engine, write next output (to data/output, or handed over in memory
+with in_memory=True). We wrap each step in try/except, raise RuntimeError
+with step index + message, and chain the original via 'from exc' so main()
+can print a full traceback.
 
-Per-layer and total runtimes are measured with time.perf_counter() and
-printed after each step and at the end.
+Per-layer and total runtimes are printed after each step and at the end;
+each step also fills a metrics.StageMetrics record (time, CPU, bytes in/out,
+peak memory) that callers can collect.
 """
+import queue
+import threading
 import time
 
 from constants import INPUT_DIR, OUTPUT_DIR
-from layers import (
-    check_parity,
-    decode_ascii85,
-    decrypt_aes_256,
-    decrypt_xor,
-    flip_and_rotate,
-    get_payload_from_layer_output,
-    parse_packets,
-    process_layer0,
-    run_tomtel_vm,
-)
-
-
-class _TimedStep:
-    """Context manager: time a block, set .elapsed on exit, print ' layer N done (Xs)'."""
-
-    def __init__(self, layer_num):
-        self.layer_num = layer_num
-        self.elapsed = 0.0
-
-    def __enter__(self):
-        self._t0 = time.perf_counter()
-        return self
-
-    def __exit__(self, typ, val, tb):
-        self.elapsed = time.perf_counter() - self._t0
-        if typ is None:
-            print("  layer {} done ({:.3f}s)".format(self.layer_num, self.elapsed))
-        return False
-
-
-def run_pipeline():
+from helpers import extract_payload, get_payload_from_layer_output, map_file
+from metrics import StageMetrics, StageTimer
+from stages import budgeted_vm, get_stages
+
+
+class BackgroundWriter:
+    """
+    Writes files on a daemon thread, off the pipeline's critical path. With
+    max_pending, write() blocks while that many writes are queued. A failed
+    write does not stop the ones after it.
+    """
+
+    def __init__(self, max_pending=0):
+        self._queue = queue.Queue(max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="layer-output-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, path, data, done=None):
+        """
+        Queue data (not modified afterwards) to be written to path. done, if
+        given, is called on the writer thread with None or the write's error,
+        which close() then does not report.
+        """
+        self._queue.put((path, data, done))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            path, data, done = item
+            error = None
+            try:
+                path.write_bytes(data)
+            except Exception as exc:
+                error = exc
+            if done is not None:
+                done(error)
+            elif error is not None and self._error is None:
+                self._error = error
+
+    def close(self, check=True):
+        """Wait for queued writes; with check, re-raise the first write error."""
+        self._queue.put(None)
+        self._thread.join()
+        if check and self._error is not None:
+            raise RuntimeError("Writing intermediate output failed: {}".format(self._error)) from self._error
+
+
+class LayerIO:
+    """
+    Hands each layer's output to the next: via files in output_dir, or in
+    memory. input_path is the pipeline's input (read by layer 0).
+
+    In memory, only the final output is written, plus the intermediates with
+    keep_intermediates; writes then go through a BackgroundWriter: `writer`
+    if given (shared, not closed here), else one of our own when keeping
+    intermediates.
+    """
+
+    def __init__(self, in_memory=False, keep_intermediates=False, output_dir=None, input_path=None, writer=None):
+        self.in_memory = in_memory
+        self.keep_intermediates = keep_intermediates
+        self.output_dir = output_dir or OUTPUT_DIR
+        self.input_path = input_path or INPUT_DIR / "layer0_ascii85.txt"
+        self._outputs = {}
+        self._own_writer = writer is None and in_memory and keep_intermediates
+        self._writer = BackgroundWriter() if self._own_writer else writer
+
+    def put(self, layer_num, data, final=False):
+        """Store layer_num's output; the final layer's output is always written to disk."""
+        path = self.output_dir / "layer{}_output.txt".format(layer_num)
+        if not self.in_memory:
+            path.write_bytes(data)
+        elif final or self.keep_intermediates:
+            if self._writer is not None:
+                self._writer.write(path, data)
+            else:
+                path.write_bytes(data)
+        if self.in_memory and not final:
+            self._outputs[layer_num] = data
+
+    def read_input(self):
+        """The pipeline's input document, memory-mapped."""
+        return map_file(self.input_path)
+
+    def payload(self, layer_num):
+        """ASCII85 payload (a memoryview) of layer_num's output (from disk if it was not run)."""
+        if layer_num in self._outputs:
+            return extract_payload(self._outputs.pop(layer_num), source="layer {} output".format(layer_num))
+        return get_payload_from_layer_output(self.output_dir / "layer{}_output.txt".format(layer_num))
+
+    def close(self, check=True):
+        if self._own_writer:
+            self._writer.close(check)
+
+
+class MemoryLayerIO:
+    """Layer I/O without files: the input document is given and every output is kept."""
+
+    def __init__(self, document):
+        self.document = document
+        self.outputs = {}
+
+    def read_input(self):
+        return self.document
+
+    def payload(self, layer_num):
+        return extract_payload(self.outputs[layer_num], source="layer {} output".format(layer_num))
+
+    def put(self, layer_num, data, final=False):
+        self.outputs[layer_num] = data
+
+
+def decode_document(document, layer=6, engines=None, max_steps=None, timeout=None):
+    """
+    Run layers 0..layer on a layer 0 ASCII85 document (bytes-like) entirely in
+    memory, without the progress lines, and return that layer's output. engines:
+    {stage name: engine name}. Errors are raised as in run_pipeline.
+
+    max_steps (instructions) and timeout (seconds) bound the layer 6 VM, for
+    untrusted documents: layer 6 then runs on stages.budgeted_vm whatever its
+    engine, and a program that does not finish fails with VMBudgetExceeded
+    as the RuntimeError's cause.
     """
-    Run each layer in sequence. Each step is wrapped in try/except: we raise
+    engines = engines or {}
+    layer_io = MemoryLayerIO(document)
+    for step, stage in enumerate(get_stages()[: layer + 1], 1):
+        transform = None
+        if stage.name == "layer6" and (max_steps is not None or timeout is not None):
+            transform = budgeted_vm(max_steps, timeout)
+        try:
+            execute_stage(stage, engines.get(stage.name), layer_io, transform=transform)
+        except Exception as exc:
+            raise RuntimeError("Step {} (Process layer {}) failed: {}".format(step, stage.layer_num, exc)) from exc
+    return layer_io.outputs[layer]
+
+
+def run_pipeline(
+    profile_vm=False,
+    in_memory=False,
+    keep_intermediates=False,
+    stages=None,
+    engines=None,
+    cache=None,
+    input_path=None,
+    output_dir=None,
+    metrics=None,
+):
+    """
+    Run each stage in sequence. Each step is wrapped in try/except: we raise
     RuntimeError with step context + original message, chained via 'from exc'.
     main() prints that error and the full traceback.
-    Per-layer and total runtimes are printed.
-    """
-    t_start_total = time.perf_counter()
-    total_sec = 0.0
+    Per-layer and total runtimes are printed, and returned as
+    {stage name: seconds, ..., "total": seconds}.
 
-    # -------------------------------------------------------------------------
-    # STEP 1: Process layer 0 (ASCII85 decode only)
-    # -------------------------------------------------------------------------
-    print("Processing layer 0...")
-    try:
-        with _TimedStep(0) as t:
-            layer0_input_path = INPUT_DIR / "layer0_ascii85.txt"
-            layer0_ascii85_text = layer0_input_path.read_text(encoding="ascii")
-            layer0_bytes = process_layer0(layer0_ascii85_text.encode("ascii"))
-            (OUTPUT_DIR / "layer0_output.txt").write_bytes(layer0_bytes)
-        total_sec += t.elapsed
-    except Exception as exc:
-        raise RuntimeError("Step 1 (Process layer 0) failed: {}".format(exc)) from exc
+    stages: stage names to run, in order (default: all of stages.STAGES); a
+    stage whose input layer is not run reads that layer's file in data/output.
+    engines: {stage name: engine name} overriding each stage's default (see
+    stages.select_engines). profile_vm is shorthand for layer6=profile, which
+    prints the VM's instruction profile as well.
 
-    # -------------------------------------------------------------------------
-    # STEP 2: Process layer 1
-    # -------------------------------------------------------------------------
-    print("Processing layer 1...")
-    try:
-        with _TimedStep(1) as t:
-            layer1_input_path = OUTPUT_DIR / "layer0_output.txt"
-            layer1_ascii85_text = get_payload_from_layer_output(layer1_input_path)
-            layer1_bytes = decode_ascii85(layer1_ascii85_text.encode("ascii"))
-            layer1_output = flip_and_rotate(layer1_bytes)
-            (OUTPUT_DIR / "layer1_output.txt").write_bytes(layer1_output)
-        total_sec += t.elapsed
-    except Exception as exc:
-        raise RuntimeError("Step 2 (Process layer 1) failed: {}".format(exc)) from exc
+    By default each layer's output is written to data/output and read back by
+    the next layer. With in_memory, outputs are handed over in memory and only
+    layer6_output.txt is written, plus the intermediate files if
+    keep_intermediates is set (written on a background thread).
 
-    # -------------------------------------------------------------------------
-    # STEP 3: Process layer 2
-    # -------------------------------------------------------------------------
-    print("Processing layer 2...")
-    try:
-        with _TimedStep(2) as t:
-            layer2_input_path = OUTPUT_DIR / "layer1_output.txt"
-            layer2_ascii85_text = get_payload_from_layer_output(layer2_input_path)
-            layer2_bytes = decode_ascii85(layer2_ascii85_text.encode("ascii"))
-            layer2_output = check_parity(layer2_bytes)
-            (OUTPUT_DIR / "layer2_output.txt").write_bytes(layer2_output)
-        total_sec += t.elapsed
-    except Exception as exc:
-        raise RuntimeError("Step 3 (Process layer 2) failed: {}".format(exc)) from exc
+    cache: a cache.ResultCache; stages whose input (and engine) it has seen
+    before are skipped and their stored output is used instead.
 
-    # -------------------------------------------------------------------------
-    # STEP 4: Process layer 3 (XOR decryption; key recovered via frequency analysis)
-    # -------------------------------------------------------------------------
-    print("Processing layer 3...")
-    try:
-        with _TimedStep(3) as t:
-            layer3_input_path = OUTPUT_DIR / "layer2_output.txt"
-            layer3_ascii85_text = get_payload_from_layer_output(layer3_input_path)
-            layer3_bytes = decode_ascii85(layer3_ascii85_text.encode("ascii"))
-            layer3_output = decrypt_xor(layer3_bytes, 32)
-            (OUTPUT_DIR / "layer3_output.txt").write_bytes(layer3_output)
-        total_sec += t.elapsed
-    except Exception as exc:
-        raise RuntimeError("Step 4 (Process layer 3) failed: {}".format(exc)) from exc
+    input_path and output_dir default to data/input/layer0_ascii85.txt and
+    data/output; give each run its own output_dir to run several at once.
 
-    # -------------------------------------------------------------------------
-    # STEP 5: Process layer 4
-    # -------------------------------------------------------------------------
-    print("Processing layer 4...")
-    try:
-        with _TimedStep(4) as t:
-            layer4_input_path = OUTPUT_DIR / "layer3_output.txt"
-            layer4_ascii85_text = get_payload_from_layer_output(layer4_input_path)
-            layer4_bytes = decode_ascii85(layer4_ascii85_text.encode("ascii"))
-            layer4_output = parse_packets(layer4_bytes)
-            (OUTPUT_DIR / "layer4_output.txt").write_bytes(layer4_output)
-        total_sec += t.elapsed
-    except Exception as exc:
-        raise RuntimeError("Step 5 (Process layer 4) failed: {}".format(exc)) from exc
+    metrics: a list to which one metrics.StageMetrics per stage run is appended.
+    """
+    t_start_total = time.perf_counter()
+    engines = dict(engines or {})
+    if profile_vm:
+        engines["layer6"] = "profile"
+    selected = get_stages(stages)
 
-    # -------------------------------------------------------------------------
-    # STEP 6: Process layer 5
-    # -------------------------------------------------------------------------
-    print("Processing layer 5...")
+    timings = {}
+    layer_io = LayerIO(in_memory, keep_intermediates, output_dir, input_path)
     try:
-        with _TimedStep(5) as t:
-            layer5_input_path = OUTPUT_DIR / "layer4_output.txt"
-            layer5_ascii85_text = get_payload_from_layer_output(layer5_input_path)
-            layer5_bytes = decode_ascii85(layer5_ascii85_text.encode("ascii"))
-            layer5_output = decrypt_aes_256(layer5_bytes)
-            (OUTPUT_DIR / "layer5_output.txt").write_bytes(layer5_output)
-        total_sec += t.elapsed
-    except Exception as exc:
-        raise RuntimeError("Step 6 (Process layer 5) failed: {}".format(exc)) from exc
+        for step, stage in enumerate(selected, 1):
+            record = _run_stage(step, stage, engines.get(stage.name), layer_io, cache)
+            timings[stage.name] = record.wall_s
+            if metrics is not None:
+                metrics.append(record)
+    except BaseException:
+        layer_io.close(check=False)
+        raise
+    layer_io.close()
+
+    total_elapsed = time.perf_counter() - t_start_total
+    if cache is not None:
+        print("Result cache: {} hits, {} misses".format(cache.hits, cache.misses))
+    print("Total pipeline runtime: {:.3f}s".format(total_elapsed))
+    timings["total"] = total_elapsed
+    return timings
+
 
-    # -------------------------------------------------------------------------
-    # STEP 7: Process layer 6 (Tomtel Core i69 VM)
-    # -------------------------------------------------------------------------
-    print("Processing layer 6...")
+def _run_stage(step, stage, engine, layer_io, cache=None):
+    """
+    Run one stage with progress output (see execute_stage); engine=None runs
+    the default. Returns the stage's StageMetrics.
+    """
+    print("Processing layer {}...".format(stage.layer_num))
+    record = StageMetrics(stage, engine or stage.default)
     try:
-        with _TimedStep(6) as t:
-            layer6_input_path = OUTPUT_DIR / "layer5_output.txt"
-            layer6_ascii85_text = get_payload_from_layer_output(layer6_input_path)
-            layer6_bytes = decode_ascii85(layer6_ascii85_text.encode("ascii"))
-            layer6_output = run_tomtel_vm(layer6_bytes)
-            (OUTPUT_DIR / "layer6_output.txt").write_bytes(layer6_output)
-        total_sec += t.elapsed
+        with StageTimer(record):
+            execute_stage(stage, engine, layer_io, cache, record=record)
     except Exception as exc:
-        raise RuntimeError("Step 7 (Process layer 6) failed: {}".format(exc)) from exc
+        raise RuntimeError("Step {} (Process layer {}) failed: {}".format(step, stage.layer_num, exc)) from exc
+    label = ", cached" if record.cached else ", {}".format(engine) if engine else ""
+    print("  layer {} done ({:.3f}s{})".format(stage.layer_num, record.wall_s, label))
+    return record
 
-    total_elapsed = time.perf_counter() - t_start_total
-    print("Total pipeline runtime: {:.3f}s".format(total_elapsed))
\ No newline at end of file
+
+def execute_stage(stage, engine, layer_io, cache=None, transform=None, record=None):
+    """
+    Read, transform and hand on one stage's output. engine=None runs the
+    default; transform, if given, is called instead of the engine itself (e.g.
+    to run it in another process). With a cache, a hit replaces decoding and
+    transforming the input. Returns True if the output came from the cache.
+    record, a StageMetrics, gets the byte counts and whether it was cached.
+    """
+    name = engine or stage.default
+    transform = transform or stage.engines[name]
+    raw = stage.read(layer_io)
+    output = key = None
+    if cache is not None and name not in stage.uncached:
+        key = cache.key(stage, name, raw)
+        output = cache.get(key)
+    cached = output is not None
+    if not cached:
+        output = transform(stage.decode_input(raw))
+        if key is not None:
+            cache.put(key, output)
+    stage.sink(layer_io, stage.layer_num, output)
+    if record is not None:
+        record.bytes_in, record.bytes_out, record.cached = len(raw), len(output), cached
+    return cached
@@ -0,0 +1,299 @@
+"""
+Long-lived asyncio service decoding onions on demand over HTTP or a Unix socket.
+
+    POST /decode[?layer=N]   body: a layer 0 ASCII85 document
+                             -> 200 with layer N's output (default: 6, the
+                                final plaintext), 422 if a layer fails or
+                                the layer 6 program overruns its budget,
+                                503 if a worker process died
+    GET  /health             -> 200 "ok"
+
+Decoding runs on a pool of worker processes that stay up between requests,
+so interpreter startup, imports (cryptography, numpy), translation tables and
+the layer 6 VM's compiled blocks are paid for once per worker, not per
+request. At most max_concurrent requests are decoded at a time; the rest wait
+for a slot. Documents are untrusted, so each request's layer 6 program is
+stopped after max_steps instructions or vm_timeout seconds. Only the small
+HTTP/1.1 subset needed here is spoken (keep-alive, Content-Length bodies; no
+chunked requests; at most _MAX_HEADERS header lines of up to 64 KiB each).
+
+Run with: python service.py --port 8080 (or --unix /path/to/socket).
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stdout
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from constants import INPUT_DIR
+from orchestrator import decode_document
+from stages import STAGES, select_engines
+
+# largest request body accepted
+_MAX_BODY = 64 << 20
+
+# responses sent before the request body was read: the connection is closed
+_UNREAD_BODY = (
+    HTTPStatus.BAD_REQUEST,
+    HTTPStatus.LENGTH_REQUIRED,
+    HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+    HTTPStatus.NOT_IMPLEMENTED,
+)
+
+# most header lines accepted in one request
+_MAX_HEADERS = 100
+
+# without a budget, the compiled VM keeps its blocks between requests in each
+# worker; with one, layer 6 always runs on the budgeted TomtelVM (see
+# orchestrator.decode_document), so no layer 6 engine can be chosen
+_DEFAULT_ENGINES = {"layer6": "compiled"}
+
+# default budget of a request's layer 6 program (the bundled onion's takes
+# about 210,000 instructions and 0.05s)
+_MAX_STEPS = 50_000_000
+_VM_TIMEOUT = 10.0
+
+
+def _decode(document: bytes, layer: int, engines: dict, max_steps: int = None, timeout: float = None) -> bytes:
+    """Worker side of a /decode request; engine prints are swallowed."""
+    with redirect_stdout(io.StringIO()):
+        return bytes(decode_document(document, layer, engines, max_steps, timeout))
+
+
+def _warm_up(engines: dict, max_steps: int = None, timeout: float = None) -> None:
+    """Pool initializer: decode the bundled onion once so tables and VM blocks are warm."""
+    path = INPUT_DIR / "layer0_ascii85.txt"
+    if path.exists():
+        try:
+            _decode(path.read_bytes(), len(STAGES) - 1, engines, max_steps, timeout)
+        except Exception:
+            pass  # only a warm-up; real requests report their own errors
+
+
+class DecodeService:
+    """The service: start() it on TCP and/or a Unix socket, then serve_forever() or close()."""
+
+    def __init__(
+        self,
+        workers: int = None,
+        max_concurrent: int = None,
+        engines: dict = None,
+        warm_up: bool = True,
+        max_steps: int = _MAX_STEPS,
+        vm_timeout: float = _VM_TIMEOUT,
+    ):
+        if "layer6" in (engines or {}) and (max_steps is not None or vm_timeout is not None):
+            raise ValueError("A layer6 engine cannot be chosen while the VM has a budget (max_steps/vm_timeout)")
+        self.workers = workers or os.cpu_count()
+        self.engines = dict(_DEFAULT_ENGINES, **(engines or {}))
+        self.max_steps = max_steps
+        self.vm_timeout = vm_timeout
+        self._warm_up = warm_up
+        self._pool = self._new_pool()
+        self._slots = asyncio.Semaphore(max_concurrent or 2 * self.workers)
+        self._servers = []
+        self._connections = {}  # handler task -> its connection's writer
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_warm_up if self._warm_up else None,
+            initargs=(self.engines, self.max_steps, self.vm_timeout) if self._warm_up else (),
+        )
+
+    async def start(self, host: str = None, port: int = None, unix_path: str = None) -> None:
+        """Listen on host:port and/or unix_path (port 0 picks a free port; see .addresses)."""
+        if port is not None:
+            self._servers.append(await asyncio.start_server(self._handle, host or "127.0.0.1", port))
+        if unix_path is not None:
+            self._servers.append(await asyncio.start_unix_server(self._handle, unix_path))
+        if not self._servers:
+            raise ValueError("DecodeService needs a port or a unix_path to listen on")
+
+    @property
+    def addresses(self) -> list:
+        return [sock.getsockname() for server in self._servers for sock in server.sockets]
+
+    async def serve_forever(self) -> None:
+        await asyncio.gather(*(server.serve_forever() for server in self._servers))
+
+    async def close(self) -> None:
+        """Stop listening, close open connections (after their current request) and the pool."""
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        self._pool.shutdown()
+
+    async def decode(self, document: bytes, layer: int = len(STAGES) - 1) -> bytes:
+        """
+        Decode a document up to layer on the worker pool, waiting for a free
+        slot. If a worker died, BrokenProcessPool is raised and the pool is
+        replaced for later requests.
+        """
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            pool = self._pool
+            try:
+                return await loop.run_in_executor(
+                    pool, _decode, document, layer, self.engines, self.max_steps, self.vm_timeout
+                )
+            except BrokenProcessPool:
+                if self._pool is pool:
+                    self._pool = self._new_pool()
+                    pool.shutdown(wait=False)
+                raise
+
+    async def _handle(self, reader, writer) -> None:
+        """One connection: answer requests until the client closes or asks to."""
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                try:
+                    request_line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):  # longer than the reader's 64 KiB limit
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, b"Request line too long", True)
+                    break
+                if not request_line:
+                    break
+                headers, error = await self._read_headers(reader)
+                if error is not None:
+                    await self._respond(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, error, True)
+                    break
+                status, body = await self._read_and_dispatch(request_line, headers, reader)
+                close = headers.get("connection", "").lower() == "close" or request_line.endswith(b"HTTP/1.0\r\n")
+                # after an error before the body was read, the stream is out of sync
+                close = close or status in _UNREAD_BODY
+                await self._respond(writer, status, body, close)
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self._connections[task]
+            writer.close()
+
+    @staticmethod
+    async def _read_headers(reader) -> tuple:
+        """({lower-case name: value}, None), or (headers so far, error message) for too many or too long lines."""
+        headers = {}
+        for _ in range(_MAX_HEADERS + 1):
+            try:
+                line = await reader.readline()
+            except (ValueError, asyncio.LimitOverrunError):
+                return headers, b"Header line too long"
+            if line in (b"\r\n", b"\n", b""):
+                return headers, None
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return headers, "More than {} header lines".format(_MAX_HEADERS).encode()
+
+    async def _read_and_dispatch(self, request_line: bytes, headers: dict, reader) -> tuple:
+        """Read the request body and answer it: (status, response body)."""
+        try:
+            method, target, _ = request_line.decode("latin-1").split()
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST, b"Malformed request line"
+        if "transfer-encoding" in headers:
+            return HTTPStatus.NOT_IMPLEMENTED, b"Chunked request bodies are not supported; send Content-Length"
+        length = headers.get("content-length", "0" if method == "GET" else None)
+        if length is None:
+            return HTTPStatus.LENGTH_REQUIRED, b"Content-Length is required"
+        if not length.isdigit():
+            return HTTPStatus.BAD_REQUEST, b"Invalid Content-Length"
+        if int(length) > _MAX_BODY:
+            return HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Body exceeds {} bytes".format(_MAX_BODY).encode()
+        body = await reader.readexactly(int(length))
+        return await self._dispatch(method, urlsplit(target), body)
+
+    async def _dispatch(self, method: str, url, body: bytes) -> tuple:
+        """(status, response body) for one complete request."""
+        if url.path == "/health":
+            return (HTTPStatus.OK, b"ok") if method == "GET" else (HTTPStatus.METHOD_NOT_ALLOWED, b"Use GET")
+        if url.path != "/decode":
+            return HTTPStatus.NOT_FOUND, "No such endpoint: {}".format(url.path).encode()
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED, b"Use POST with a layer 0 ASCII85 document as the body"
+        layer = parse_qs(url.query).get("layer", [str(len(STAGES) - 1)])[0]
+        if not layer.isdigit() or int(layer) >= len(STAGES):
+            return HTTPStatus.UNPROCESSABLE_ENTITY, "layer must be 0-{}".format(len(STAGES) - 1).encode()
+        try:
+            return HTTPStatus.OK, await self.decode(body, int(layer))
+        except BrokenProcessPool:  # a RuntimeError too, but not the document's fault
+            return HTTPStatus.SERVICE_UNAVAILABLE, b"A decoding worker died; retry the request"
+        except RuntimeError as exc:  # a layer failed on this document, or layer 6 overran its budget
+            return HTTPStatus.UNPROCESSABLE_ENTITY, str(exc).encode("utf-8")
+
+    @staticmethod
+    async def _respond(writer, status: HTTPStatus, body: bytes, close: bool) -> None:
+        head = "HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n{}\r\n".format(
+            status.value,
+            status.phrase,
+            "application/octet-stream" if status == HTTPStatus.OK else "text/plain; charset=utf-8",
+            len(body),
+            "Connection: close\r\n" if close else "",
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+async def serve(host=None, port=None, unix_path=None, **kwargs) -> None:
+    """Run a DecodeService until cancelled (kwargs: see DecodeService)."""
+    service = DecodeService(**kwargs)
+    try:
+        await service.start(host, port, unix_path)
+        print("Serving on {}".format(", ".join(str(a) for a in service.addresses)))
+        await service.serve_forever()
+    finally:
+        await service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode onions on demand over HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, help="TCP port to listen on")
+    parser.add_argument("--unix", metavar="PATH", help="Unix socket to listen on")
+    parser.add_argument("--workers", type=int, help="Decoding processes (default: CPU count)")
+    parser.add_argument("--max-concurrent", type=int, help="Requests decoded at once (default: 2 * workers)")
+    parser.add_argument("--engine", action="append", metavar="STAGE=ENGINE", help="As in main.py (repeatable)")
+    parser.add_argument(
+        "--max-steps",
+        type=int,
+        default=_MAX_STEPS,
+        help="Instructions a request's layer 6 program may run; 0: no limit (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--vm-timeout",
+        type=float,
+        default=_VM_TIMEOUT,
+        help="Seconds a request's layer 6 program may run; 0: no limit (default: %(default)s)",
+    )
+    args = parser.parse_args()
+    if args.port is None and args.unix is None:
+        parser.error("give --port and/or --unix")
+    engines = select_engines(args.engine)
+    if "layer6" in engines and (args.max_steps or args.vm_timeout):
+        parser.error("--engine layer6=... needs --max-steps 0 --vm-timeout 0: a budgeted VM has no engine choice")
+    try:
+        asyncio.run(
+            serve(
+                args.host,
+                args.port,
+                args.unix,
+                workers=args.workers,
+                max_concurrent=args.max_concurrent,
+                engines=engines,
+                max_steps=args.max_steps or None,
+                vm_timeout=args.vm_timeout or None,
+            )
+        )
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,235 @@
+"""
+Declarative registry of pipeline stages (one per layer), in run order.
+
+Each Stage names where its input comes from (read, then decode), the
+implementations of its transform (engines, selectable by name: 'fast',
+'reference', 'numpy', ...) and where its output goes (sink). run_pipeline
+just walks a list of stages, so parts of the pipeline can be run on their own
+and single layers switched to another engine, e.g.
+select_engines(["layer2=numpy"]).
+
+Readers and sinks take the orchestrator's layer I/O object, which provides
+read_input(), payload(layer_num) and put(layer_num, data, final=False).
+"""
+from functools import partial
+
+from helpers import decode_ascii85, decode_ascii85_reference
+from layers import (
+    VMProfile,
+    check_parity,
+    decrypt_aes_256,
+    decrypt_xor,
+    detect_key_length,
+    flip_and_rotate,
+    parse_packets,
+    process_layer0,
+    run_tomtel_vm,
+)
+from layers.layer1_flip_rotate import flip_and_rotate_numpy, flip_and_rotate_reference
+from layers.layer2_parity import check_parity_numpy, check_parity_reference
+from layers.layer3_xor_dec import decrypt_xor_reference
+from layers.layer4_packets import parse_packets_reference
+from layers.layer5_aes_ctr import decrypt_aes_256_parallel
+from layers.layer6_tomtel_vm import run_tomtel_vm_compiled, run_tomtel_vm_reference
+
+# instructions kept for the unknown-opcode dump when profiling layer 6
+_VM_TRACE = 32
+
+
+class Stage:
+    """
+    One pipeline stage.
+
+    name: registry key, as used by --engine/--stages ("layer2").
+    layer_num: layer number, for output file names and progress messages.
+    read: (layer_io) -> raw input bytes (what the result cache hashes).
+    decode: raw input -> input of the transform (None: the raw input itself).
+    engines: {engine name: transform(data) -> bytes}; `default` runs unless
+        another engine is selected.
+    sink: (layer_io, layer_num, output) -> None; hands the output on.
+    version: bump when the stage's output for a given input changes, so
+        cached results are not reused.
+    uncached: engines run for their side effects, never served from the cache.
+    pool: 'process' for transforms that hold the GIL (pure-Python loops),
+        'thread' for those that release it; used by the pipelined batch
+        executor to pick each stage's worker pool.
+    """
+
+    def __init__(
+        self, name, layer_num, read, decode, engines, sink, default="fast", version=1, uncached=(), pool="thread"
+    ):
+        self.name = name
+        self.layer_num = layer_num
+        self.read = read
+        self.decode = decode
+        self.engines = engines
+        self.sink = sink
+        self.default = default
+        self.version = version
+        self.uncached = frozenset(uncached)
+        self.pool = pool
+
+    def decode_input(self, raw):
+        """Transform input from the raw input returned by read."""
+        return raw if self.decode is None else self.decode(raw)
+
+    def __repr__(self):
+        return "Stage({!r}, engines={})".format(self.name, sorted(self.engines))
+
+
+# -----------------------------------------------------------------------------
+# Readers and sinks
+# -----------------------------------------------------------------------------
+def read_input(layer_io):
+    """Layer 0 input: the pipeline's ASCII85 input document."""
+    return layer_io.read_input()
+
+
+def previous_payload(layer_num):
+    """Reader: ASCII85 payload of layer layer_num's output (decode with decode_ascii85)."""
+
+    def read(layer_io):
+        return layer_io.payload(layer_num)
+
+    return read
+
+
+def put_output(layer_io, layer_num, output):
+    """Sink: pass the output on to the next stage (a file in the output dir by default)."""
+    layer_io.put(layer_num, output)
+
+
+def put_final_output(layer_io, layer_num, output):
+    """Sink for the last layer: always written to the output dir."""
+    layer_io.put(layer_num, output, final=True)
+
+
+# -----------------------------------------------------------------------------
+# Engines that need more than a single call
+# -----------------------------------------------------------------------------
+def _xor_engine(decrypt):
+    """Layer 3 engine: detect the key length, report it, then decrypt(data, key_len)."""
+
+    def run(data):
+        key_len, confidence = detect_key_length(data)
+        print("  layer 3 key length {} (confidence {:.2f})".format(key_len, confidence))
+        return decrypt(data, key_len)
+
+    return run
+
+
+def _run_vm_profiled(bytecode):
+    """Layer 6 in the VM's profiling mode; prints the instruction profile."""
+    profile = VMProfile()
+    output = run_tomtel_vm(bytecode, profile=profile, trace=_VM_TRACE)
+    print("  layer 6 VM profile: " + profile.report().replace("\n", "\n    "))
+    return output
+
+
+def budgeted_vm(max_steps=None, timeout=None):
+    """
+    Layer 6 transform on the resumable TomtelVM (the compiled engine) that
+    raises VMBudgetExceeded after max_steps instructions or timeout seconds.
+    """
+    return partial(run_tomtel_vm, max_steps=max_steps, timeout=timeout)
+
+
+STAGES = [
+    Stage(
+        "layer0",
+        0,
+        read_input,
+        None,
+        {"fast": process_layer0, "reference": decode_ascii85_reference},
+        put_output,
+    ),
+    Stage(
+        "layer1",
+        1,
+        previous_payload(0),
+        decode_ascii85,
+        {"fast": flip_and_rotate, "numpy": flip_and_rotate_numpy, "reference": flip_and_rotate_reference},
+        put_output,
+    ),
+    Stage(
+        "layer2",
+        2,
+        previous_payload(1),
+        decode_ascii85,
+        {"fast": check_parity, "numpy": check_parity_numpy, "reference": check_parity_reference},
+        put_output,
+        pool="process",
+    ),
+    Stage(
+        "layer3",
+        3,
+        previous_payload(2),
+        decode_ascii85,
+        {"fast": _xor_engine(decrypt_xor), "reference": _xor_engine(decrypt_xor_reference)},
+        put_output,
+        pool="process",
+    ),
+    Stage(
+        "layer4",
+        4,
+        previous_payload(3),
+        decode_ascii85,
+        {"fast": parse_packets, "reference": parse_packets_reference},
+        put_output,
+        pool="process",
+    ),
+    Stage(
+        "layer5",
+        5,
+        previous_payload(4),
+        decode_ascii85,
+        {"fast": decrypt_aes_256, "parallel": decrypt_aes_256_parallel},
+        put_output,
+    ),
+    Stage(
+        "layer6",
+        6,
+        previous_payload(5),
+        decode_ascii85,
+        {
+            "fast": run_tomtel_vm,
+            "compiled": run_tomtel_vm_compiled,
+            "profile": _run_vm_profiled,
+            "reference": run_tomtel_vm_reference,
+        },
+        put_final_output,
+        uncached=("profile",),
+        pool="process",
+    ),
+]
+
+STAGES_BY_NAME = {stage.name: stage for stage in STAGES}
+
+
+def get_stages(names=None):
+    """Stages by name, in the given order (all of STAGES if names is None)."""
+    if names is None:
+        return list(STAGES)
+    unknown = [name for name in names if name not in STAGES_BY_NAME]
+    if unknown:
+        raise ValueError("Unknown stage(s) {}; available: {}".format(", ".join(unknown), ", ".join(STAGES_BY_NAME)))
+    return [STAGES_BY_NAME[name] for name in names]
+
+
+def select_engines(specs):
+    """
+    Parse 'stage=engine' specs (e.g. ["layer2=numpy"]) into {stage name: engine},
+    raising ValueError for malformed specs and unknown stages or engines.
+    """
+    engines = {}
+    for spec in specs or ():
+        name, sep, engine = spec.partition("=")
+        if not sep:
+            raise ValueError("Engine spec {!r} is not of the form stage=engine".format(spec))
+        (stage,) = get_stages([name])
+        if engine not in stage.engines:
+            raise ValueError(
+                "Unknown engine {!r} for {}; available: {}".format(engine, name, ", ".join(stage.engines))
+            )
+        engines[name] = engine
+    return engines
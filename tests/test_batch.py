@@ -0,0 +1,148 @@
+"""
+Tests for batch mode (many inputs, one output directory each, process pools).
+"""
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import pytest
+
+from batch import find_inputs, format_summary, parse_stage_workers, run_batch, run_pipelined
+from constants import INPUT_DIR
+
+
+def _make_inputs(tmp_path, count=2):
+    inputs = tmp_path / "in"
+    inputs.mkdir()
+    for i in range(count):
+        shutil.copy(INPUT_DIR / "layer0_ascii85.txt", inputs / "{}.txt".format("abcdefghij"[i]))
+    (inputs / "bad.txt").write_bytes(b"not ascii85")
+    return find_inputs(inputs)
+
+
+@pytest.mark.parametrize("runner", [run_batch, run_pipelined])
+def test_run_batch(tmp_path, runner):
+    """Each input gets its own outputs; a bad input fails alone and shows in the summary."""
+    results = sorted(runner(_make_inputs(tmp_path), tmp_path / "out", workers=2), key=lambda r: r.input.name)
+    assert [r.input.name for r in results] == ["a.txt", "b.txt", "bad.txt"]
+    a, b, bad = results
+    assert a.error is None and b.error is None
+    assert "Step 1 (Process layer 0) failed" in bad.error and bad.timings is None
+    assert set(a.timings) == {"layer{}".format(i) for i in range(7)} | {"total"}
+    assert a.output_dir == tmp_path / "out" / "a.txt"
+    assert (a.output_dir / "layer6_output.txt").read_bytes() == (b.output_dir / "layer6_output.txt").read_bytes()
+    assert [m.stage for m in a.metrics] == [m.stage for m in b.metrics] == sorted(set(a.timings) - {"total"})
+    assert {m.input for m in a.metrics} == {"a.txt"} and a.metrics[-1].cpu_s > 0
+    assert bad.metrics == []
+
+    summary = format_summary(results, 1.0)
+    assert "bad.txt" in summary and "FAILED" in summary
+    assert summary.splitlines()[-1].startswith("2 ok, 1 failed")
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="workers must inherit the patch")
+def test_run_batch_survives_a_crashed_worker(tmp_path, monkeypatch):
+    """An input that kills its worker fails alone; the others still run and report."""
+    import batch
+
+    run_pipeline = batch.run_pipeline
+
+    def crashing_pipeline(input_path, **kwargs):
+        if input_path.name == "b.txt":
+            os._exit(1)
+        return run_pipeline(input_path=input_path, **kwargs)
+
+    monkeypatch.setattr(batch, "run_pipeline", crashing_pipeline)
+    inputs = _make_inputs(tmp_path, count=6)
+    results = sorted(run_batch(inputs, tmp_path / "out", workers=2, stages=["layer0", "layer1"]))
+    assert [r.input.name for r in results] == [path.name for path in inputs]
+    errors = {r.input.name: r.error for r in results if r.error is not None}
+    assert sorted(errors) == ["b.txt", "bad.txt"] and errors["b.txt"].startswith("BrokenProcessPool")
+    assert all((r.output_dir / "layer1_output.txt").exists() for r in results if r.error is None)
+
+
+def test_run_pipelined_many_inputs_and_early_stop(tmp_path):
+    """Small queues and per-stage workers still finish every input; closing early does not hang."""
+    inputs = _make_inputs(tmp_path, count=6)
+    results = list(run_pipelined(inputs, tmp_path / "out", queue_size=1, stage_workers={"layer6": 2, "layer3": 2}))
+    assert sorted(r.error is None for r in results) == [False] + [True] * 6
+    outputs = {(r.output_dir / "layer6_output.txt").read_bytes() for r in results if r.error is None}
+    assert len(outputs) == 1
+
+    stream = run_pipelined(inputs, tmp_path / "again", queue_size=1)
+    next(stream)
+    stream.close()
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_run_pipelined_survives_dying_workers(tmp_path, monkeypatch):
+    """A BaseException fails only its input; a worker thread that dies still ends the batch."""
+    import batch
+
+    inputs = _make_inputs(tmp_path, count=2)
+    execute_stage = batch.execute_stage
+
+    def exiting_stage(stage, engine, layer_io, *args):
+        if stage.name == "layer3" and layer_io.input_path.name == "a.txt":
+            raise SystemExit
+        return execute_stage(stage, engine, layer_io, *args)
+
+    monkeypatch.setattr(batch, "execute_stage", exiting_stage)
+    results = {r.input.name: r for r in run_pipelined(inputs, tmp_path / "out")}
+    assert results["a.txt"].error.endswith("(Process layer 3) failed: SystemExit")
+    assert results["b.txt"].error is None
+
+    class LosingQueue(queue.Queue):
+        """Loses everything put in it; stage workers (bounded inboxes) die on get."""
+
+        def put(self, item, block=True, timeout=None):
+            pass
+
+        def get(self, block=True, timeout=None):
+            if self.maxsize:
+                raise SystemExit
+            return super().get(block, timeout)
+
+    monkeypatch.setattr(batch, "queue", SimpleNamespace(Queue=LosingQueue, Empty=queue.Empty))
+    monkeypatch.setattr(batch, "_RESULT_POLL_S", 0.05)
+    with pytest.raises(RuntimeError, match="exited before finishing"):
+        list(run_pipelined(inputs, tmp_path / "lost"))
+
+
+def test_run_pipelined_write_error_fails_only_its_input(tmp_path):
+    """A failed write fails its own input; the others' files are all written before they are yielded."""
+    inputs = [path for path in _make_inputs(tmp_path, count=3) if path.name != "bad.txt"]
+    (tmp_path / "out" / "b.txt" / "layer3_output.txt").mkdir(parents=True)
+    results = {}
+    for r in run_pipelined(inputs, tmp_path / "out", keep_intermediates=True):
+        results[r.input.name] = r
+        if r.error is None:
+            assert sorted(p.name for p in r.output_dir.iterdir()) == ["layer{}_output.txt".format(i) for i in range(7)]
+    assert results["a.txt"].error is None and results["c.txt"].error is None
+    assert "layer3_output.txt" in results["b.txt"].error
+    assert (tmp_path / "out" / "b.txt" / "layer6_output.txt").exists()
+
+
+def test_parse_stage_workers():
+    assert parse_stage_workers(["layer6=2", "layer3=1"]) == {"layer6": 2, "layer3": 1}
+    for spec in ("layer6", "layer6=0", "layer6=x", "layer9=1"):
+        with pytest.raises(ValueError):
+            parse_stage_workers([spec])
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    for runner in (run_batch, run_pipelined):
+        with tempfile.TemporaryDirectory() as tmp:
+            test_run_batch(Path(tmp), runner)
+    with tempfile.TemporaryDirectory() as tmp:
+        test_run_pipelined_many_inputs_and_early_stop(Path(tmp))
+    test_parse_stage_workers()
+    print("test_batch passed.")
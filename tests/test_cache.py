@@ -0,0 +1,54 @@
+"""
+Tests for the content-addressed stage result cache.
+"""
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from cache import ResultCache
+from stages import STAGES_BY_NAME
+
+
+def test_key_covers_stage_engine_version_and_input():
+    stage = STAGES_BY_NAME["layer2"]
+    key = ResultCache.key(stage, "fast", b"input")
+    assert key == ResultCache.key(stage, "fast", memoryview(b"input"))
+    assert key != ResultCache.key(stage, "fast", b"input!")
+    assert key != ResultCache.key(stage, "numpy", b"input")
+    assert key != ResultCache.key(STAGES_BY_NAME["layer1"], "fast", b"input")
+
+
+def test_get_put_roundtrip(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    assert cache.get("a" * 64) is None
+    cache.put("a" * 64, b"output")
+    cache.put("b" * 64, b"")
+    assert bytes(cache.get("a" * 64)) == b"output"
+    assert bytes(cache.get("b" * 64)) == b""
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert not list((tmp_path / "cache").glob("*.tmp"))
+
+
+def test_lru_eviction(tmp_path):
+    """Beyond max_bytes the least recently used entries go; a get counts as a use."""
+    cache = ResultCache(tmp_path, max_bytes=350)
+    for i, key in enumerate("abc"):
+        cache.put(key, bytes(100))
+        os.utime(tmp_path / (key + ".bin"), ns=(i * 10**9, i * 10**9))
+    assert cache.get("a") is not None  # b is now the least recently used
+    cache.put("d", bytes(100))
+    assert sorted(p.stem for p in tmp_path.glob("*.bin")) == ["a", "c", "d"]
+    cache.put("e", bytes(400))  # larger than the cap: not stored
+    assert cache.get("e") is None and cache.get("a") is not None
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    test_key_covers_stage_engine_version_and_input()
+    for test in (test_get_put_roundtrip, test_lru_eviction):
+        with tempfile.TemporaryDirectory() as tmp:
+            test(Path(tmp))
+    print("test_cache passed.")
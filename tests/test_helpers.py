@@ -0,0 +1,143 @@
+"""
+Tests for shared helpers (ASCII85 decoding, Internet checksum).
+"""
+import base64
+import io
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import helpers
+from helpers import (
+    Ascii85Decoder,
+    checksum,
+    checksum_update,
+    decode_ascii85,
+    decode_ascii85_reference,
+    decode_ascii85_stream,
+    get_payload_from_layer_output,
+)
+
+# whitespace, 'z' groups, and a partial final group
+_A85_SAMPLE = base64.a85encode(os.urandom(997) + b"\x00" * 12 + b"tail", adobe=True, wrapcol=37)
+
+
+def _decode_or_error(fn, data):
+    try:
+        return bytes(fn(data))
+    except ValueError as exc:
+        return "ValueError: {}".format(exc)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        _A85_SAMPLE,
+        b"<~~>", b"~>", b"<~9~>", b"<~9j~>", b"<~9jqo~>", b"9jqo^~>", b"<~ 9j\tqo^\n z ~>",
+        b"<~9jzqo~>", b"<~s8W-!~>", b"<~s8W-\"~>", b"<~9jyo^~>", b"<~9jqo^", b"<~9jqo^~>x",
+    ],
+)
+def test_decode_ascii85_matches_reference(data):
+    """Same output, and the same ValueError messages, as base64.a85decode(adobe=True)."""
+    assert _decode_or_error(decode_ascii85, data) == _decode_or_error(decode_ascii85_reference, data)
+
+
+def test_ascii85_decoder_any_chunking():
+    """Feeding in chunks of any size (splitting '<~', groups, 'z' and '~>') gives the same bytes."""
+    expected = decode_ascii85_reference(_A85_SAMPLE)
+    for size in (1, 2, 3, 5, 7, 64, 1000):
+        decoder = Ascii85Decoder()
+        out = b"".join(decoder.feed(_A85_SAMPLE[i : i + size]) for i in range(0, len(_A85_SAMPLE), size))
+        assert out + decoder.finish() == expected
+    assert decode_ascii85_stream(io.BytesIO(_A85_SAMPLE + b"\n"), chunk_size=11) == expected
+
+
+def test_decode_ascii85_numpy_and_python_paths(monkeypatch):
+    encoded = base64.a85encode(os.urandom(50000), adobe=True, wrapcol=80)
+    expected = decode_ascii85_reference(encoded)
+    monkeypatch.setattr(helpers, "_A85_CHUNK_SIZE", 4096)
+    assert decode_ascii85(encoded) == expected
+    monkeypatch.setattr(helpers, "_A85_NUMPY_MIN", 0)
+    assert decode_ascii85(encoded) == expected
+    monkeypatch.setattr(helpers, "np", None)
+    assert decode_ascii85(encoded) == expected
+
+
+def test_get_payload_from_layer_output(tmp_path):
+    """Zero-copy view of the <~ ... ~> block; explanation text only on request."""
+    path = tmp_path / "layer.txt"
+    path.write_bytes("Explanation \u2014 ~> <~\n==[ Payload ]===\n\n<~9jqo^~>\n".encode("utf-8"))
+    payload = get_payload_from_layer_output(path)
+    assert isinstance(payload, memoryview) and bytes(payload) == b"<~9jqo^~>"
+    assert decode_ascii85(payload) == b"Man "
+    payload, explanation = get_payload_from_layer_output(path, with_explanation=True)
+    assert explanation == "Explanation \u2014 ~> <~\n"
+    for text in (b"", b"no marker", b"==[ Payload ]==\n9jqo^~>", b"==[ Payload ]==\n<~9jqo^"):
+        path.write_bytes(text)
+        with pytest.raises(ValueError):
+            get_payload_from_layer_output(path)
+
+
+def _checksum_loop(data: bytes) -> int:
+    """Word-by-word RFC 1071 checksum, as helpers.checksum used to compute it."""
+    if len(data) % 2 == 1:
+        data += b"\x00"
+    s = 0
+    for i in range(0, len(data), 2):
+        s += (data[i] << 8) + data[i + 1]
+    while s >> 16:
+        s = (s & 0xFFFF) + (s >> 16)
+    return (~s) & 0xFFFF
+
+
+@pytest.mark.parametrize(
+    "data",
+    [b"", b"\x00", b"\x00" * 20, b"\xff\xff", b"\xff\xff\xff\xff", b"\x01", b"\xfe\xff\x00\x01"]
+    + [os.urandom(n) for n in (1, 2, 19, 20, 21, 1500)],
+)
+def test_checksum_matches_word_loop(data):
+    """Bulk checksum equals the word loop, incl. odd lengths and 0 / 0xFFFF edge cases."""
+    assert checksum(data) == _checksum_loop(data)
+    assert checksum(memoryview(data)) == _checksum_loop(data)
+
+
+def test_checksum_parts_equal_concatenation():
+    """checksum(a, b, c) == checksum(a + b + c), even when parts have odd lengths."""
+    for sizes in ((12, 8, 33), (3, 5, 7), (0, 1, 0, 2), (1,)):
+        parts = [os.urandom(n) for n in sizes]
+        assert checksum(*parts) == _checksum_loop(b"".join(parts))
+
+
+def test_checksum_known_ipv4_header():
+    """RFC 1071 style example: a valid IPv4 header checksums to 0 including its checksum."""
+    hdr = bytes.fromhex("450000730000400040110000c0a80001c0a800c7")
+    cksum = checksum(hdr)
+    assert cksum == 0xB861
+    full = hdr[:10] + cksum.to_bytes(2, "big") + hdr[12:]
+    assert checksum(full) == 0
+
+
+def test_checksum_update_rfc1624():
+    """Incremental update equals a full recompute after changing a field."""
+    for _ in range(200):
+        data = bytearray(os.urandom(40))
+        old = checksum(data)
+        pos = 2 * int.from_bytes(os.urandom(1), "big") % 38
+        old_field = bytes(data[pos : pos + 2])
+        data[pos : pos + 2] = os.urandom(2)
+        assert checksum_update(old, old_field, data[pos : pos + 2]) == checksum(data)
+
+
+if __name__ == "__main__":
+    test_decode_ascii85_matches_reference(_A85_SAMPLE)
+    test_ascii85_decoder_any_chunking()
+    for d in (b"", b"\x01", os.urandom(21)):
+        test_checksum_matches_word_loop(d)
+    test_checksum_parts_equal_concatenation()
+    test_checksum_known_ipv4_header()
+    test_checksum_update_rfc1624()
+    print("test_helpers passed.")
@@ -1,12 +1,20 @@
 """
 Tests for layer 1 (flip every second bit, rotate right by 1).
 """
+import os
 import sys
 from pathlib import Path
 
+import pytest
+
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
 
-from layers.layer1_flip_rotate import flip_and_rotate
+from layers.layer1_flip_rotate import (
+    flip_and_rotate,
+    flip_and_rotate_numpy,
+    flip_and_rotate_reference,
+    np,
+)
 
 
 def _inverse_flip_rotate(data: bytes) -> bytes:
@@ -34,3 +42,17 @@ def test_layer1_flip_rotate_empty():
 def test_layer1_flip_rotate_known():
     """Known pair: 0x55 -> 0x00 (XOR 0x55 -> 0x00; rotate R 1 -> 0x00)."""
     assert flip_and_rotate(bytes([0x55])) == bytes([0x00])
+
+
+def test_layer1_table_matches_reference():
+    """Table engine matches the per-byte reference for every byte value."""
+    data = bytes(range(256)) + os.urandom(4096)
+    assert flip_and_rotate(data) == flip_and_rotate_reference(data)
+
+
+@pytest.mark.skipif(np is None, reason="numpy not installed")
+def test_layer1_numpy_matches_reference():
+    """NumPy engine matches the per-byte reference."""
+    data = bytes(range(256)) + os.urandom(4096)
+    assert flip_and_rotate_numpy(data) == flip_and_rotate_reference(data)
+    assert flip_and_rotate_numpy(b"") == b""
@@ -1,12 +1,15 @@
 """
 Tests for layer 2 (parity bit: keep valid bytes, emit 7 data bits each).
 """
+import os
 import sys
 from pathlib import Path
 
+import pytest
+
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
 
-from layers.layer2_parity import check_parity
+from layers.layer2_parity import _CHUNK_SIZE, check_parity, check_parity_numpy, check_parity_reference, np
 
 
 def _make_byte(data_bits: int, odd_parity: bool) -> int:
@@ -51,6 +54,20 @@ def test_layer2_invalid_dropped():
     assert out == b"\x00" * 7
 
 
+@pytest.mark.parametrize("size", [1, 7, 9, 15, 1000, _CHUNK_SIZE + 13])
+def test_layer2_matches_reference(size):
+    """Packed engine matches the bit-list reference, incl. partial groups and chunk edges."""
+    data = os.urandom(size)
+    assert check_parity(data) == check_parity_reference(data)
+
+
+@pytest.mark.skipif(np is None, reason="numpy not installed")
+def test_layer2_numpy_matches_reference():
+    """NumPy engine matches the bit-list reference."""
+    data = os.urandom(_CHUNK_SIZE + 13)
+    assert check_parity_numpy(data) == check_parity_reference(data)
+
+
 if __name__ == "__main__":
     test_layer2_empty()
     test_layer2_all_zero()
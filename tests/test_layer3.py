@@ -1,12 +1,17 @@
 """
 Tests for layer 3 (XOR decrypt with key recovery; 1-bit bias correction).
 """
+import os
+import random
 import sys
 from pathlib import Path
 
+import pytest
+
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
 
-from layers.layer3_xor_dec import decrypt_xor
+from layers import layer3_xor_dec
+from layers.layer3_xor_dec import decrypt_xor, decrypt_xor_reference, detect_key_length
 
 
 def _encrypt_xor(plain: bytes, key: bytes) -> bytes:
@@ -39,6 +44,80 @@ def test_layer3_short():
     assert out == plain, "expected {!r}, got {!r}".format(plain, out)
 
 
+def test_layer3_text_matches_reference():
+    """English text under a 32-byte key: histogram engine agrees with the reference."""
+    plain = b"The quick brown fox jumps over the lazy dog, again and again. " * 40
+    cipher = _encrypt_xor(plain, os.urandom(32))
+    assert decrypt_xor(cipher, 32) == decrypt_xor_reference(cipher, 32)
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_layer3_matches_reference_random(monkeypatch, use_numpy):
+    """Both scoring backends match the reference on random data (same tie-breaking)."""
+    if use_numpy and layer3_xor_dec.np is None:
+        pytest.skip("numpy not installed")
+    if not use_numpy:
+        monkeypatch.setattr(layer3_xor_dec, "np", None)
+    cipher = os.urandom(777)
+    for key_len in (1, 5, 32):
+        assert decrypt_xor(cipher, key_len) == decrypt_xor_reference(cipher, key_len)
+
+
+_WORDS = (
+    b"the key length leaks because bytes that are a multiple of it apart were "
+    b"encrypted with the same key byte and keep the uneven letter frequencies "
+    b"of plain english text while every other pair of bytes looks random"
+).split()
+# non-periodic English-like text (a repeated sentence would add its own period)
+_TEXT = b" ".join(random.Random(3).choices(_WORDS, k=3000))
+
+
+@pytest.mark.parametrize("key_len", [1, 3, 32, 200])
+def test_layer3_detect_key_length(key_len):
+    """Detected length matches the key used, with high confidence."""
+    cipher = _encrypt_xor(_TEXT, os.urandom(key_len))
+    found, confidence = detect_key_length(cipher)
+    assert found == key_len
+    assert confidence > 0.9
+
+
+@pytest.mark.parametrize(
+    "key, key_len",
+    [
+        (b"\x9e\x9e\xf5", 3),
+        (b"\xaa\xbb\xaa\xcc", 4),
+        (b"\x42\x07", 2),  # 0x42 ^ 0x07 turns 'e' into ' ': looks like a coincidence
+        (b"\x01\x02\x03" * 4, 3),
+    ],
+)
+def test_layer3_detect_key_length_repeated_bytes(key, key_len):
+    """A key with repeated bytes is not collapsed to a length it only partly repeats at."""
+    found, confidence = detect_key_length(_encrypt_xor(_TEXT, key))
+    assert found == key_len
+    assert confidence > 0.9
+
+
+@pytest.mark.skipif(layer3_xor_dec.np is None, reason="numpy not installed")
+def test_layer3_detect_key_length_backends_agree(monkeypatch):
+    """The pure-Python counts are the numpy ones, so both give the same answer."""
+    ciphers = [_encrypt_xor(_TEXT, key) for key in (os.urandom(32), b"\x9e\x9e\xf5", os.urandom(1))]
+    with_numpy = [detect_key_length(cipher) for cipher in ciphers]
+    monkeypatch.setattr(layer3_xor_dec, "np", None)
+    assert [detect_key_length(cipher) for cipher in ciphers] == with_numpy
+
+
+def test_layer3_detect_key_length_random():
+    """Random bytes have no period: confidence stays low."""
+    _, confidence = detect_key_length(os.urandom(50000))
+    assert confidence < 0.5
+
+
+def test_layer3_auto_key_length_matches_explicit():
+    """decrypt_xor(payload) without key_len equals the explicit-length call."""
+    cipher = _encrypt_xor(_TEXT, os.urandom(32))
+    assert decrypt_xor(cipher) == decrypt_xor(cipher, 32)
+
+
 if __name__ == "__main__":
     test_layer3_empty()
     test_layer3_roundtrip()
@@ -1,6 +1,8 @@
 """
 Tests for layer 4 (IPv4/UDP packet parsing; filter by SRC_IP, DST_IP, DST_PORT).
 """
+import io
+import random
 import socket
 import struct
 import sys
@@ -10,12 +12,20 @@ sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
 
 from constants import DST_IP, DST_PORT, SRC_IP
 from helpers import checksum
-from layers.layer4_packets import parse_packets
+from layers.layer4_packets import (
+    PacketFilter,
+    ScanStats,
+    iter_packets,
+    parse_packets,
+    parse_packets_reference,
+)
 
 
-def _build_ip_udp_packet(payload: bytes, src_port: int = 12345) -> bytes:
-    """Build IPv4 + UDP packet with SRC_IP, DST_IP, DST_PORT. UDP checksum 0."""
-    src = socket.inet_aton(SRC_IP)
+def _build_ip_udp_packet(
+    payload: bytes, src_port: int = 12345, src_ip: str = SRC_IP, udp_checksum: bool = False
+) -> bytes:
+    """Build IPv4 + UDP packet to DST_IP, DST_PORT. UDP checksum 0 unless udp_checksum."""
+    src = socket.inet_aton(src_ip)
     dst = socket.inet_aton(DST_IP)
     ihl = 5
     ip_len = 20 + 8 + len(payload)
@@ -33,9 +43,28 @@ def _build_ip_udp_packet(payload: bytes, src_port: int = 12345) -> bytes:
     )
     udp_len = 8 + len(payload)
     udp_hdr = struct.pack("!HHHH", src_port, DST_PORT, udp_len, 0)
+    if udp_checksum:
+        pseudo = src + dst + struct.pack("!BBH", 0, 17, udp_len)
+        udp_hdr = udp_hdr[:6] + struct.pack("!H", checksum(pseudo + udp_hdr + payload))
     return ip_hdr + udp_hdr + payload
 
 
+def _noisy_capture(seed: int, count: int = 300) -> bytes:
+    """Mix of matching, filtered, checksummed and corrupted packets plus junk bytes."""
+    rng = random.Random(seed)
+    parts = []
+    for i in range(count):
+        payload = bytes(rng.randrange(256) for _ in range(rng.randrange(40)))
+        src_ip = SRC_IP if rng.random() < 0.8 else "10.9.9.9"
+        pkt = bytearray(_build_ip_udp_packet(payload, i, src_ip, udp_checksum=rng.random() < 0.7))
+        if rng.random() < 0.2:
+            pkt[rng.randrange(len(pkt))] ^= 1 << rng.randrange(8)
+        if rng.random() < 0.1:
+            pkt[:0] = bytes(rng.randrange(256) for _ in range(rng.randrange(1, 25)))
+        parts.append(bytes(pkt))
+    return b"".join(parts)
+
+
 def test_layer4_empty():
     """No valid packet -> empty output."""
     assert parse_packets(b"") == b""
@@ -58,6 +87,96 @@ def test_layer4_two_packets():
     assert out == a + b
 
 
+def test_layer4_udp_checksum_verified():
+    """Packets with a valid non-zero UDP checksum pass; a corrupted payload is dropped."""
+    good = _build_ip_udp_packet(b"odd", udp_checksum=True)
+    bad = bytearray(_build_ip_udp_packet(b"even", udp_checksum=True))
+    bad[-1] ^= 0xFF
+    assert parse_packets(good + bytes(bad)) == b"odd"
+
+
+def test_layer4_filters_source_ip():
+    """Packets from other source addresses are skipped."""
+    blob = _build_ip_udp_packet(b"no", src_ip="10.9.9.9") + _build_ip_udp_packet(b"yes")
+    assert parse_packets(blob) == b"yes"
+
+
+def test_layer4_matches_reference_on_noisy_capture():
+    """Zero-copy scanner matches the slicing reference, incl. resync after junk and corruption."""
+    for seed in range(5):
+        blob = _noisy_capture(seed)
+        assert parse_packets(blob) == parse_packets_reference(blob)
+
+
+def test_layer4_iter_packets_across_chunk_boundaries():
+    """Streaming with tiny reads yields the same payloads as parsing the whole blob."""
+    blob = _noisy_capture(7)
+    expected = parse_packets(blob)
+    for read_size in (1, 13, 100, 1 << 16):
+        packets = list(iter_packets(io.BytesIO(blob), read_size=read_size))
+        assert b"".join(bytes(p.payload) for p in packets) == expected
+        for p in packets:
+            assert blob[p.offset] >> 4 == 4
+
+
+def test_layer4_iter_packets_socket_like():
+    """Objects with recv() (sockets) are read the same way as files."""
+
+    class _FakeSocket:
+        def __init__(self, data):
+            self._stream = io.BytesIO(data)
+
+        def recv(self, size):
+            return self._stream.read(min(size, 7))
+
+    blob = _build_ip_udp_packet(b"over ") + _build_ip_udp_packet(b"socket")
+    payloads = [bytes(p.payload) for p in iter_packets(_FakeSocket(blob))]
+    assert payloads == [b"over ", b"socket"]
+
+
+def test_layer4_filter_cidr_and_port_range():
+    """PacketFilter accepts CIDR ranges, address sets and port ranges."""
+    blob = (
+        _build_ip_udp_packet(b"a", 1000, src_ip="10.1.1.10")
+        + _build_ip_udp_packet(b"b", 2000, src_ip="10.1.2.3")
+        + _build_ip_udp_packet(b"c", 3000, src_ip="192.168.0.1")
+    )
+    cidr = PacketFilter(src_ips=["10.1.0.0/16"])
+    assert [bytes(p.payload) for p in iter_packets(io.BytesIO(blob), filter=cidr)] == [b"a", b"b"]
+    ports = PacketFilter(src_ports=range(1500, 3500), dst_ports={DST_PORT})
+    assert parse_packets(blob, filter=ports) == b"bc"
+    exact = PacketFilter(src_ips={"10.1.1.10", "192.168.0.1"})
+    assert parse_packets(blob, filter=exact) == b"ac"
+
+
+def test_layer4_stats_counters():
+    """Skipped bytes and per-reason rejections are counted."""
+    good = _build_ip_udp_packet(b"ok")
+    corrupt = bytearray(_build_ip_udp_packet(b"bad", udp_checksum=True))
+    corrupt[-1] ^= 0xFF
+    bad_ip = bytearray(_build_ip_udp_packet(b"hdr"))
+    bad_ip[8] ^= 0x01  # TTL changes, header checksum no longer matches
+    blob = b"\x00" * 7 + good + bytes(corrupt) + _build_ip_udp_packet(b"x", src_ip="10.9.9.9") + bytes(bad_ip)
+    stats = ScanStats()
+    assert parse_packets(blob, stats=stats) == b"ok"
+    assert stats.packets == 1
+    assert stats.rejected["udp_checksum"] == 1
+    assert stats.rejected["filtered"] == 1
+    assert stats.rejected["ip_checksum"] == 1
+    # 7 junk bytes + the whole corrupt-header packet
+    assert stats.bytes_skipped == 7 + len(bad_ip)
+
+
+def test_layer4_resync_through_junk_matches_reference():
+    """Candidate-based resync over random junk gives the same result as byte-by-byte."""
+    rng = random.Random(11)
+    junk = bytes(rng.randrange(256) for _ in range(20000))
+    blob = junk + _noisy_capture(3, 50) + junk[:999]
+    stats = ScanStats()
+    assert parse_packets(blob, stats=stats) == parse_packets_reference(blob)
+    assert stats.bytes_skipped >= len(junk)
+
+
 if __name__ == "__main__":
     test_layer4_empty()
     test_layer4_single_packet()
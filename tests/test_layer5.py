@@ -3,17 +3,20 @@ Tests for layer 5 (RFC 3394 key unwrap + AES-256-CTR decryption).
 
 Compatible with older cryptography versions (Python 3.7).
 """
+import io
 import os
 import sys
 from pathlib import Path
 
+import pytest
+
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
 
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives.keywrap import aes_key_wrap
 
-from layers.layer5_aes_ctr import decrypt_aes_256
+from layers.layer5_aes_ctr import _decrypt_range, decrypt_aes_256, decrypt_aes_256_parallel, decrypt_aes_256_stream
 
 # RFC 3394 default IV used by aes_key_wrap
 _KEY_IV = b"\xA6" * 8
@@ -62,7 +65,54 @@ def test_layer5_empty_plaintext():
     assert out == plain
 
 
+def test_layer5_stream_matches_in_memory():
+    """Chunked streaming decrypt writes the same plaintext, for chunk sizes not aligned to 16."""
+    kek = os.urandom(32)
+    data_iv = os.urandom(16)
+    plain = os.urandom(10_000)
+    payload = _build_layer5_payload(plain, kek, data_iv)
+
+    for chunk_size in (1, 7, 16, 1000, 1 << 20):
+        dst = io.BytesIO()
+        written = decrypt_aes_256_stream(io.BytesIO(payload), dst, chunk_size=chunk_size)
+        assert written == len(plain)
+        assert dst.getvalue() == plain == decrypt_aes_256(payload)
+
+
+def test_layer5_stream_truncated_header():
+    """A payload shorter than the 96-byte header is rejected."""
+    with pytest.raises(ValueError):
+        decrypt_aes_256_stream(io.BytesIO(b"\x00" * 50), io.BytesIO())
+
+
+@pytest.mark.parametrize("chunk_size", [16, 33, 4096])
+def test_layer5_parallel_matches_serial(chunk_size):
+    """Counter-partitioned parallel decrypt is byte-identical, incl. counter wrap-around."""
+    kek = os.urandom(32)
+    plain = os.urandom(50_001)
+    for data_iv in (os.urandom(16), b"\xff" * 15 + b"\xf0"):
+        payload = _build_layer5_payload(plain, kek, data_iv)
+        out = decrypt_aes_256_parallel(payload, workers=4, chunk_size=chunk_size)
+        assert out == plain == decrypt_aes_256(payload)
+        assert type(out) is bytes
+
+
+@pytest.mark.parametrize("size", [0, 5, 16, 17, 4096])
+def test_layer5_decrypt_range_stays_in_its_slot(size):
+    """A range's output view is filled exactly; the bytes after it (the next slot) are untouched."""
+    key, src = os.urandom(32), os.urandom(size)
+    buf = bytearray(size) + b"\xaa" * 32
+    _decrypt_range(key, 7, memoryview(src), memoryview(buf)[:size])
+    cipher = Cipher(algorithms.AES(key), modes.CTR((7).to_bytes(16, "big")), backend=default_backend())
+    expected = cipher.decryptor().update(src)
+    assert buf == expected + b"\xaa" * 32
+
+
 if __name__ == "__main__":
     test_layer5_roundtrip()
     test_layer5_empty_plaintext()
+    test_layer5_stream_matches_in_memory()
+    test_layer5_stream_truncated_header()
+    test_layer5_parallel_matches_serial(4096)
+    test_layer5_decrypt_range_stays_in_its_slot(17)
     print("test_layer5 passed.")
@@ -1,21 +1,280 @@
 """
 Tests for layer 6 (Tomtel Core i69 VM) using the spec's "Hello, world!" example.
 """
+import io
+import multiprocessing
+import os
+import random
 import sys
 from pathlib import Path
 
+import pytest
+
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
 
 from helpers import HELLO_HEX, hex_to_bytes
-from layers.layer6_tomtel_vm import run_tomtel_vm
+from layers import layer6_tomtel_vm
+from layers.layer6_tomtel_vm import (
+    TomtelVM,
+    VMBudgetExceeded,
+    VMProfile,
+    VMState,
+    run_many,
+    run_tomtel_vm,
+    run_tomtel_vm_compiled,
+    run_tomtel_vm_reference,
+)
+
+
+def run_tomtel_vm_profiled(bytecode):
+    return run_tomtel_vm(bytecode, profile=VMProfile(), trace=4)
+
+
+def run_tomtel_vm_sliced(bytecode):
+    """Run in 3-instruction slices, round-tripping a snapshot between slices."""
+    vm = TomtelVM(bytecode)
+    while not vm.run(max_steps=3):
+        vm = TomtelVM.resume(vm.snapshot())
+    return vm.output
+
 
+ENGINES = [run_tomtel_vm, run_tomtel_vm_compiled, run_tomtel_vm_profiled, run_tomtel_vm_sliced]
 
-def test_layer6_hello_world():
+# prints 'A', patches the MVI immediate at address 3 to 'B' and loops once more;
+# a stale decoded MVI would print 'A' forever
+SELF_MODIFYING = bytes.fromhex(
+    "5803"        # 0:  MVI c, 3           (ptr + c) = 3
+    "4841"        # 2:  MVI a, 'A'         immediate at address 3
+    "02"          # 4:  OUT a
+    "5042"        # 5:  MVI b, 'B'
+    "c1"          # 7:  CMP                f = a != b
+    "7a"          # 8:  MV (ptr+c), b      mem[3] = 'B'
+    "2202000000"  # 9:  JNZ 2
+    "01"          # 14: HALT
+)
+
+
+@pytest.mark.parametrize("run", ENGINES)
+def test_layer6_hello_world(run):
     bytecode = hex_to_bytes(HELLO_HEX)
-    out = run_tomtel_vm(bytecode)
+    out = run(bytecode)
     assert out == b"Hello, world!", "expected b'Hello, world!', got {!r}".format(out)
 
 
+@pytest.mark.parametrize("run", ENGINES + [run_tomtel_vm_reference])
+def test_layer6_self_modifying_code(run):
+    assert run(SELF_MODIFYING) == b"AB"
+
+
+@pytest.mark.parametrize(
+    "bytecode",
+    [
+        b"",
+        bytes.fromhex("4841" "02"),                  # runs off the end
+        bytes.fromhex("4841" "02" "a8"),             # truncated MVI32
+        bytes.fromhex("4841" "b0ffffffff" "02"),     # jump past the end
+        bytes.fromhex("a808000000" "5001" "7a" "02" "02"),  # overwrites the next OUT with HALT
+        bytes.fromhex("a8ffffffff" "4f" "02" "5801" "4f" "02"),  # (ptr+c) out of bounds, then wrapped to 0
+    ],
+)
+def test_layer6_matches_reference_edge_cases(bytecode):
+    for run in ENGINES:
+        assert run(bytecode) == run_tomtel_vm_reference(bytecode)
+
+
+@pytest.mark.parametrize("run", ENGINES)
+def test_layer6_unknown_opcode(run):
+    with pytest.raises(RuntimeError, match=r"Unknown opcode 0xFF at pc=0x2"):
+        run(bytes.fromhex("4841ff"))
+
+
+def test_layer6_profile_counts():
+    profile = VMProfile()
+    assert run_tomtel_vm(SELF_MODIFYING, profile=profile) == b"AB"
+    # 7 instructions up to the first JNZ, then 7 from address 2 to HALT
+    assert profile.instructions == 14
+    assert sum(profile.opcodes.values()) == sum(profile.pcs.values()) == 14
+    assert profile.pcs[2] == 2 and profile.opcodes[0x02] == 2
+    assert profile.block_entries == {0: 1, 2: 1, 14: 1}
+    assert profile.hot_blocks(1) == [(0, 1, 7)]
+    assert "14 instructions" in profile.report()
+
+
+def test_layer6_trace_dumped_on_unknown_opcode():
+    with pytest.raises(RuntimeError) as excinfo:
+        run_tomtel_vm(bytes.fromhex("4841" "02" "a801000000" "ff"), trace=2)
+    message = str(excinfo.value)
+    assert message.startswith("Unknown opcode 0xFF at pc=0x8")
+    assert "last 2 instructions:" in message
+    assert "MVI32 ptr <- 0x1" in message and "OUT a" not in message
+
+
+def test_layer6_budget_stops_infinite_loop():
+    loop = bytes.fromhex("4841" "02" "b002000000")  # OUT a forever
+    with pytest.raises(VMBudgetExceeded) as excinfo:
+        run_tomtel_vm(loop, max_steps=100)
+    state = excinfo.value.state
+    assert state.steps == 100 and not state.finished
+    assert state.out == b"A" * 50
+    with pytest.raises(VMBudgetExceeded):
+        run_tomtel_vm(loop, timeout=0.05)
+
+
+def test_layer6_step_counts_are_exact():
+    bytecode = hex_to_bytes(HELLO_HEX)
+    profile = VMProfile()
+    run_tomtel_vm(bytecode, profile=profile)
+    for steps in (1, 2, 7, profile.instructions - 1):
+        vm = TomtelVM(bytecode)
+        assert not vm.run(max_steps=steps)
+        assert vm.state.steps == steps
+    vm = TomtelVM(bytecode)
+    assert vm.run(max_steps=profile.instructions)
+    assert vm.state.halted and vm.output == b"Hello, world!"
+
+
+def test_layer6_snapshot_round_trip():
+    vm = TomtelVM(hex_to_bytes(HELLO_HEX))
+    vm.run(max_steps=40)
+    state = VMState.from_bytes(vm.snapshot())
+    assert state.to_bytes() == vm.snapshot()
+    assert (state.mem, state.regs, state.pc, state.out, state.steps) == (
+        vm.state.mem, vm.state.regs, vm.state.pc, vm.state.out, vm.state.steps
+    )
+    with pytest.raises(ValueError):
+        VMState.from_bytes(b"XXXX" + vm.snapshot()[4:])
+    with pytest.raises(ValueError):
+        VMState.from_bytes(vm.snapshot()[:-1])
+
+
+# prints bytes 0x00..0xFF: OUT a; a += 1; loop while a != 0
+COUNT_256 = bytes.fromhex("5001" "02" "c2" "5000" "c1" "5001" "2202000000" "01")
+
+
+@pytest.mark.parametrize("run", [run_tomtel_vm, run_tomtel_vm_compiled, run_tomtel_vm_profiled])
+def test_layer6_output_sinks(run, monkeypatch):
+    """Output reaches a stream, a bytearray or a preallocated buffer in flushed chunks."""
+    monkeypatch.setattr(layer6_tomtel_vm, "_FLUSH_SIZE", 16)
+    expected = bytes(range(256))
+    run_with = (lambda b, out: run(b, out=out)) if run is not run_tomtel_vm_profiled else (
+        lambda b, out: run_tomtel_vm(b, profile=VMProfile(), out=out)
+    )
+
+    stream = io.BytesIO()
+    assert run_with(COUNT_256, stream) == 256 and stream.getvalue() == expected
+    grown = bytearray(b"prefix:")
+    assert run_with(COUNT_256, grown) == 256 and grown == b"prefix:" + expected
+    buf = bytearray(300)
+    assert run_with(COUNT_256, memoryview(buf)) == 256 and buf[:256] == expected
+    with pytest.raises(ValueError, match="output buffer"):
+        run_with(COUNT_256, memoryview(bytearray(100)))
+
+
+def test_layer6_tomtel_vm_sink_flushes_each_run():
+    stream = io.BytesIO()
+    vm = TomtelVM(COUNT_256, out=stream)
+    assert not vm.run(max_steps=100)
+    # MVI b, then 6 instructions per byte: the 17th OUT is step 98
+    assert vm.state.out == b"" and stream.getvalue() == bytes(range(17))
+    assert vm.run()
+    assert stream.getvalue() == bytes(range(256)) and vm.sink.written == 256
+
+
+def test_layer6_run_many_reports_errors_per_program(monkeypatch):
+    # send everything but the 3-byte program through shared memory
+    monkeypatch.setattr(layer6_tomtel_vm, "_SHM_THRESHOLD", 4)
+    programs = [
+        hex_to_bytes(HELLO_HEX),
+        bytes.fromhex("4841ff"),        # unknown opcode
+        bytes.fromhex("b000000000"),    # infinite loop, stopped by max_steps
+        SELF_MODIFYING,
+        bytes.fromhex("484102"),
+    ]
+    results = sorted(run_many(programs, workers=2, max_steps=10000))
+    assert [r.index for r in results] == [0, 1, 2, 3, 4]
+    assert results[0].output == b"Hello, world!" and results[0].error is None
+    assert results[1].output is None and results[1].error.startswith("RuntimeError: Unknown opcode 0xFF")
+    assert results[2].output is None and results[2].error.startswith("VMBudgetExceeded")
+    assert results[3].output == b"AB"
+    assert results[4].output == b"A"
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="workers must inherit the patched VM")
+def test_layer6_run_many_survives_a_crashed_worker(monkeypatch):
+    """A program that kills its worker fails alone; the others still run and report."""
+    run_vm = layer6_tomtel_vm.run_tomtel_vm
+
+    def crashing_vm(bytecode, **kwargs):
+        if bytecode == b"crash":
+            os._exit(1)
+        return run_vm(bytecode, **kwargs)
+
+    monkeypatch.setattr(layer6_tomtel_vm, "run_tomtel_vm", crashing_vm)
+    programs = [hex_to_bytes(HELLO_HEX)] * 24
+    programs[5] = b"crash"
+    results = sorted(run_many(programs, workers=2))
+    assert [r.index for r in results] == list(range(24))
+    assert results[5].output is None and results[5].error.startswith("BrokenProcessPool")
+    assert all(r.output == b"Hello, world!" and r.error is None for r in results if r.index != 5)
+
+
+def _random_program(rng: random.Random) -> bytes:
+    """
+    Random straight-line program with forward jumps and stores into its own
+    code; ptr points into the program so (ptr+c) reads and writes hit it.
+    """
+    code = bytearray()
+    for _ in range(rng.randint(1, 60)):
+        choice = rng.random()
+        if choice < 0.3:    # MV / MVI, incl. (ptr+c) and the no-op dest 0
+            dest, src = rng.randint(0, 7), rng.randint(0, 7)
+            code.append(0x40 | dest << 3 | src)
+            if src == 0:
+                code.append(rng.randrange(256))
+        elif choice < 0.45:  # MV32 / MVI32 (never to pc: jumps are added below)
+            dest, src = rng.choice([0, 1, 2, 3, 4, 5, 7]), rng.randint(0, 7)
+            code.append(0x80 | dest << 3 | src)
+            if src == 0:
+                code += rng.randrange(96).to_bytes(4, "little")
+        elif choice < 0.75:
+            code.append(rng.choice([0x02, 0xC1, 0xC2, 0xC3, 0xC4]))
+        elif choice < 0.85:
+            code += bytes([0xE1, rng.randrange(8)])
+        elif choice < 0.97:  # JEZ / JNZ / MVI32 pc, forward only (maybe past the end)
+            code.append(rng.choice([0x21, 0x22, 0xB0]))
+            code += (len(code) + 4 + rng.randint(0, 12)).to_bytes(4, "little")
+        else:               # HALT or an unknown opcode
+            code.append(rng.choice([0x01, 0x00, 0xFF]))
+    return bytes(code)
+
+
+def _outcome(run, bytecode):
+    try:
+        return run(bytecode)
+    except RuntimeError as exc:
+        # first line only: a trace may follow
+        return str(exc).splitlines()[0]
+
+
+def test_layer6_compiled_fuzz_matches_reference():
+    rng = random.Random(69)
+    for _ in range(300):
+        bytecode = _random_program(rng)
+        expected = _outcome(run_tomtel_vm_reference, bytecode)
+        for run in ENGINES:
+            assert _outcome(run, bytecode) == expected, bytecode.hex()
+
+
 if __name__ == "__main__":
-    test_layer6_hello_world()
+    for engine in ENGINES:
+        test_layer6_hello_world(engine)
+        test_layer6_self_modifying_code(engine)
+        test_layer6_unknown_opcode(engine)
+    test_layer6_profile_counts()
+    test_layer6_budget_stops_infinite_loop()
+    test_layer6_step_counts_are_exact()
+    test_layer6_snapshot_round_trip()
+    test_layer6_tomtel_vm_sink_flushes_each_run()
+    test_layer6_trace_dumped_on_unknown_opcode()
+    test_layer6_compiled_fuzz_matches_reference()
     print("test_layer6 passed.")
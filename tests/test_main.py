@@ -6,11 +6,15 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
 
+import tempfile
 import unittest
+from contextlib import redirect_stdout
 from io import StringIO
 from unittest.mock import patch
 
+from cache import ResultCache
 from main import main
+from orchestrator import run_pipeline
 
 
 class TestMain(unittest.TestCase):
@@ -45,6 +49,17 @@ class TestMain(unittest.TestCase):
         self.assertIn("Running pipeline...", out)
         self.assertIn("Congratulations! All layers complete. Watch out for drop bears.", out)
 
+    @patch("main.run_pipeline")
+    def test_main_cache_is_opt_in(self, mock_run_pipeline):
+        """Without cache=True nothing is cached; with it, results go to data/cache."""
+        with redirect_stdout(StringIO()):
+            main(clear=False)
+        self.assertIsNone(mock_run_pipeline.call_args.kwargs["cache"])
+        with tempfile.TemporaryDirectory() as tmp, patch("main.CACHE_DIR", Path(tmp)):
+            with redirect_stdout(StringIO()):
+                main(clear=False, cache=True)
+            self.assertEqual(mock_run_pipeline.call_args.kwargs["cache"].directory, Path(tmp))
+
     @patch("main.run_pipeline")
     @patch("sys.exit")
     def test_main_handles_exception(self, mock_exit, mock_run_pipeline):
@@ -68,5 +83,30 @@ class TestMain(unittest.TestCase):
         mock_exit.assert_called_once_with(1)
 
 
+class TestRunPipeline(unittest.TestCase):
+    def _run(self, **kwargs):
+        """Run the real pipeline into a temp output dir; return {file name: bytes}."""
+        with tempfile.TemporaryDirectory() as tmp, patch("orchestrator.OUTPUT_DIR", Path(tmp)):
+            with redirect_stdout(StringIO()):
+                run_pipeline(**kwargs)
+            return {p.name: p.read_bytes() for p in Path(tmp).iterdir()}
+
+    def test_in_memory_matches_file_mode(self):
+        """In-memory chaining writes only the final output, unless intermediates are kept."""
+        files = self._run()
+        self.assertEqual(len(files), 7)
+        self.assertEqual(self._run(in_memory=True), {"layer6_output.txt": files["layer6_output.txt"]})
+        self.assertEqual(self._run(in_memory=True, keep_intermediates=True), files)
+
+    def test_cached_run_matches(self):
+        """A second run with the same cache skips every stage and gives the same files."""
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResultCache(Path(tmp))
+            files = self._run(cache=cache)
+            self.assertEqual((cache.hits, cache.misses), (0, 7))
+            self.assertEqual(self._run(cache=cache), files)
+            self.assertEqual((cache.hits, cache.misses), (7, 7))
+
+
 if __name__ == "__main__":
     unittest.main()
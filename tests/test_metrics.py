@@ -0,0 +1,108 @@
+"""
+Tests for per-stage metrics and their JSON lines / Prometheus output.
+"""
+import io
+import json
+import sys
+from contextlib import redirect_stdout
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import pytest
+
+from cache import ResultCache
+from metrics import StageMetrics, StageTimer, format_prometheus, write_metrics
+from orchestrator import run_pipeline
+from stages import STAGES
+
+
+def _run(tmp_path, **kwargs):
+    metrics = []
+    with redirect_stdout(io.StringIO()):
+        timings = run_pipeline(output_dir=tmp_path, metrics=metrics, **kwargs)
+    return timings, metrics
+
+
+def test_run_pipeline_records_metrics(tmp_path):
+    """One record per stage with times, byte counts and peak memory; cache hits are marked."""
+    timings, metrics = _run(tmp_path)
+    assert [m.stage for m in metrics] == [stage.name for stage in STAGES]
+    for m in metrics:
+        assert m.engine == "fast" and not m.cached
+        assert m.wall_s == timings[m.stage] and m.cpu_s >= 0
+        assert m.bytes_in > 0 and m.bytes_out > 0 and m.mb_per_s > 0
+        if sys.platform != "win32":
+            assert m.peak_rss_bytes > 0
+        assert m.alloc_peak_bytes is None  # tracemalloc is not tracing
+    assert metrics[-1].bytes_out == (tmp_path / "layer6_output.txt").stat().st_size
+
+    cache = ResultCache(tmp_path / "cache")
+    _run(tmp_path, cache=cache, engines={"layer2": "reference"})
+    _, again = _run(tmp_path, cache=cache, engines={"layer2": "reference"})
+    assert all(m.cached for m in again)
+    assert again[2].engine == "reference"
+    assert [m.bytes_out for m in again] == [m.bytes_out for m in metrics]
+
+
+def test_write_metrics(tmp_path):
+    _, metrics = _run(tmp_path, stages=["layer0", "layer1"])
+    metrics[1].input = 'odd "name"\\.txt'
+
+    out = tmp_path / "metrics.jsonl"
+    write_metrics(metrics, out)
+    write_metrics(metrics[:1], out)  # appends
+    lines = [json.loads(line) for line in out.read_text().splitlines()]
+    assert [line["stage"] for line in lines] == ["layer0", "layer1", "layer0"]
+    assert lines[1]["bytes_in"] == metrics[1].bytes_in and "mb_per_s" in lines[1]
+
+    prom = tmp_path / "metrics.prom"
+    write_metrics(metrics, prom)
+    text = prom.read_text()
+    assert text == format_prometheus(metrics)
+    assert "# TYPE onion_stage_wall_seconds gauge" in text
+    assert 'onion_stage_input_bytes{{stage="layer0",engine="fast"}} {}'.format(float(metrics[0].bytes_in)) in text
+    assert r'input="odd \"name\"\\.txt"' in text
+    assert "onion_stage_alloc_peak_bytes" not in text  # no values to report
+
+    with pytest.raises(ValueError):
+        write_metrics(metrics, out, "csv")
+
+
+def test_stage_timer_counts_worker_threads():
+    """Process CPU by default, so an engine's own threads count; thread_time leaves them out."""
+    import threading
+    import time
+
+    def spin():
+        end = time.thread_time() + 0.2
+        while time.thread_time() < end:
+            pass
+
+    for clock, counted in ((time.process_time, True), (time.thread_time, False)):
+        record = StageMetrics(STAGES[5], "parallel")
+        with StageTimer(record, clock):
+            worker = threading.Thread(target=spin)
+            worker.start()
+            worker.join()
+        assert (record.cpu_s >= 0.15) == counted
+
+
+def test_stage_metrics_pickles():
+    import pickle
+
+    record = StageMetrics(STAGES[3], "reference", "a.txt")
+    record.bytes_in, record.wall_s = 2_000_000, 0.5
+    copy = pickle.loads(pickle.dumps(record))
+    assert copy.to_dict() == record.to_dict() and copy.mb_per_s == 4.0
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    for test in (test_run_pipeline_records_metrics, test_write_metrics):
+        with tempfile.TemporaryDirectory() as tmp:
+            test(Path(tmp))
+    test_stage_timer_counts_worker_threads()
+    test_stage_metrics_pickles()
+    print("test_metrics passed.")
@@ -0,0 +1,181 @@
+"""
+Tests for the asyncio decode service, through a loopback HTTP client.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from constants import INPUT_DIR
+from layers.layer6_tomtel_vm import VMBudgetExceeded
+from orchestrator import decode_document
+from service import DecodeService
+
+_DOCUMENT = (INPUT_DIR / "layer0_ascii85.txt").read_bytes()
+
+
+async def _request(reader, writer, method, target, body=b""):
+    """Send one keep-alive request; return (status, body)."""
+    head = "{} {} HTTP/1.1\r\nHost: test\r\nContent-Length: {}\r\n\r\n".format(method, target, len(body))
+    writer.write(head.encode("ascii") + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line == b"\r\n":
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.lower()] = value.strip()
+    return status, await reader.readexactly(int(headers["content-length"]))
+
+
+async def _exercise(connect):
+    reader, writer = await connect()
+    try:
+        assert await _request(reader, writer, "GET", "/health") == (200, b"ok")
+        # several requests on one connection, and some in parallel on others
+        status, final = await _request(reader, writer, "POST", "/decode", _DOCUMENT)
+        assert status == 200 and final == bytes(decode_document(_DOCUMENT))
+        status, layer2 = await _request(reader, writer, "POST", "/decode?layer=2", _DOCUMENT)
+        assert status == 200 and layer2 == bytes(decode_document(_DOCUMENT, 2))
+        status, message = await _request(reader, writer, "POST", "/decode", b"<~ not an onion")
+        assert status == 422 and b"Step 1 (Process layer 0) failed" in message
+        assert (await _request(reader, writer, "POST", "/decode?layer=7", _DOCUMENT))[0] == 422
+        assert (await _request(reader, writer, "GET", "/decode"))[0] == 405
+        assert (await _request(reader, writer, "GET", "/nope"))[0] == 404
+    finally:
+        writer.close()
+
+    async def one():
+        r, w = await connect()
+        try:
+            return await _request(r, w, "POST", "/decode", _DOCUMENT)
+        finally:
+            w.close()
+
+    assert set(await asyncio.gather(*(one() for _ in range(4)))) == {(200, final)}
+
+
+def test_service_over_tcp():
+    async def run():
+        service = DecodeService(workers=1, max_concurrent=2)
+        await service.start(port=0)
+        try:
+            host, port = service.addresses[0][:2]
+            await _exercise(lambda: asyncio.open_connection(host, port))
+        finally:
+            await service.close()
+
+    asyncio.run(run())
+
+
+def test_decode_document_vm_budget():
+    """A step budget or timeout stops layer 6; a generous one changes nothing."""
+    with pytest.raises(RuntimeError, match="Step 7 ") as info:
+        decode_document(_DOCUMENT, max_steps=1000)
+    assert isinstance(info.value.__cause__, VMBudgetExceeded)
+    with pytest.raises(RuntimeError):
+        decode_document(_DOCUMENT, timeout=0)
+    assert decode_document(_DOCUMENT, max_steps=10**7, timeout=60) == decode_document(_DOCUMENT)
+
+
+def test_service_budget_and_dead_worker():
+    """Overrunning the VM budget is the document's fault (422); a dead worker is not (503, then recovered)."""
+
+    async def run():
+        service = DecodeService(workers=1, warm_up=False, max_steps=1000)
+        await service.start(port=0)
+        try:
+            host, port = service.addresses[0][:2]
+            reader, writer = await asyncio.open_connection(host, port)
+            status, message = await _request(reader, writer, "POST", "/decode", _DOCUMENT)
+            assert status == 422 and b"Step 7 (Process layer 6) failed" in message
+            assert (await _request(reader, writer, "POST", "/decode?layer=5", _DOCUMENT))[0] == 200
+
+            with pytest.raises(BrokenProcessPool):
+                service._pool.submit(os._exit, 1).result()
+            assert await _request(reader, writer, "POST", "/decode?layer=5", _DOCUMENT) == (
+                503,
+                b"A decoding worker died; retry the request",
+            )
+            assert (await _request(reader, writer, "POST", "/decode?layer=5", _DOCUMENT))[0] == 200
+            writer.close()
+        finally:
+            await service.close()
+
+    asyncio.run(run())
+
+
+def test_service_rejects_oversized_heads():
+    """Over-long request or header lines and too many headers get 400/431 and a closed connection."""
+    heads = [
+        (b"GET /" + b"x" * (70 << 10) + b" HTTP/1.1\r\n\r\n", 400),
+        (b"GET /health HTTP/1.1\r\nX-Big: " + b"x" * (70 << 10) + b"\r\n\r\n", 431),
+        (b"GET /health HTTP/1.1\r\n" + b"X-Many: 1\r\n" * 101 + b"\r\n", 431),
+    ]
+
+    async def run():
+        service = DecodeService(workers=1, warm_up=False)
+        await service.start(port=0)
+        try:
+            host, port = service.addresses[0][:2]
+            for head, status in heads:
+                reader, writer = await asyncio.open_connection(host, port)
+                writer.write(head)
+                await writer.drain()
+                response = await reader.read()  # until the service closes the connection
+                assert response.startswith("HTTP/1.1 {} ".format(status).encode())
+                assert b"Connection: close" in response
+                writer.close()
+            reader, writer = await asyncio.open_connection(host, port)
+            many = "".join("X-{}: 1\r\n".format(i) for i in range(100))
+            writer.write("GET /health HTTP/1.1\r\n{}\r\n".format(many).encode())
+            assert (await reader.readline()).startswith(b"HTTP/1.1 200 ")
+            writer.close()
+        finally:
+            await service.close()
+
+    asyncio.run(run())
+
+
+def test_service_layer6_engine_needs_no_budget():
+    with pytest.raises(ValueError):
+        DecodeService(workers=1, warm_up=False, engines={"layer6": "reference"})
+    service = DecodeService(
+        workers=1, warm_up=False, engines={"layer6": "reference"}, max_steps=None, vm_timeout=None
+    )
+    asyncio.run(service.close())
+
+
+@pytest.mark.skipif(not hasattr(asyncio, "start_unix_server"), reason="no Unix sockets")
+def test_service_over_unix_socket():
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "onion.sock")
+            service = DecodeService(workers=1, warm_up=False)
+            await service.start(unix_path=path)
+            try:
+                reader, writer = await asyncio.open_unix_connection(path)
+                assert await _request(reader, writer, "GET", "/health") == (200, b"ok")
+                writer.close()
+            finally:
+                await service.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_service_over_tcp()
+    test_decode_document_vm_budget()
+    test_service_budget_and_dead_worker()
+    test_service_rejects_oversized_heads()
+    test_service_layer6_engine_needs_no_budget()
+    test_service_over_unix_socket()
+    print("test_service passed.")
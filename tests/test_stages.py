@@ -0,0 +1,58 @@
+"""
+Tests for the stage registry (engine selection, every engine of every stage).
+"""
+import sys
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from constants import INPUT_DIR
+from orchestrator import MemoryLayerIO
+from stages import STAGES, get_stages, select_engines
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def test_registry_order():
+    assert [stage.name for stage in STAGES] == ["layer{}".format(i) for i in range(7)]
+    assert all(stage.default in stage.engines for stage in STAGES)
+    assert [stage.name for stage in get_stages(["layer5", "layer6"])] == ["layer5", "layer6"]
+
+
+def test_select_engines():
+    assert select_engines(None) == {}
+    assert select_engines(["layer2=numpy", "layer6=compiled"]) == {"layer2": "numpy", "layer6": "compiled"}
+    for spec in ("layer2", "layer9=fast", "layer2=turbo"):
+        with pytest.raises(ValueError):
+            select_engines([spec])
+    with pytest.raises(ValueError):
+        get_stages(["layer0", "nope"])
+
+
+def test_every_engine_matches_default():
+    """Each stage's engines give the default engine's output for the real layer input."""
+    layer_io = MemoryLayerIO((INPUT_DIR / "layer0_ascii85.txt").read_bytes())
+    with redirect_stdout(StringIO()):
+        for stage in STAGES:
+            data = stage.decode_input(stage.read(layer_io))
+            expected = bytes(stage.engines[stage.default](data))
+            for name, engine in stage.engines.items():
+                if name == "numpy" and numpy is None:
+                    continue
+                assert bytes(engine(data)) == expected, (stage.name, name)
+            stage.sink(layer_io, stage.layer_num, expected)
+    assert len(layer_io.outputs) == 7
+
+
+if __name__ == "__main__":
+    test_registry_order()
+    test_select_engines()
+    test_every_engine_matches_default()
+    print("test_stages passed.")